@@ -47,14 +47,14 @@ class TeacherAdmin(admin.ModelAdmin):
 
 @admin.register(Subject)
 class SubjectAdmin(admin.ModelAdmin):
-    list_display = ('name', 'teacher')
+    list_display = ('name', 'teacher', 'deck_count')
     search_fields = ('name', 'teacher__name')
     list_filter = ('teacher',)
 
 
 @admin.register(Deck)
 class DeckAdmin(admin.ModelAdmin):
-    list_display = ('title', 'subject', 'teacher', 'is_public', 'created_at')
+    list_display = ('title', 'subject', 'teacher', 'card_count', 'is_public', 'created_at')
     search_fields = ('title', 'slug', 'teacher__name')
     list_filter = ('is_public', 'subject', 'teacher')
     readonly_fields = ('slug', 'created_at', 'updated_at')
@@ -0,0 +1,17 @@
+"""
+The API's URLs under ASGI (flashcards.asgi): those of api.urls, with the
+async views of api.async_views ahead of the DRF views they stand in for.
+"""
+from django.urls import path
+
+from . import async_views
+from .urls import urlpatterns as drf_urlpatterns
+
+urlpatterns = [
+    # The async list falls back to the router's view for writes and pages
+    path('decks/', async_views.deck_list, name='deck-list'),
+    path('auth/me/', async_views.get_current_teacher, name='current-teacher'),
+    path('study/<slug:slug>/', async_views.public_deck, name='public-deck'),
+    path('study/<slug:slug>/changes/', async_views.public_deck_changes, name='public-deck-changes'),
+    *drf_urlpatterns,
+]
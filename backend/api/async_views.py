@@ -0,0 +1,144 @@
+"""
+Async versions of the hottest read endpoints, for ASGI deployments.
+
+Under gunicorn's sync workers every request holds a worker until the last
+byte has gone out, so a handful of slow clients on /api/study/<slug>/ can
+tie up all of them. Under uvicorn workers (flashcards.asgi) these views
+run on the event loop instead: waiting on a client costs nothing, and the
+database and cache calls go through Django's async ORM and cache APIs.
+
+DRF views are sync only, so these are plain Django views that mirror the
+DRF ones in views.py: the same payloads, ETags, status codes and anonymous
+rate limit. Anything they do not cover (writes, paginated listings) is
+handed to the DRF view in a thread. Only flashcards.asgi routes to them
+(api.async_urls); under WSGI the DRF views serve these endpoints, without
+an event loop per request.
+
+The anonymous rate limit's bucket store is a blocking SQLite database, so
+the throttle check runs in the sync thread rather than on the event loop.
+"""
+from asgiref.sync import sync_to_async
+from django.db.models import aprefetch_related_objects
+from django.http import Http404, HttpResponse
+from django.middleware.csrf import get_token
+from django.shortcuts import aget_object_or_404
+from django.utils.cache import get_conditional_response
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_safe
+from rest_framework.renderers import JSONRenderer
+
+from .cache import aget_cached_teacher, aget_public_deck_payload, arender_public_deck_payload, deck_etag
+from .models import Deck
+from .pagination import DeckPagination
+from .routers import read_from_replica
+from .serializers import DeckListSerializer, DeckSerializer, TeacherSerializer
+from .throttling import AnonRateThrottle
+from .views import DeckViewSet, set_deck_validators
+from . import sync
+
+_deck_viewset = DeckViewSet.as_view({'get': 'list', 'post': 'create'})
+
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+
+
+async def throttled(request):
+    """The 429 response DRF's anonymous throttle would send, or None if allowed"""
+    if await request.session.aget('teacher_id'):
+        return None
+    request.user = await request.auser()
+    throttle = AnonRateThrottle()
+    if await sync_to_async(throttle.allow_request)(request, None):
+        return None
+    wait = throttle.wait()
+    response = json_response(
+        {'detail': f'Request was throttled. Expected available in {int(wait) + 1} seconds.'},
+        status=429,
+    )
+    response['Retry-After'] = str(int(wait) + 1)
+    return response
+
+
+@require_safe
+async def get_current_teacher(request):
+    """Get currently logged in teacher"""
+    # Ensure CSRF cookie is set
+    get_token(request)
+
+    teacher_id = await request.session.aget('teacher_id')
+    teacher = await aget_cached_teacher(teacher_id) if teacher_id else None
+    if teacher:
+        return json_response(TeacherSerializer(teacher).data)
+    return await throttled(request) or json_response({'error': 'Not authenticated'}, status=401)
+
+
+@csrf_exempt  # like every DRF view; DRF enforces CSRF for signed-in teachers itself
+async def deck_list(request):
+    """List the teacher's decks; creates and paginated listings go to DeckViewSet"""
+    params = request.GET
+    if (
+        request.method != 'GET'
+        or DeckPagination.cursor_query_param in params
+        or DeckPagination.page_size_query_param in params
+    ):
+        return await sync_to_async(_deck_viewset)(request)
+
+    teacher_id = await request.session.aget('teacher_id')
+    if not teacher_id:
+        return await throttled(request) or json_response([])
+    # card_count is a column, so listing needs no join against cards
+    decks = [deck async for deck in Deck.objects.filter(teacher_id=teacher_id).select_related('subject')]
+    return json_response(DeckListSerializer(decks, many=True).data)
+
+
+@require_safe
+@read_from_replica
+async def public_deck(request, slug):
+    """Get a public deck by slug (no auth required)"""
+    response = await throttled(request)
+    if response is not None:
+        return response
+
+    cached = await aget_public_deck_payload(slug)
+    if cached is not None:
+        etag, payload = cached
+        response = get_conditional_response(request, etag=etag)
+    else:
+        try:
+            deck = await aget_object_or_404(
+                Deck.objects.select_related('subject', 'teacher'),
+                slug=slug, is_public=True
+            )
+        except Http404 as error:
+            return json_response({'detail': str(error)}, status=404)
+        etag = deck_etag(deck)
+        # Answer revalidations before the cards are loaded
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            await aprefetch_related_objects([deck], 'cards')
+            etag, payload = await arender_public_deck_payload(deck, DeckSerializer(deck).data)
+    if response is None:
+        response = HttpResponse(payload, content_type='application/json')
+    return set_deck_validators(response, etag)
+
+
+@require_safe
+@read_from_replica
+async def public_deck_changes(request, slug):
+    """Card changes to a public deck since the version in ?since= (see api.sync)"""
+    response = await throttled(request)
+    if response is not None:
+        return response
+
+    since = sync.parse_since(request.GET.get('since'))
+    if since is None:
+        return json_response({'since': 'Must be a deck version'}, status=400)
+    try:
+        deck = await aget_object_or_404(
+            Deck.objects.select_related('subject', 'teacher'),
+            slug=slug, is_public=True
+        )
+    except Http404 as error:
+        return json_response({'detail': str(error)}, status=404)
+    return json_response(await sync_to_async(sync.changes)(deck, since))
@@ -0,0 +1,35 @@
+"""
+DRF authentication for teachers.
+
+Teachers sign in with their own accounts (not django.contrib.auth users),
+and the session holds their id. TeacherAuthentication turns that id into
+the Teacher once per request, from the cache in api.cache, and makes it
+both request.user and request.teacher, so views and serializers never look
+the teacher up again. Requests without a teacher fall through to DRF's
+SessionAuthentication, which still signs in Django admin users.
+
+Like SessionAuthentication it enforces CSRF on unsafe methods, but checks
+the token against the Django request: its POST only parses form bodies, so
+raw bodies stay unread for views that stream them (card imports).
+"""
+from rest_framework.authentication import SessionAuthentication
+
+from .cache import get_cached_teacher
+
+
+class TeacherAuthentication(SessionAuthentication):
+    def authenticate(self, request):
+        teacher_id = request._request.session.get('teacher_id')
+        if not teacher_id:
+            return None
+        teacher = get_cached_teacher(teacher_id)
+        if teacher is None:
+            return None
+        self.enforce_csrf(request)
+        request.teacher = teacher
+        return (teacher, None)
+
+    def enforce_csrf(self, request):
+        # The DRF request's POST would parse the whole body, and reject raw
+        # content types the view's parsers do not know, before the view runs
+        return super().enforce_csrf(request._request)
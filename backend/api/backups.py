@@ -0,0 +1,406 @@
+"""
+SQLite backup helpers used by the backup_db management command.
+
+Snapshots are taken with SQLite's online backup API on a separate
+connection, a few pages per step with a pause in between, so gunicorn
+workers keep writing while a backup runs and the copy is always a
+consistent database rather than a file caught mid-write.
+
+Incremental backups store only the pages that changed since the previous
+backup. Every backup has a ``.pages`` manifest next to it holding one digest
+per database page; an incremental run snapshots the database, compares the
+snapshot's pages with the latest manifest and writes the changed pages to a
+``.delta`` file (gzip) that names the backup it applies on top of.
+Restoring a delta replays the chain from the last full backup.
+
+The portable JSON backup is JSON lines in Django's jsonl serialization
+format (one {"model", "pk", "fields"} object per row, so ``loaddata`` can
+read it too). export_jsonl streams every api model in dependency order,
+reading each in primary-key order with a chunked iterator; restore_jsonl
+replays it with batched multi-row inserts, parents before children, in one
+transaction with the DELETE of the old rows, so a bad line or a failed
+insert leaves the database as it was; once it commits, the cache is
+cleared, because restored decks go back to earlier versions and cached
+payloads keyed by deck id and version would no longer match them. Both
+run in memory bounded by JSONL_BATCH_SIZE. copy_database does the same,
+cache clearing included, straight from another database connection, which
+is how an existing db.sqlite3 moves to PostgreSQL.
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import shutil
+import sqlite3
+import struct
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+DEFAULT_STEP_PAGES = 1024
+DEFAULT_STEP_SLEEP = 0.01  # seconds between steps, so writers get the lock
+
+JSONL_BATCH_SIZE = 2000
+
+DIGEST_SIZE = 16
+DELTA_MAGIC = b'FCDELTA1\n'
+_PAGE_NUMBER = struct.Struct('>I')
+END_OF_PAGES = 0xFFFFFFFF
+
+
+def online_backup(source, target, step_pages=DEFAULT_STEP_PAGES, step_sleep=DEFAULT_STEP_SLEEP):
+    """
+    Copy the database at source into target with the online backup API.
+    Returns {'pages', 'steps', 'seconds'}.
+    """
+    stats = {'pages': 0, 'steps': 0}
+
+    def progress(status, remaining, total):
+        stats['pages'] = total
+        stats['steps'] += 1
+        if remaining and step_sleep:
+            time.sleep(step_sleep)
+
+    start = time.perf_counter()
+    source_db = sqlite3.connect(str(source))
+    target_db = sqlite3.connect(str(target))
+    try:
+        source_db.backup(target_db, pages=step_pages, progress=progress)
+    finally:
+        target_db.close()
+        source_db.close()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def integrity_check(path):
+    """Problems reported by PRAGMA integrity_check; empty when the database is sound"""
+    db = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = [row[0] for row in db.execute('PRAGMA integrity_check')]
+    finally:
+        db.close()
+    return [] if rows == ['ok'] else rows
+
+
+def compress(path):
+    """Gzip path to path.gz, remove the original and return the new path"""
+    target = Path(f'{path}.gz')
+    with open(path, 'rb') as source, gzip.open(target, 'wb', compresslevel=6) as out:
+        shutil.copyfileobj(source, out, 1024 * 1024)
+    Path(path).unlink()
+    return target
+
+
+def decompress(path, target):
+    with gzip.open(path, 'rb') as source, open(target, 'wb') as out:
+        shutil.copyfileobj(source, out, 1024 * 1024)
+    return Path(target)
+
+
+def page_size(path):
+    """Page size from the SQLite file header"""
+    with open(path, 'rb') as db:
+        size = struct.unpack('>H', db.read(18)[16:18])[0]
+    return 65536 if size == 1 else size
+
+
+def _pages(path, size):
+    with open(path, 'rb') as db:
+        yield from iter(lambda: db.read(size), b'')
+
+
+def _digest(page):
+    return hashlib.blake2b(page, digest_size=DIGEST_SIZE).digest()
+
+
+def manifest_path(backup_path):
+    """The .pages manifest stored alongside a backup"""
+    name = Path(backup_path).name.split('.')[0]
+    return Path(backup_path).with_name(f'{name}.pages')
+
+
+def write_manifest(database, target):
+    """Write the page digests of an uncompressed database file to target"""
+    with open(target, 'wb') as out:
+        for page in _pages(database, page_size(database)):
+            out.write(_digest(page))
+
+
+def write_delta(snapshot, base_backup, target):
+    """
+    Write the pages of snapshot that differ from base_backup's manifest to
+    target and refresh target's manifest. Returns (changed pages, total pages).
+    """
+    size = page_size(snapshot)
+    base_manifest = manifest_path(base_backup).read_bytes()
+    changed = total = 0
+    with gzip.open(target, 'wb', compresslevel=6) as delta, open(manifest_path(target), 'wb') as manifest:
+        header = {'base': Path(base_backup).name, 'page_size': size}
+        delta.write(DELTA_MAGIC + json.dumps(header).encode() + b'\n')
+        for number, page in enumerate(_pages(snapshot, size)):
+            digest = _digest(page)
+            manifest.write(digest)
+            if base_manifest[number * DIGEST_SIZE:(number + 1) * DIGEST_SIZE] != digest:
+                delta.write(_PAGE_NUMBER.pack(number) + page)
+                changed += 1
+            total += 1
+        # End marker and page count, to truncate a database that shrank
+        delta.write(_PAGE_NUMBER.pack(END_OF_PAGES) + _PAGE_NUMBER.pack(total))
+    return changed, total
+
+
+def read_delta_header(path):
+    with gzip.open(path, 'rb') as delta:
+        if delta.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+            raise ValueError(f'{Path(path).name} is not a delta backup')
+        return json.loads(delta.readline())
+
+
+def apply_delta(database, delta_path):
+    """Write a delta's pages into an uncompressed database file in place"""
+    with gzip.open(delta_path, 'rb') as delta, open(database, 'r+b') as db:
+        if delta.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+            raise ValueError(f'{Path(delta_path).name} is not a delta backup')
+        size = json.loads(delta.readline())['page_size']
+        while True:
+            number = _PAGE_NUMBER.unpack(delta.read(_PAGE_NUMBER.size))[0]
+            if number == END_OF_PAGES:
+                db.truncate(_PAGE_NUMBER.unpack(delta.read(_PAGE_NUMBER.size))[0] * size)
+                return
+            db.seek(number * size)
+            db.write(delta.read(size))
+
+
+def delta_chain(delta_path):
+    """[full backup, delta, ..., delta_path] needed to rebuild a delta backup"""
+    chain = [Path(delta_path)]
+    while chain[0].name.endswith('.delta'):
+        base = chain[0].with_name(read_delta_header(chain[0])['base'])
+        if not base.exists():
+            raise FileNotFoundError(f'Missing base backup {base.name} for {chain[0].name}')
+        chain.insert(0, base)
+    return chain
+
+
+def materialize(backup_path, target):
+    """Rebuild a plain database file at target from a full, compressed or delta backup"""
+    chain = delta_chain(backup_path)
+    if chain[0].suffix == '.gz':
+        decompress(chain[0], target)
+    else:
+        shutil.copyfile(chain[0], target)
+    for delta in chain[1:]:
+        apply_delta(target, delta)
+    return Path(target)
+
+
+class _Encoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder keeping microseconds, so restored timestamps are exact"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _open_text(path, mode):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=6)
+    return open(path, mode, encoding='utf-8')
+
+
+def api_models():
+    """Models of the api app, every model after the models its foreign keys reference"""
+    remaining = list(apps.get_app_config('api').get_models())
+    ordered = []
+    while remaining:
+        for model in remaining:
+            parents = {
+                field.related_model for field in model._meta.concrete_fields
+                if field.is_relation and field.related_model is not model
+            }
+            if not parents & set(remaining):
+                ordered.append(model)
+                remaining.remove(model)
+                break
+        else:
+            raise ValueError(f'Circular foreign keys between {remaining}')
+    return ordered
+
+
+def _data_fields(model):
+    return [field for field in model._meta.concrete_fields if not field.primary_key]
+
+
+@contextmanager
+def read_transaction():
+    """
+    A transaction for consistent reads. On SQLite it is started DEFERRED even
+    when the connection uses BEGIN IMMEDIATE (settings_prod), so a long export
+    holds a read snapshot rather than the write lock.
+    """
+    mode = getattr(connection, 'transaction_mode', None)
+    if connection.vendor == 'sqlite':
+        connection.ensure_connection()
+        connection.transaction_mode = None
+    try:
+        with transaction.atomic():
+            if connection.vendor == 'sqlite':
+                connection.transaction_mode = mode
+            yield
+    finally:
+        if connection.vendor == 'sqlite':
+            connection.transaction_mode = mode
+
+
+def export_jsonl(target, batch_size=JSONL_BATCH_SIZE):
+    """
+    Stream every api row to target (gzipped when it ends in .gz) from one
+    read transaction, so the rows are a consistent snapshot.
+    Returns {model label: rows written}.
+    """
+    encoder = _Encoder(ensure_ascii=False)
+    counts = {}
+    with _open_text(target, 'w') as out, read_transaction():
+        for model in api_models():
+            fields = _data_fields(model)
+            label = model._meta.label_lower
+            rows = model._base_manager.order_by('pk').values_list(
+                'pk', *(field.attname for field in fields)
+            ).iterator(chunk_size=batch_size)
+            count = 0
+            for pk, *values in rows:
+                out.write(encoder.encode({
+                    'model': label,
+                    'pk': pk,
+                    'fields': {field.name: value for field, value in zip(fields, values)},
+                }))
+                out.write('\n')
+                count += 1
+            counts[label] = count
+    return counts
+
+
+def _clear_tables(models):
+    with connection.cursor() as cursor:
+        for model in reversed(list(models)):
+            cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+
+
+def _finish_restore(models):
+    from . import search
+
+    # Explicit primary keys leave PostgreSQL sequences behind
+    sequence_sql = connection.ops.sequence_reset_sql(no_style(), list(models))
+    if sequence_sql:
+        with connection.cursor() as cursor:
+            for sql in sequence_sql:
+                cursor.execute(sql)
+    search.rebuild_index()
+
+
+def _insert_rows(model, fields, rows):
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in [model._meta.pk, *fields])
+    placeholders = ', '.join(['%s'] * (len(fields) + 1))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', rows)
+
+
+def restore_jsonl(path, batch_size=JSONL_BATCH_SIZE):
+    """
+    Replace every api row with the rows in a JSON lines backup.
+
+    Rows are inserted verbatim, batch by batch, in the file's order (which
+    export_jsonl writes parents first), bypassing model hooks: stored
+    counters and timestamps are kept as they were. Fields missing from the
+    file, as in backups taken before a column was added, get the field's
+    default. Everything happens in one transaction; on any error the
+    existing rows are kept. The search index is rebuilt at the end, and the
+    cache cleared once the transaction commits.
+    Returns {model label: rows restored}.
+    """
+    models = {model._meta.label_lower: model for model in api_models()}
+    counts = {}
+    model = fields = None
+    batch = []
+    with _open_text(path, 'r') as source, transaction.atomic():
+        _clear_tables(models.values())
+        for number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if model is None or row['model'] != model._meta.label_lower:
+                if batch:
+                    _insert_rows(model, fields, batch)
+                    batch = []
+                if row['model'] not in models:
+                    raise ValueError(f'Line {number}: unknown model {row["model"]}')
+                model = models[row['model']]
+                fields = _data_fields(model)
+            values = row['fields']
+            batch.append([model._meta.pk.get_db_prep_save(model._meta.pk.to_python(row['pk']), connection)] + [
+                field.get_db_prep_save(
+                    field.to_python(values[field.name]) if field.name in values else field.get_default(),
+                    connection
+                )
+                for field in fields
+            ])
+            counts[row['model']] = counts.get(row['model'], 0) + 1
+            if len(batch) >= batch_size:
+                _insert_rows(model, fields, batch)
+                batch = []
+        if batch:
+            _insert_rows(model, fields, batch)
+        _finish_restore(models.values())
+        transaction.on_commit(cache.clear)
+    return counts
+
+
+def _copy_model(model, source, batch_size):
+    """Insert the rows of model at connection alias source; returns how many"""
+    fields = _data_fields(model)
+    rows = model._base_manager.using(source).order_by('pk').values_list(
+        'pk', *(field.attname for field in fields)
+    ).iterator(chunk_size=batch_size)
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append([
+            field.get_db_prep_save(value, connection)
+            for field, value in zip([model._meta.pk, *fields], row)
+        ])
+        if len(batch) >= batch_size:
+            _insert_rows(model, fields, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        _insert_rows(model, fields, batch)
+        count += len(batch)
+    return count
+
+
+def copy_database(source, batch_size=JSONL_BATCH_SIZE):
+    """
+    Replace every api row with the rows of the database at connection alias
+    source, e.g. an old db.sqlite3 moved into PostgreSQL. Rows are read in
+    primary-key order with a chunked iterator and inserted in batches, like
+    restore_jsonl, in one transaction, and the cache is cleared once it
+    commits. Returns {model label: rows copied}.
+    """
+    models = api_models()
+    counts = {}
+    with transaction.atomic():
+        _clear_tables(models)
+        for model in models:
+            counts[model._meta.label_lower] = _copy_model(model, source, batch_size)
+        _finish_restore(models)
+        transaction.on_commit(cache.clear)
+    return counts
@@ -0,0 +1,210 @@
+"""
+Versioned response cache for public deck payloads.
+
+Each public deck has a small version pointer in the cache
+(``deck:version:<slug>``) and the pre-rendered JSON bytes are stored under a
+key that includes that version (``deck:json:<slug>:<version>``). A cache hit
+therefore costs two cache reads and no database or serializer work. Writes
+move the pointer to the new version instead of deleting keys, so a request
+that was rendering the old deck while the teacher saved cannot re-publish
+stale bytes. api.signals moves it after every committed deck save or
+delete, however the deck was written (API, admin, imports), and moves the
+decks of a renamed teacher or subject, whose names the payload embeds, to
+new versions. A render that finds the pointer on an older version of the
+same deck moves it on as well, so a missed move costs one extra render
+rather than one per request until the pointer expires.
+
+The cached entry also carries the deck's strong ETag so conditional GETs can
+be answered with a 304 straight from the cache.
+
+Signed-in teachers are cached too (``teacher:<id>``, without the password
+hash) so api.authentication resolves the teacher of a request without a
+query; api.signals drops the entry whenever a teacher is saved or deleted.
+
+Under ASGI the public deck is served by an async view (api.async_views),
+which goes through the cache's async API: the a-prefixed functions are the
+async twins of the ones the DRF views use.
+
+Teacher dashboards (api.dashboard) are versioned the same way, under
+``dashboard:version:<teacher_id>`` and ``dashboard:json:<teacher_id>:<version>``.
+api.signals moves the pointer after any transaction that saved or deleted
+one of the teacher's decks or subjects (card writes always save their
+deck). It moves only after the commit, so a dashboard built from the old
+rows while that transaction was open is left under the old version.
+"""
+from functools import partial
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+PUBLIC_DECK_CACHE_TIMEOUT = 60 * 60 * 24  # 24 hours
+TEACHER_CACHE_TIMEOUT = 60 * 60  # 1 hour
+DASHBOARD_CACHE_TIMEOUT = 60 * 60  # 1 hour
+
+# Pointer value for decks that were deleted; no payload is ever stored under it
+DELETED_VERSION = 'deleted'
+
+
+def deck_version(deck):
+    """
+    Cache version for a deck: its id and Deck.version, which every save
+    moves on. Versions restart at 1 for every deck, and a deleted deck's
+    slug goes to the next deck with the same title, so the id is needed
+    to tell them apart.
+    """
+    return f'{deck.id}-{deck.version}'
+
+
+def deck_etag(deck):
+    """Strong ETag built from deck id and version"""
+    return f'"{deck_version(deck)}"'
+
+
+def _version_key(slug):
+    return f'deck:version:{slug}'
+
+
+def _payload_key(slug, version):
+    return f'deck:json:{slug}:{version}'
+
+
+def get_public_deck_payload(slug):
+    """Return cached (etag, JSON bytes) for a public deck, or None on a miss"""
+    version = cache.get(_version_key(slug))
+    if version is None or version == DELETED_VERSION:
+        return None
+    return cache.get(_payload_key(slug, version))
+
+
+async def aget_public_deck_payload(slug):
+    """get_public_deck_payload for async views"""
+    version = await cache.aget(_version_key(slug))
+    if version is None or version == DELETED_VERSION:
+        return None
+    return await cache.aget(_payload_key(slug, version))
+
+
+def render_public_deck_payload(deck, data):
+    """Render serialized deck data to JSON bytes and cache them with the ETag"""
+    entry = (deck_etag(deck), JSONRenderer().render(data))
+    version = deck_version(deck)
+    cache.set(_payload_key(deck.slug, version), entry, PUBLIC_DECK_CACHE_TIMEOUT)
+    # add() never overwrites, so a newer pointer written by a concurrent save wins
+    # A pointer older than this render missed a move and is replaced; a save
+    # landing between the get() and set() is undone until the deck's next save
+    key = _version_key(deck.slug)
+    if not cache.add(key, version, PUBLIC_DECK_CACHE_TIMEOUT) and _is_older(cache.get(key), deck):
+        cache.set(key, version, PUBLIC_DECK_CACHE_TIMEOUT)
+    return entry
+
+
+async def arender_public_deck_payload(deck, data):
+    """render_public_deck_payload for async views"""
+    entry = (deck_etag(deck), JSONRenderer().render(data))
+    version = deck_version(deck)
+    await cache.aset(_payload_key(deck.slug, version), entry, PUBLIC_DECK_CACHE_TIMEOUT)
+    # add() never overwrites, so a newer pointer written by a concurrent save wins
+    key = _version_key(deck.slug)
+    if not await cache.aadd(key, version, PUBLIC_DECK_CACHE_TIMEOUT) and _is_older(await cache.aget(key), deck):
+        await cache.aset(key, version, PUBLIC_DECK_CACHE_TIMEOUT)
+    return entry
+
+
+def _is_older(pointer, deck):
+    """
+    Whether a version pointer names an earlier version of this deck, which
+    some write moved on from without moving the pointer. Pointers to other
+    decks or to DELETED_VERSION may be newer than the rendered row.
+    """
+    deck_id, _, version = str(pointer).partition('-')
+    return deck_id == str(deck.id) and version.isdigit() and int(version) < deck.version
+
+
+def _set_version(slug, version):
+    cache.set(_version_key(slug), version, PUBLIC_DECK_CACHE_TIMEOUT)
+
+
+def _set_deck_version(deck):
+    _set_version(deck.slug, deck_version(deck))
+
+
+def invalidate_public_deck(deck):
+    """
+    Point the cache at the deck's version once the current transaction
+    commits. The version is read then: post_save runs before Deck.save()
+    has read back the number it got.
+    """
+    transaction.on_commit(partial(_set_deck_version, deck))
+
+
+def forget_public_deck(slug):
+    """Mark a deleted deck, once the current transaction commits, so its payload is no longer served"""
+    transaction.on_commit(partial(_set_version, slug, DELETED_VERSION))
+
+
+def _teacher_key(teacher_id):
+    return f'teacher:{teacher_id}'
+
+
+def get_cached_teacher(teacher_id):
+    """The teacher with this id, from the cache when possible; None if there is none"""
+    from .models import Teacher
+
+    key = _teacher_key(teacher_id)
+    teacher = cache.get(key)
+    if teacher is None:
+        teacher = Teacher.objects.defer('password').filter(pk=teacher_id).first()
+        if teacher is not None:
+            cache.set(key, teacher, TEACHER_CACHE_TIMEOUT)
+    return teacher
+
+
+async def aget_cached_teacher(teacher_id):
+    """get_cached_teacher for async views"""
+    from .models import Teacher
+
+    key = _teacher_key(teacher_id)
+    teacher = await cache.aget(key)
+    if teacher is None:
+        teacher = await Teacher.objects.defer('password').filter(pk=teacher_id).afirst()
+        if teacher is not None:
+            await cache.aset(key, teacher, TEACHER_CACHE_TIMEOUT)
+    return teacher
+
+
+def forget_teacher(teacher_id):
+    cache.delete(_teacher_key(teacher_id))
+
+
+def _dashboard_version_key(teacher_id):
+    return f'dashboard:version:{teacher_id}'
+
+
+def _dashboard_key(teacher_id, version):
+    return f'dashboard:json:{teacher_id}:{version}'
+
+
+def get_dashboard_payload(teacher_id):
+    """Return (version, cached JSON bytes or None) for a teacher's dashboard"""
+    version_key = _dashboard_version_key(teacher_id)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, uuid4().hex, DASHBOARD_CACHE_TIMEOUT)
+        return cache.get(version_key), None
+    return version, cache.get(_dashboard_key(teacher_id, version))
+
+
+def set_dashboard_payload(teacher_id, version, payload):
+    """Cache a dashboard under the version read before it was built"""
+    cache.set(_dashboard_key(teacher_id, version), payload, DASHBOARD_CACHE_TIMEOUT)
+
+
+def _move_dashboard_version(teacher_id):
+    cache.set(_dashboard_version_key(teacher_id), uuid4().hex, DASHBOARD_CACHE_TIMEOUT)
+
+
+def forget_dashboard(teacher_id):
+    """Move a teacher's dashboard to a new version once the current transaction commits"""
+    transaction.on_commit(partial(_move_dashboard_version, teacher_id))
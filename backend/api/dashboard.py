@@ -0,0 +1,59 @@
+"""
+The teacher dashboard in one response.
+
+The dashboard used to load GET /decks/ and GET /subjects/ side by side.
+GET /api/dashboard/ returns the teacher's subjects, each with its decks
+(most recently edited first, in the DeckListSerializer shape), and deck and
+card totals per subject and overall.
+
+It is built from two queries, one over the teacher's subjects and one over
+their decks, whatever the size of the library: deck and card counts are
+denormalized columns (Subject.deck_count, Deck.card_count), so nothing is
+counted per row. Rows are read with values() and rendered once to JSON,
+which api.cache keeps per teacher until one of their decks or subjects is
+written, so repeat loads cost two cache reads.
+"""
+from django.db.models import F
+from rest_framework.renderers import JSONRenderer
+
+from .cache import get_dashboard_payload, set_dashboard_payload
+from .models import Deck, Subject
+
+DECK_FIELDS = (
+    'id', 'title', 'slug', 'subject', 'exam_board', 'year_group', 'target_grade',
+    'created_at', 'updated_at', 'is_public', 'card_count',
+)
+
+
+def build_dashboard(teacher_id):
+    rows = Subject.objects.filter(teacher_id=teacher_id).order_by('name').values('id', 'name', 'deck_count')
+    subjects = {subject['id']: {**subject, 'card_count': 0, 'decks': []} for subject in rows}
+    decks = (
+        Deck.objects.filter(teacher_id=teacher_id)
+        .order_by('-updated_at', '-id')
+        .values(*DECK_FIELDS, subject_name=F('subject__name'))
+    )
+    for deck in decks:
+        subject = subjects.get(deck['subject'])
+        if subject is None:
+            # A deck filed under another teacher's subject still gets listed
+            subject = subjects[deck['subject']] = {
+                'id': deck['subject'], 'name': deck['subject_name'], 'deck_count': 0, 'card_count': 0, 'decks': [],
+            }
+        subject['decks'].append(deck)
+        subject['card_count'] += deck['card_count']
+    subjects = list(subjects.values())
+    return {
+        'deck_count': sum(len(subject['decks']) for subject in subjects),
+        'card_count': sum(subject['card_count'] for subject in subjects),
+        'subjects': subjects,
+    }
+
+
+def dashboard_payload(teacher_id):
+    """The teacher's dashboard as JSON bytes, from the cache when possible"""
+    version, payload = get_dashboard_payload(teacher_id)
+    if payload is None:
+        payload = JSONRenderer().render(build_dashboard(teacher_id))
+        set_dashboard_payload(teacher_id, version, payload)
+    return payload
@@ -1,93 +1,201 @@
 """
-Email service using Resend
+Outbound email through a persistent outbox.
+
+Request handlers only enqueue: send_verification_email and
+send_password_reset_email render the message and insert an OutboundEmail
+row, which costs one INSERT. The send_emails management command delivers
+the outbox in batches: it claims due messages, sends them through the
+configured transport with at most EMAIL_CONCURRENCY in flight, and
+reschedules failures with exponential backoff until EMAIL_MAX_ATTEMPTS.
+
+A claim moves next_attempt_at forward by CLAIM_LEASE, so a worker that dies
+mid-batch only delays its messages; another run picks them up once the
+lease expires. On PostgreSQL claims use SKIP LOCKED, so several workers can
+share the outbox.
+
+Templates live in api/templates/emails and are compiled once per process.
+
+Transports implement send(message) -> provider id and raise
+PermanentEmailError for messages that must not be retried.
+ResendTransport needs the resend package and RESEND_API_KEY; without the
+key it refuses to start, so a misconfigured worker fails instead of
+dropping mail. FakeTransport records the latest messages in memory, so
+tests, benchmarks and local development need no network; settings.py only
+picks it by default under DEBUG.
 """
-import resend
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import cache
+
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboundEmail
+
+CLAIM_LEASE = timedelta(minutes=5)
+
+
+class PermanentEmailError(Exception):
+    """The provider rejected the message itself; retrying cannot help"""
+
+
+@cache
+def _template(name):
+    return get_template(f'emails/{name}.html')
+
+
+def enqueue(to, subject, template, context):
+    return OutboundEmail.objects.create(to=to, subject=subject, html=_template(template).render(context))
+
+
+def send_verification_email(teacher, token):
+    """Queue the email verification link for a new teacher"""
+    return enqueue(teacher.email, 'Verify your Flashcard Generator account', 'verification', {
+        'name': teacher.name,
+        'url': f'{settings.FRONTEND_URL}/verify/{token}',
+    })
+
+
+def send_password_reset_email(teacher, token):
+    """Queue a password reset link"""
+    return enqueue(teacher.email, 'Reset your Flashcard Generator password', 'password_reset', {
+        'name': teacher.name,
+        'url': f'{settings.FRONTEND_URL}/reset-password/{token}',
+    })
+
+
+class ResendTransport:
+    def __init__(self):
+        if not settings.RESEND_API_KEY:
+            raise ImproperlyConfigured('ResendTransport needs RESEND_API_KEY')
+        import resend
+
+        resend.api_key = settings.RESEND_API_KEY
+        self.emails = resend.Emails
+
+    def send(self, message):
+        try:
+            response = self.emails.send({
+                'from': settings.EMAIL_FROM,
+                'to': message.to,
+                'subject': message.subject,
+                'html': message.html,
+            })
+        except Exception as error:
+            # 4xx other than rate limiting means the message itself is bad
+            code = getattr(error, 'code', None)
+            if isinstance(code, int) and 400 <= code < 500 and code != 429:
+                raise PermanentEmailError(str(error)) from error
+            raise
+        return response['id']
+
+
+class FakeTransport:
+    """Keeps the last `limit` sent messages in FakeTransport.sent; latency simulates a slow provider"""
+    sent = []
+    count = 0
+    limit = 1000
+    latency = 0.0
+    failures = {}  # address -> exception raised when sending to it
+    _lock = threading.Lock()
+
+    def send(self, message):
+        if self.latency:
+            time.sleep(self.latency)
+        if message.to in self.failures:
+            raise self.failures[message.to]
+        with self._lock:
+            self.sent.append(message)
+            del self.sent[:-self.limit]
+            FakeTransport.count += 1
+            return f'fake-{self.count}'
+
+    @classmethod
+    def reset(cls, latency=0.0, failures=None):
+        cls.sent = []
+        cls.count = 0
+        cls.latency = latency
+        cls.failures = failures or {}
+
+
+def get_transport():
+    return import_string(settings.EMAIL_TRANSPORT)()
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter after the given number of failed attempts"""
+    delay = settings.EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claim_batch(size):
+    """Lock in up to size due messages for this worker"""
+    now = timezone.now()
+    with transaction.atomic():
+        due = OutboundEmail.objects.filter(
+            status__in=[OutboundEmail.PENDING, OutboundEmail.SENDING], next_attempt_at__lte=now
+        ).order_by('next_attempt_at')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        batch = list(due[:size])
+        OutboundEmail.objects.filter(id__in=[message.id for message in batch]).update(
+            status=OutboundEmail.SENDING, next_attempt_at=now + CLAIM_LEASE
+        )
+    return batch
+
+
+def deliver(batch, transport, concurrency):
+    """Send a claimed batch and record each outcome. Returns (sent, failed)"""
+    def send(message):
+        try:
+            return message, transport.send(message), None
+        except Exception as error:
+            return message, None, error
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, batch))
+
+    now = timezone.now()
+    sent = failed = 0
+    for message, provider_id, error in results:
+        if error is None:
+            message.status = OutboundEmail.SENT
+            message.provider_id = provider_id or ''
+            message.sent_at = now
+            message.last_error = ''
+            sent += 1
+            continue
+        message.attempts += 1
+        message.last_error = f'{type(error).__name__}: {error}'[:1000]
+        if isinstance(error, PermanentEmailError) or message.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+            message.status = OutboundEmail.FAILED
+        else:
+            message.status = OutboundEmail.PENDING
+            message.next_attempt_at = now + retry_delay(message.attempts)
+        failed += 1
+    OutboundEmail.objects.bulk_update(
+        batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'provider_id', 'sent_at']
+    )
+    return sent, failed
 
 
-def send_verification_email(teacher):
-    """Send email verification link to new teacher"""
-    if not settings.RESEND_API_KEY:
-        print("Warning: RESEND_API_KEY not set, skipping email")
-        return False
-
-    resend.api_key = settings.RESEND_API_KEY
-
-    verification_url = f"{settings.FRONTEND_URL}/verify/{teacher.verification_token}"
-
-    try:
-        resend.Emails.send({
-            "from": settings.EMAIL_FROM,
-            "to": teacher.email,
-            "subject": "Verify your Flashcard Generator account",
-            "html": f"""
-            <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-                <h2 style="color: #667eea;">Welcome to Flashcard Generator!</h2>
-                <p>Hi {teacher.name},</p>
-                <p>Thanks for signing up. Please verify your email address by clicking the button below:</p>
-                <p style="text-align: center; margin: 30px 0;">
-                    <a href="{verification_url}"
-                       style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                              color: white;
-                              padding: 14px 30px;
-                              text-decoration: none;
-                              border-radius: 8px;
-                              font-weight: bold;">
-                        Verify Email
-                    </a>
-                </p>
-                <p>Or copy this link: <a href="{verification_url}">{verification_url}</a></p>
-                <p style="color: #666; font-size: 14px;">
-                    If you didn't create an account, you can ignore this email.
-                </p>
-            </div>
-            """
-        })
-        return True
-    except Exception as e:
-        print(f"Error sending verification email: {e}")
-        return False
-
-
-def send_password_reset_email(teacher):
-    """Send password reset link"""
-    if not settings.RESEND_API_KEY:
-        print("Warning: RESEND_API_KEY not set, skipping email")
-        return False
-
-    resend.api_key = settings.RESEND_API_KEY
-
-    reset_url = f"{settings.FRONTEND_URL}/reset-password/{teacher.reset_token}"
-
-    try:
-        resend.Emails.send({
-            "from": settings.EMAIL_FROM,
-            "to": teacher.email,
-            "subject": "Reset your Flashcard Generator password",
-            "html": f"""
-            <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-                <h2 style="color: #667eea;">Password Reset Request</h2>
-                <p>Hi {teacher.name},</p>
-                <p>We received a request to reset your password. Click the button below to create a new password:</p>
-                <p style="text-align: center; margin: 30px 0;">
-                    <a href="{reset_url}"
-                       style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                              color: white;
-                              padding: 14px 30px;
-                              text-decoration: none;
-                              border-radius: 8px;
-                              font-weight: bold;">
-                        Reset Password
-                    </a>
-                </p>
-                <p>Or copy this link: <a href="{reset_url}">{reset_url}</a></p>
-                <p style="color: #666; font-size: 14px;">
-                    This link expires in 1 hour. If you didn't request a password reset, you can ignore this email.
-                </p>
-            </div>
-            """
-        })
-        return True
-    except Exception as e:
-        print(f"Error sending password reset email: {e}")
-        return False
+def process_outbox(transport=None, batch_size=None, concurrency=None):
+    """Deliver every due message, batch by batch. Returns (sent, failed)"""
+    transport = transport or get_transport()
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    concurrency = concurrency or settings.EMAIL_CONCURRENCY
+    totals = [0, 0]
+    while True:
+        batch = claim_batch(batch_size)
+        if not batch:
+            return tuple(totals)
+        sent, failed = deliver(batch, transport, concurrency)
+        totals[0] += sent
+        totals[1] += failed
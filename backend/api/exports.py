@@ -0,0 +1,204 @@
+"""
+Server-side deck export in the formats offered by the frontend
+(frontend/src/utils/exportFormats.js): Anki, Quizlet, Kahoot and plain CSV.
+
+Exports are generators of text chunks fed by a chunked card iterator, so a
+deck of any size streams in constant memory. A teacher's whole library
+streams as a zip archive written entry by entry into a buffer that is
+drained after every chunk.
+
+Under ASGI, Django would read a sync generator into a list before sending
+the first byte, so responses there wrap it in aiter_chunks, which advances
+it one chunk at a time in Django's sync thread.
+
+Exports of small enough decks are cached per deck version and format
+(``deck:export:<id>:<format>:<version>``). A saved deck gets a new version,
+so stale exports are never served and simply expire.
+"""
+import csv
+import re
+import zipfile
+from collections import deque
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from .cache import deck_version
+from .models import CARD_BATCH_SIZE
+
+EXPORT_CACHE_TIMEOUT = 60 * 60 * 24  # 24 hours
+
+# Exports larger than this stream every time instead of being cached
+EXPORT_CACHE_MAX_BYTES = 1024 * 1024
+
+KAHOOT_PLACEHOLDER = 'Add wrong answer'
+KAHOOT_TIME_LIMIT = 30
+
+ANKI_INSTRUCTIONS = (
+    '# Anki Import Instructions:\n'
+    '# 1. Open Anki and go to File > Import\n'
+    '# 2. Select this file\n'
+    '# 3. Set "Field separator" to Tab\n'
+    '# 4. Set "Fields" to: Front, Back\n'
+    '# 5. Click Import\n'
+    '#\n'
+)
+
+
+class _Echo:
+    """File-like object whose write() returns the value, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+class _ZipBuffer:
+    """Unseekable sink for zipfile that hands written bytes back in chunks"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def _one_line(text):
+    """Tabs and newlines would split a card in tab-separated formats"""
+    return re.sub(r'[\t\r\n]+', ' ', text)
+
+
+def iter_cards(deck):
+    """(question, answer) of every card in deck order, fetched in batches"""
+    return deck.cards.order_by('order', 'id').values_list('question', 'answer').iterator(
+        chunk_size=CARD_BATCH_SIZE
+    )
+
+
+def _tab_separated(cards):
+    for question, answer in cards:
+        yield f'{_one_line(question)}\t{_one_line(answer)}\n'
+
+
+def _anki(cards):
+    yield ANKI_INSTRUCTIONS
+    yield from _tab_separated(cards)
+
+
+def _csv(cards):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(['Question', 'Answer'])
+    for question, answer in cards:
+        yield writer.writerow([question, answer])
+
+
+def _kahoot(cards):
+    """
+    Kahoot quiz sheet with the card's answer as the correct option. The wrong
+    options are the answers of the preceding cards, which are usually on the
+    same topic; the first cards are padded with placeholders.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow([
+        'Question', 'Answer 1', 'Answer 2', 'Answer 3', 'Answer 4', 'Time limit', 'Correct answer(s)'
+    ])
+    recent = deque(maxlen=3)
+    for question, answer in cards:
+        wrong = [option for option in recent if option != answer]
+        wrong += [KAHOOT_PLACEHOLDER] * (3 - len(wrong))
+        yield writer.writerow([question, answer, *wrong, KAHOOT_TIME_LIMIT, 1])
+        recent.appendleft(answer)
+
+
+# format name -> (file suffix, content type, chunk generator)
+FORMATS = {
+    'anki': ('anki.txt', 'text/plain; charset=utf-8', _anki),
+    'quizlet': ('quizlet.txt', 'text/plain; charset=utf-8', _tab_separated),
+    'kahoot': ('kahoot.csv', 'text/csv; charset=utf-8', _kahoot),
+    'csv': ('cards.csv', 'text/csv; charset=utf-8', _csv),
+}
+
+
+def sanitize_filename(name):
+    return re.sub(r'[^a-z0-9]', '_', name, flags=re.IGNORECASE).lower()
+
+
+def export_filename(deck, export_format):
+    return f'{sanitize_filename(deck.title)}_{FORMATS[export_format][0]}'
+
+
+def export_etag(deck, export_format):
+    return f'"{deck_version(deck)}-{export_format}"'
+
+
+def _cache_key(deck, export_format):
+    return f'deck:export:{deck.id}:{export_format}:{deck_version(deck)}'
+
+
+def iter_export(deck, export_format):
+    """
+    Encoded chunks of one deck's export. Served from the cache when this
+    version was exported before; otherwise streamed from the database and
+    cached afterwards unless it outgrew EXPORT_CACHE_MAX_BYTES.
+    """
+    key = _cache_key(deck, export_format)
+    cached = cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    kept = []
+    size = 0
+    lines = FORMATS[export_format][2](iter_cards(deck))
+    # Yield one chunk per batch of rows rather than per row
+    while batch := ''.join(islice(lines, CARD_BATCH_SIZE)):
+        chunk = batch.encode()
+        if kept is not None:
+            size += len(chunk)
+            if size <= EXPORT_CACHE_MAX_BYTES:
+                kept.append(chunk)
+            else:
+                kept = None
+        yield chunk
+    if kept is not None:
+        cache.set(key, b''.join(kept), EXPORT_CACHE_TIMEOUT)
+
+
+def iter_library_zip(decks, export_format):
+    """Zip archive of every deck's export, one entry per deck named by slug"""
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for deck in decks:
+            with archive.open(f'{deck.slug}_{FORMATS[export_format][0]}', 'w') as entry:
+                for chunk in iter_export(deck, export_format):
+                    entry.write(chunk)
+                    yield from buffer.drain()
+            yield from buffer.drain()
+    yield from buffer.drain()
+
+
+async def aiter_chunks(chunks):
+    """
+    Async iterator over a chunk generator. Each chunk is produced in the
+    sync thread, where the generator's queries run like any sync view's.
+    """
+    advance = sync_to_async(next)
+    done = object()
+    try:
+        while (chunk := await advance(chunks, done)) is not done:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
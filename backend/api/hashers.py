@@ -0,0 +1,48 @@
+"""
+Password hashers whose cost comes from settings.
+
+Django's hashers fix their cost in class attributes; these read it from
+PASSWORD_PBKDF2_ITERATIONS, PASSWORD_SCRYPT_* and PASSWORD_ARGON2_*, so
+each deployment can trade login CPU time against brute-force resistance
+(see benchmarks/bench_login.py). PASSWORD_HASHER chooses the hasher; a hash
+made with another hasher or cost is upgraded on the teacher's next
+successful login (Teacher.check_password).
+
+Argon2 needs the argon2-cffi package.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    # OpenSSL refuses scrypt above 32 MB unless allowed; this is a ceiling,
+    # the memory used is 128 * block_size * work_factor bytes
+    maxmem = 256 * 1024 * 1024
+
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT_WORK_FACTOR
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_SCRYPT_PARALLELISM
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
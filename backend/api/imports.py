@@ -0,0 +1,327 @@
+"""
+Streaming bulk import of cards into an existing deck.
+
+The request body (or an uploaded file) is read in chunks, decoded
+incrementally and parsed card by card, so an import of any size holds at
+most one batch of cards and one JSON object in memory. Cards are written
+with bulk_create in batches of CARD_BATCH_SIZE, one transaction and one deck
+version per batch; a failure part way through keeps the batches already
+committed and reports how far the import got.
+
+Accepted formats, a Python port of the tolerant parsing in
+frontend/src/utils/cardParser.js plus the files our exports produce:
+
+    json   JSON array or JSON lines of {"question", "answer"} objects (also
+           q/a and front/back keys), or such an array wrapped in an object
+           like {"cards": [...]}. Prose or ``` fences around the array are
+           ignored and a truncated array keeps its complete cards.
+    csv    question,answer rows; a header row is skipped
+    anki   question<TAB>answer lines; # comment lines are skipped
+    quizlet  same as anki
+    table  markdown table with a header row
+    qa     "Q: ... A: ..." pairs or a numbered list, answers on their own line
+    auto   detect one of the above from the start of the input
+"""
+import codecs
+import csv
+import json
+import re
+from collections import namedtuple
+from itertools import chain
+
+from django.db import transaction
+from django.db.models import Max
+
+from . import search
+from .models import Card, CARD_BATCH_SIZE, ORDER_GAP
+
+IMPORT_CHUNK_SIZE = 64 * 1024
+
+# Most cards one import may add to a deck
+IMPORT_MAX_CARDS = 50000
+
+# Errors beyond this are counted but not listed in the response
+MAX_REPORTED_ERRORS = 100
+
+# A JSON object still unparsable after this many characters is malformed
+# rather than split across chunks
+MAX_JSON_OBJECT_LENGTH = 64 * 1024
+
+QUESTION_KEYS = ('question', 'q', 'front')
+ANSWER_KEYS = ('answer', 'a', 'back')
+
+_INVISIBLE = re.compile('[\ufeff\u200b\u200c\u200d\u2060]')
+_TABLE_ROW = re.compile(r'^\s*\|(.+?)\|(.+?)\|')
+_QUESTION_LINE = re.compile(r'^\s*(?:\d+[.)]\s*)?Q(?:uestion)?\s*\d*\s*[:.]\s*(.*)$', re.IGNORECASE)
+_NUMBERED_LINE = re.compile(r'^\s*\d+[.)]\s+(.*)$')
+_ANSWER_LINE = re.compile(r'^\s*A(?:nswer)?\s*[:.]\s*(.*)$', re.IGNORECASE)
+# An object whose first value is an array, as in {"cards": [{...}, ...]}
+_JSON_WRAPPER = re.compile(r'\{\s*"[^"\\]*"\s*:\s*\[')
+
+ParsedCard = namedtuple('ParsedCard', ['line', 'question', 'answer', 'error'])
+
+
+def _card(line, question, answer):
+    question = (question or '').strip()
+    answer = (answer or '').strip()
+    if not question:
+        return ParsedCard(line, None, None, 'Missing question')
+    if not answer:
+        return ParsedCard(line, None, None, 'Missing answer')
+    return ParsedCard(line, question, answer, None)
+
+
+def _error(line, message):
+    return ParsedCard(line, None, None, message)
+
+
+def iter_chunks(stream, size=IMPORT_CHUNK_SIZE):
+    """Byte chunks of a request body or uploaded file"""
+    if hasattr(stream, 'chunks'):
+        return stream.chunks(size)
+    return iter(lambda: stream.read(size), b'')
+
+
+def iter_text(chunks):
+    """Decode UTF-8 byte chunks incrementally, dropping BOMs and zero-width characters"""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in chain(chunks, [b'']):
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+            yield _INVISIBLE.sub('', text)
+
+
+def iter_lines(text):
+    """Lines of a stream of text pieces, without line endings"""
+    pending = ''
+    for piece in text:
+        pending += piece
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line.rstrip('\r')
+    if pending:
+        yield pending.rstrip('\r')
+
+
+def parse_json(text):
+    """
+    Every JSON object in the input, wherever it sits: inside an array, one
+    per line, wrapped in prose and code fences, or in the array of a
+    wrapping object such as {"cards": [...]}.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0  # next character of buffer to look at
+    line = 1  # line number of buffer[pos]
+    finished = False
+    pieces = iter(text)
+    while not finished:
+        piece = next(pieces, None)
+        if piece is None:
+            finished = True
+        else:
+            # Drop what was consumed once per chunk, not once per object
+            buffer = buffer[pos:] + piece
+            pos = 0
+        while True:
+            start = buffer.find('{', pos)
+            if start < 0:
+                line += buffer.count('\n', pos)
+                pos = len(buffer)
+                break
+            line += buffer.count('\n', pos, start)
+            pos = start
+            wrapper = _JSON_WRAPPER.match(buffer, pos)
+            if wrapper:
+                # Look for the cards inside the wrapper's array
+                line += buffer.count('\n', pos, wrapper.end())
+                pos = wrapper.end()
+                continue
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not finished and len(buffer) - pos < MAX_JSON_OBJECT_LENGTH:
+                    break  # Probably split across chunks; wait for more
+                if finished and buffer.find('{', pos + 1) < 0:
+                    yield _error(line, 'Incomplete card at end of input')
+                    pos = len(buffer)
+                    break
+                yield _error(line, 'Invalid JSON')
+                # Skip past this brace and look for the next object
+                pos += 1
+                continue
+            if isinstance(value, dict):
+                question = next((value[key] for key in QUESTION_KEYS if value.get(key)), '')
+                answer = next((value[key] for key in ANSWER_KEYS if value.get(key)), '')
+                if isinstance(question, str) and isinstance(answer, str):
+                    yield _card(line, question, answer)
+                else:
+                    yield _error(line, 'Question and answer must be text')
+            else:
+                yield _error(line, 'Expected an object with question and answer')
+            line += buffer.count('\n', pos, end)
+            pos = end
+
+
+def parse_csv(text):
+    lines = (f'{line}\n' for line in iter_lines(text))
+    reader = csv.reader(lines)
+    first = True
+    line = 1
+    for row in reader:
+        row_line, line = line, reader.line_num + 1
+        if first:
+            first = False
+            if row and row[0].strip().lower() in QUESTION_KEYS + ('term',):
+                continue
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(row) < 2:
+            yield _error(row_line, 'Expected question,answer')
+            continue
+        yield _card(row_line, row[0], row[1])
+
+
+def parse_tab_separated(text):
+    for line, content in enumerate(iter_lines(text), 1):
+        if not content.strip() or content.startswith('#'):
+            continue
+        if '\t' not in content:
+            yield _error(line, 'Expected question<TAB>answer')
+            continue
+        question, answer = content.split('\t')[:2]
+        yield _card(line, question, answer)
+
+
+def parse_table(text):
+    header = True
+    for line, content in enumerate(iter_lines(text), 1):
+        match = _TABLE_ROW.match(content)
+        if not match:
+            continue
+        question, answer = match.group(1).strip(), match.group(2).strip()
+        if set(question) <= set('-: '):
+            continue  # Separator row
+        if header:
+            header = False
+            continue
+        yield _card(line, question, answer)
+
+
+def parse_qa(text):
+    """Q:/A: pairs and numbered lists; unmarked lines continue the current field"""
+    start = question = answer = None
+    for line, content in enumerate(iter_lines(text), 1):
+        if not content.strip() or content.lstrip().startswith('```'):
+            continue
+        answer_match = _ANSWER_LINE.match(content)
+        if answer_match and question is not None and answer is None:
+            answer = answer_match.group(1)
+            continue
+        question_match = _QUESTION_LINE.match(content) or _NUMBERED_LINE.match(content)
+        if question_match:
+            if question is not None:
+                yield _card(start, question, answer)
+            start, question, answer = line, question_match.group(1), None
+        elif answer is not None:
+            answer += '\n' + content.strip()
+        elif question is not None:
+            question += '\n' + content.strip()
+    if question is not None:
+        yield _card(start, question, answer)
+
+
+PARSERS = {
+    'json': parse_json,
+    'csv': parse_csv,
+    'anki': parse_tab_separated,
+    'quizlet': parse_tab_separated,
+    'table': parse_table,
+    'qa': parse_qa,
+}
+
+
+def detect_format(head):
+    """Guess the format from the first chunk of input, in cardParser.js order"""
+    if re.search(r'\{\s*"', head):
+        return 'json'
+    if re.search(r'^\s*\|.+\|.+\|', head, re.MULTILINE):
+        return 'table'
+    if any(_QUESTION_LINE.match(line) or _NUMBERED_LINE.match(line) for line in head.splitlines()[:20]):
+        return 'qa'
+    if '\t' in head:
+        return 'anki'
+    return 'csv'
+
+
+class ImportReport:
+    """Outcome of an import; errors beyond MAX_REPORTED_ERRORS are only counted"""
+
+    def __init__(self, import_format):
+        self.format = import_format
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+        self.stopped = None
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        data = {
+            'format': self.format,
+            'imported': self.imported,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+        if self.stopped:
+            data['stopped'] = self.stopped
+        return data
+
+
+def import_cards(deck, stream, import_format='auto'):
+    """
+    Append the cards read from stream to deck, in batched transactions.
+    Returns an ImportReport; the caller invalidates caches.
+    """
+    text = iter_text(iter_chunks(stream))
+    if import_format == 'auto':
+        head = next(text, '')
+        import_format = detect_format(head)
+        text = chain([head], text)
+    report = ImportReport(import_format)
+
+    last = deck.cards.aggregate(last=Max('order'))['last']
+    order = 0 if last is None else last + ORDER_GAP
+    batch = []
+
+    def write():
+        with transaction.atomic():
+            Card.objects.bulk_create(batch)
+            # Each committed batch is a version of the deck of its own
+            deck.content_hash = ''
+            deck.save(update_fields=['updated_at', 'content_hash'])
+            deck.log_card_changes(inserted=[card.id for card in batch])
+        report.imported += len(batch)
+        batch.clear()
+
+    # Committed batches are searchable once the import finishes
+    with search.deferred_indexing():
+        for parsed in PARSERS[import_format](text):
+            if parsed.error:
+                report.add_error(parsed.line, parsed.error)
+                continue
+            if report.imported + len(batch) >= IMPORT_MAX_CARDS:
+                report.stopped = f'Import limit of {IMPORT_MAX_CARDS} cards reached at line {parsed.line}'
+                break
+            batch.append(Card(deck=deck, question=parsed.question, answer=parsed.answer, order=order))
+            order += ORDER_GAP
+            if len(batch) >= CARD_BATCH_SIZE:
+                write()
+        if batch:
+            write()
+
+    deck.card_count += report.imported
+    return report
@@ -0,0 +1,86 @@
+"""
+API profiling report management command.
+
+Usage:
+    python manage.py api_profile                  # p50/p95/p99 per endpoint
+    python manage.py api_profile --slowest 5      # Also show the 5 slowest requests with SQL
+    python manage.py api_profile --json           # Raw JSON output
+    python manage.py api_profile --reset          # Clear collected stats
+
+Stats are collected by api.middleware.ProfilingMiddleware when the server
+runs with API_PROFILING=1, and read back from the shared cache.
+"""
+
+import json
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from api import profiling
+
+
+class Command(BaseCommand):
+    help = 'Show per-endpoint latency and query stats collected by the profiling middleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--slowest',
+            type=int,
+            default=0,
+            help='Show the N slowest requests with their SQL',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the raw stats as JSON',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Clear all collected stats',
+        )
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            profiling.reset()
+            self.stdout.write(self.style.SUCCESS('Profiling stats cleared.'))
+            return
+
+        summary = profiling.summarize()
+        slowest = profiling.slowest_requests(options['slowest']) if options['slowest'] else []
+
+        if options['json']:
+            self.stdout.write(json.dumps({'endpoints': summary, 'slowest': slowest}, indent=2))
+            return
+
+        if not summary:
+            self.stdout.write(self.style.WARNING(
+                'No profiling data. Run the server with API_PROFILING=1 and a shared cache.'
+            ))
+            return
+
+        self.stdout.write(self.style.SUCCESS('\n=== Endpoints (ms unless noted) ==='))
+        header = f'{"endpoint":<28}{"count":>7}{"p50":>9}{"p95":>9}{"p99":>9}{"max":>9}{"q p95":>7}{"db p95":>9}{"KB p95":>9}'
+        self.stdout.write(header)
+        for endpoint, stats in summary.items():
+            wall = stats['wall_ms']
+            self.stdout.write(
+                f'{endpoint:<28}{stats["count"]:>7}'
+                f'{wall["p50"]:>9.1f}{wall["p95"]:>9.1f}{wall["p99"]:>9.1f}{wall["max"]:>9.1f}'
+                f'{stats["queries"]["p95"]:>7}{stats["db_ms"]["p95"]:>9.1f}'
+                f'{stats["bytes"]["p95"] / 1024:>9.1f}'
+            )
+
+        if slowest:
+            self.stdout.write(self.style.SUCCESS(f'\n=== {len(slowest)} slowest requests ==='))
+            for entry in slowest:
+                at = datetime.fromtimestamp(entry['at'])
+                self.stdout.write(
+                    f'{entry["wall_ms"]:.1f} ms  {entry["method"]} {entry["path"]} '
+                    f'-> {entry["status"]} ({entry["queries"]} queries, {entry["db_ms"]:.1f} ms DB) '
+                    f'at {at:%Y-%m-%d %H:%M:%S}'
+                )
+                for query in entry['sql']:
+                    self.stdout.write(f'    [{query["ms"]:.2f} ms] {query["sql"]}')
+
+        self.stdout.write('')
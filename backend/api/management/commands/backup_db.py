@@ -3,21 +3,46 @@ Database backup management command.
 
 Usage:
     python manage.py backup_db                    # Create SQLite backup
-    python manage.py backup_db --json             # Also export to JSON
+    python manage.py backup_db --compress         # Gzip the backup
+    python manage.py backup_db --verify           # Run PRAGMA integrity_check on the copy
+    python manage.py backup_db --incremental      # Store only pages changed since the last backup
+    python manage.py backup_db --json             # Also export to JSON lines (streamed)
     python manage.py backup_db --keep 7           # Keep last 7 backups (default)
     python manage.py backup_db --list             # List existing backups
     python manage.py backup_db --restore <file>   # Restore from backup
+
+Backups are taken with SQLite's online backup API (see api.backups), so the
+server can keep writing while they run.
+
+--keep counts full and incremental backups alike, and also keeps the
+backups that a kept incremental one is applied on top of. An incremental
+run whose chain already holds --keep backups takes a full backup instead,
+so old chains fall out of the kept set and are removed whole.
+
+A restore clears the cache (shared with the server in production), since
+cached payloads are keyed by deck versions that go back with the data.
 """
 
-import os
-import shutil
-import json
+import tempfile
+import time
 from datetime import datetime
 from pathlib import Path
 
 from django.core.management.base import BaseCommand, CommandError
 from django.core.management import call_command
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from api import backups
+
+FULL_PATTERNS = ('db_*.sqlite3', 'db_*.sqlite3.gz')
+JSON_PATTERNS = ('db_*.json', 'db_*.jsonl', 'db_*.jsonl.gz')
+
+
+def backup_time(path):
+    """Timestamp part of a backup name, so safety backups sort by age too"""
+    return path.name.split('.')[0].removeprefix('db_').removeprefix('pre_restore_')
 
 
 class Command(BaseCommand):
@@ -27,13 +52,13 @@ class Command(BaseCommand):
         parser.add_argument(
             '--json',
             action='store_true',
-            help='Also export data to JSON format (portable)',
+            help='Also export data to JSON lines format (portable)',
         )
         parser.add_argument(
             '--keep',
             type=int,
             default=7,
-            help='Number of backups to keep (default: 7)',
+            help='Number of backups to keep, incremental ones included (default: 7)',
         )
         parser.add_argument(
             '--list',
@@ -45,6 +70,33 @@ class Command(BaseCommand):
             type=str,
             help='Restore from a backup file',
         )
+        parser.add_argument(
+            '--compress',
+            action='store_true',
+            help='Gzip full backups',
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Run PRAGMA integrity_check on the copy before keeping it',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Only store pages changed since the previous backup',
+        )
+        parser.add_argument(
+            '--step-pages',
+            type=int,
+            default=backups.DEFAULT_STEP_PAGES,
+            help=f'Pages copied per backup step (default: {backups.DEFAULT_STEP_PAGES})',
+        )
+        parser.add_argument(
+            '--step-sleep',
+            type=float,
+            default=backups.DEFAULT_STEP_SLEEP,
+            help=f'Seconds to pause between steps for writers (default: {backups.DEFAULT_STEP_SLEEP})',
+        )
         parser.add_argument(
             '--backup-dir',
             type=str,
@@ -59,25 +111,44 @@ class Command(BaseCommand):
         backup_dir.mkdir(parents=True, exist_ok=True)
 
         # Get database path
-        db_path = base_dir / 'db.sqlite3'
+        db_path = Path(settings.DATABASES['default']['NAME'])
+        self.step_pages = options['step_pages']
+        self.step_sleep = options['step_sleep']
 
         if options['list']:
             self.list_backups(backup_dir)
             return
 
+        if connection.vendor != 'sqlite':
+            raise CommandError('backup_db backs up the SQLite file; back up PostgreSQL with pg_dump')
+
         if options['restore']:
             self.restore_backup(options['restore'], db_path, backup_dir)
             return
 
         # Create backup
-        self.create_backup(db_path, backup_dir, options['json'], options['keep'])
+        self.create_backup(
+            db_path, backup_dir, options['json'], options['keep'],
+            compress=options['compress'], verify=options['verify'], incremental=options['incremental']
+        )
+
+    def full_backups(self, backup_dir):
+        """Full SQLite backups, newest first"""
+        found = [path for pattern in FULL_PATTERNS for path in backup_dir.glob(pattern)]
+        return sorted(found, key=backup_time, reverse=True)
+
+    def json_backups(self, backup_dir):
+        """JSON backups, newest first"""
+        found = [path for pattern in JSON_PATTERNS for path in backup_dir.glob(pattern)]
+        return sorted(found, key=backup_time, reverse=True)
 
     def list_backups(self, backup_dir):
         """List all existing backups."""
-        sqlite_backups = sorted(backup_dir.glob('db_*.sqlite3'), reverse=True)
-        json_backups = sorted(backup_dir.glob('db_*.json'), reverse=True)
+        sqlite_backups = self.full_backups(backup_dir)
+        delta_backups = sorted(backup_dir.glob('db_*.delta'), reverse=True)
+        json_backups = self.json_backups(backup_dir)
 
-        if not sqlite_backups and not json_backups:
+        if not sqlite_backups and not delta_backups and not json_backups:
             self.stdout.write(self.style.WARNING('No backups found.'))
             return
 
@@ -87,6 +158,14 @@ class Command(BaseCommand):
             modified = datetime.fromtimestamp(backup.stat().st_mtime)
             self.stdout.write(f'  {backup.name} ({size:.1f} KB) - {modified:%Y-%m-%d %H:%M}')
 
+        if delta_backups:
+            self.stdout.write(self.style.SUCCESS('\n=== Incremental Backups ==='))
+            for backup in delta_backups:
+                size = backup.stat().st_size / 1024
+                modified = datetime.fromtimestamp(backup.stat().st_mtime)
+                base = backups.read_delta_header(backup)['base']
+                self.stdout.write(f'  {backup.name} ({size:.1f} KB, on top of {base}) - {modified:%Y-%m-%d %H:%M}')
+
         if json_backups:
             self.stdout.write(self.style.SUCCESS('\n=== JSON Backups ==='))
             for backup in json_backups:
@@ -106,72 +185,161 @@ class Command(BaseCommand):
         if not backup_path.exists():
             raise CommandError(f'Backup file not found: {backup_path}')
 
-        if backup_path.suffix == '.sqlite3':
-            # Create a safety backup of current database first
-            if db_path.exists():
-                safety_backup = backup_dir / f'db_pre_restore_{datetime.now():%Y%m%d_%H%M%S}.sqlite3'
-                shutil.copy2(db_path, safety_backup)
-                self.stdout.write(f'Created safety backup: {safety_backup.name}')
+        if backup_path.name.endswith(('.sqlite3', '.sqlite3.gz', '.delta')):
+            self.safety_backup(db_path, backup_dir)
+
+            # Rebuild the backup as a plain database file, check it, then copy
+            # it into the live database through the backup API
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                source = backup_path
+                if backup_path.suffix != '.sqlite3':
+                    source = backups.materialize(backup_path, Path(tmp_dir) / 'restore.sqlite3')
+                problems = backups.integrity_check(source)
+                if problems:
+                    raise CommandError(f'Backup failed integrity check: {problems[:5]}')
+                stats = backups.online_backup(source, db_path, step_pages=-1, step_sleep=0)
+            cache.clear()
+            self.stdout.write(self.style.SUCCESS(
+                f'Restored database from: {backup_path.name} ({stats["seconds"]:.2f}s)'
+            ))
+
+        elif backup_path.name.endswith(('.jsonl', '.jsonl.gz')):
+            self.safety_backup(db_path, backup_dir)
 
-            # Restore SQLite backup
-            shutil.copy2(backup_path, db_path)
-            self.stdout.write(self.style.SUCCESS(f'Restored database from: {backup_path.name}'))
+            started = time.perf_counter()
+            counts = backups.restore_jsonl(backup_path)
+            rows = ', '.join(f'{count} {label}' for label, count in counts.items())
+            self.stdout.write(self.style.SUCCESS(
+                f'Restored data from: {backup_path.name} ({rows}; {time.perf_counter() - started:.2f}s)'
+            ))
 
         elif backup_path.suffix == '.json':
-            # For JSON, we need to use loaddata
-            # First backup current database
-            if db_path.exists():
-                safety_backup = backup_dir / f'db_pre_restore_{datetime.now():%Y%m%d_%H%M%S}.sqlite3'
-                shutil.copy2(db_path, safety_backup)
-                self.stdout.write(f'Created safety backup: {safety_backup.name}')
+            # Backups from before JSON lines were written with dumpdata
+            self.safety_backup(db_path, backup_dir)
 
             # Load JSON data
             call_command('loaddata', str(backup_path), verbosity=0)
+            cache.clear()
             self.stdout.write(self.style.SUCCESS(f'Restored data from: {backup_path.name}'))
 
         else:
             raise CommandError(f'Unsupported backup format: {backup_path.suffix}')
 
-    def create_backup(self, db_path, backup_dir, include_json, keep_count):
+    def safety_backup(self, db_path, backup_dir):
+        """Snapshot the current database before a restore overwrites it"""
+        if db_path.exists():
+            safety_backup = backup_dir / f'db_pre_restore_{datetime.now():%Y%m%d_%H%M%S}.sqlite3'
+            backups.online_backup(db_path, safety_backup, self.step_pages, self.step_sleep)
+            self.stdout.write(f'Created safety backup: {safety_backup.name}')
+
+    def create_backup(self, db_path, backup_dir, include_json, keep_count,
+                      compress=False, verify=False, incremental=False):
         """Create a new backup."""
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
 
         if not db_path.exists():
             raise CommandError(f'Database not found: {db_path}')
 
-        # SQLite backup
-        sqlite_backup = backup_dir / f'db_{timestamp}.sqlite3'
-        shutil.copy2(db_path, sqlite_backup)
-        size_kb = sqlite_backup.stat().st_size / 1024
-        self.stdout.write(self.style.SUCCESS(f'Created SQLite backup: {sqlite_backup.name} ({size_kb:.1f} KB)'))
+        base = self.latest_backup(backup_dir) if incremental else None
+        if incremental and base is None:
+            self.stdout.write(self.style.WARNING('No previous backup with a page manifest; taking a full backup.'))
+        elif base is not None and self.chain_length(base) >= keep_count:
+            self.stdout.write(f'{base.name} ends a chain of {keep_count} or more backups; taking a full backup.')
+            base = None
+
+        with tempfile.TemporaryDirectory(dir=backup_dir) as tmp_dir:
+            snapshot = Path(tmp_dir) / 'snapshot.sqlite3'
+            stats = backups.online_backup(db_path, snapshot, self.step_pages, self.step_sleep)
+            size_mb = snapshot.stat().st_size / (1024 * 1024)
+            self.stdout.write(
+                f'Copied {stats["pages"]} pages ({size_mb:.1f} MB) in {stats["steps"]} steps, '
+                f'{stats["seconds"]:.2f}s ({size_mb / max(stats["seconds"], 1e-6):.1f} MB/s)'
+            )
+
+            if verify:
+                self.verify(snapshot)
+
+            if base is not None:
+                delta_backup = backup_dir / f'db_{timestamp}.delta'
+                started = time.perf_counter()
+                changed, total = backups.write_delta(snapshot, base, delta_backup)
+                size_kb = delta_backup.stat().st_size / 1024
+                self.stdout.write(self.style.SUCCESS(
+                    f'Created incremental backup: {delta_backup.name} ({size_kb:.1f} KB, '
+                    f'{changed} of {total} pages changed since {base.name}, '
+                    f'{time.perf_counter() - started:.2f}s)'
+                ))
+            else:
+                sqlite_backup = backup_dir / f'db_{timestamp}.sqlite3'
+                backups.write_manifest(snapshot, backups.manifest_path(sqlite_backup))
+                snapshot.rename(sqlite_backup)
+                if compress:
+                    started = time.perf_counter()
+                    sqlite_backup = backups.compress(sqlite_backup)
+                    self.stdout.write(f'Compressed in {time.perf_counter() - started:.2f}s')
+                size_kb = sqlite_backup.stat().st_size / 1024
+                self.stdout.write(self.style.SUCCESS(f'Created SQLite backup: {sqlite_backup.name} ({size_kb:.1f} KB)'))
 
         # JSON export (optional)
         if include_json:
-            json_backup = backup_dir / f'db_{timestamp}.json'
-            with open(json_backup, 'w') as f:
-                call_command('dumpdata',
-                    'api',  # Only backup the api app data
-                    '--indent', '2',
-                    '--output', str(json_backup),
-                    verbosity=0
-                )
-            if json_backup.exists():
-                size_kb = json_backup.stat().st_size / 1024
-                self.stdout.write(self.style.SUCCESS(f'Created JSON backup: {json_backup.name} ({size_kb:.1f} KB)'))
+            json_backup = backup_dir / f'db_{timestamp}.jsonl{".gz" if compress else ""}'
+            started = time.perf_counter()
+            counts = backups.export_jsonl(json_backup)
+            size_kb = json_backup.stat().st_size / 1024
+            self.stdout.write(self.style.SUCCESS(
+                f'Created JSON backup: {json_backup.name} ({size_kb:.1f} KB, '
+                f'{sum(counts.values())} rows, {time.perf_counter() - started:.2f}s)'
+            ))
 
         # Cleanup old backups
         self.cleanup_old_backups(backup_dir, keep_count)
 
+    def verify(self, database):
+        started = time.perf_counter()
+        problems = backups.integrity_check(database)
+        if problems:
+            raise CommandError(f'Backup failed integrity check, not kept: {problems[:5]}')
+        self.stdout.write(f'Integrity check ok in {time.perf_counter() - started:.2f}s')
+
+    def latest_backup(self, backup_dir):
+        """Newest full or incremental backup that has a page manifest"""
+        candidates = self.full_backups(backup_dir) + list(backup_dir.glob('db_*.delta'))
+        candidates = [
+            path for path in candidates
+            if not path.name.startswith('db_pre_restore_') and backups.manifest_path(path).exists()
+        ]
+        return max(candidates, key=backup_time, default=None)
+
+    def chain_length(self, backup):
+        """Number of backups a restore of backup replays; infinite when one is missing"""
+        try:
+            return len(backups.delta_chain(backup))
+        except FileNotFoundError:
+            return float('inf')
+
     def cleanup_old_backups(self, backup_dir, keep_count):
         """Remove old backups, keeping only the most recent ones."""
-        # Cleanup SQLite backups
-        sqlite_backups = sorted(backup_dir.glob('db_*.sqlite3'), reverse=True)
-        for old_backup in sqlite_backups[keep_count:]:
-            old_backup.unlink()
-            self.stdout.write(f'Removed old backup: {old_backup.name}')
+        # Cleanup SQLite backups: the newest full and incremental ones and
+        # every backup those incremental ones need. Deltas whose chain is
+        # broken cannot be restored and go too.
+        sqlite_backups = sorted(
+            self.full_backups(backup_dir) + list(backup_dir.glob('db_*.delta')),
+            key=backup_time, reverse=True
+        )
+        needed = set()
+        for backup in sqlite_backups[:keep_count]:
+            try:
+                needed.update(backups.delta_chain(backup))
+            except FileNotFoundError:
+                pass
+        for old_backup in sqlite_backups:
+            if old_backup not in needed:
+                old_backup.unlink()
+                backups.manifest_path(old_backup).unlink(missing_ok=True)
+                self.stdout.write(f'Removed old backup: {old_backup.name}')
 
         # Cleanup JSON backups
-        json_backups = sorted(backup_dir.glob('db_*.json'), reverse=True)
+        json_backups = self.json_backups(backup_dir)
         for old_backup in json_backups[keep_count:]:
             old_backup.unlink()
             self.stdout.write(f'Removed old backup: {old_backup.name}')
@@ -0,0 +1,72 @@
+"""
+Move the data of an existing SQLite database into the configured database.
+
+Usage:
+    POSTGRES_DB=flashcards python manage.py migrate
+    POSTGRES_DB=flashcards python manage.py import_sqlite db.sqlite3
+
+Every teacher, subject, deck and card is copied in batches with its primary
+key, sequences are reset and the search index is rebuilt (see
+api.backups.copy_database). Rows already in the target are replaced, and
+the cache is cleared, since its keys name ids and versions of the old rows.
+Sessions are not copied, so teachers sign in again; admin users are
+recreated with createsuperuser.
+"""
+
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.migrations.recorder import MigrationRecorder
+
+from api import backups
+
+SOURCE_ALIAS = 'sqlite_source'
+
+
+class Command(BaseCommand):
+    help = 'Copy all flashcard data from a SQLite file into the default database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='SQLite database file to copy from')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=backups.JSONL_BATCH_SIZE,
+            help=f'Rows per insert batch (default: {backups.JSONL_BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path']).resolve()
+        if not path.exists():
+            raise CommandError(f'Database not found: {path}')
+        if connection.vendor == 'sqlite' and Path(connection.settings_dict['NAME']).resolve() == path:
+            raise CommandError('The source is the default database itself')
+
+        connections.settings[SOURCE_ALIAS] = connections.configure_settings({
+            **connections.settings,
+            SOURCE_ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(path)},
+        })[SOURCE_ALIAS]
+        try:
+            self.check_migrations()
+            started = time.perf_counter()
+            counts = backups.copy_database(SOURCE_ALIAS, options['batch_size'])
+        finally:
+            connections[SOURCE_ALIAS].close()
+        rows = ', '.join(f'{count} {label}' for label, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Copied {rows} from {path.name} in {time.perf_counter() - started:.2f}s'
+        ))
+
+    def check_migrations(self):
+        """Both databases must be at the same api migration, or columns differ"""
+        def applied(alias):
+            return {name for app, name in MigrationRecorder(connections[alias]).applied_migrations() if app == 'api'}
+
+        missing = applied(SOURCE_ALIAS) ^ applied('default')
+        if missing:
+            raise CommandError(
+                f'Migrations differ between the databases ({", ".join(sorted(missing))}); '
+                f'run migrate on both first'
+            )
@@ -0,0 +1,25 @@
+"""
+Rebuild the public deck search index.
+
+Usage:
+    python manage.py rebuild_search_index
+
+The index is kept up to date on every deck and card write; this is only
+needed to repair it, e.g. after editing cards with raw SQL.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over deck titles and card text'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = search.rebuild_index()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} decks in {elapsed:.2f}s'))
@@ -0,0 +1,41 @@
+"""
+Recompute the denormalized deck and card counters.
+
+Usage:
+    python manage.py repair_counts            # Recompute every counter
+    python manage.py repair_counts --check    # Only report counters that drifted
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from api.models import Subject, Deck, Card
+
+
+class Command(BaseCommand):
+    help = 'Recompute Deck.card_count and Subject.deck_count from the actual rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Report drifted counters without fixing them',
+        )
+
+    def handle(self, *args, **options):
+        drifted_decks = Deck.objects.annotate(actual=Count('cards')).exclude(card_count=F('actual')).count()
+        drifted_subjects = Subject.objects.annotate(actual=Count('decks')).exclude(deck_count=F('actual')).count()
+        self.stdout.write(f'Decks with a wrong card_count: {drifted_decks}')
+        self.stdout.write(f'Subjects with a wrong deck_count: {drifted_subjects}')
+
+        if options['check']:
+            return
+
+        card_counts = Card.objects.filter(deck=OuterRef('pk')).order_by().values('deck').annotate(n=Count('id')).values('n')
+        deck_counts = Deck.objects.filter(subject=OuterRef('pk')).order_by().values('subject').annotate(n=Count('id')).values('n')
+        with transaction.atomic():
+            decks = Deck.objects.update(card_count=Coalesce(Subquery(card_counts), 0))
+            subjects = Subject.objects.update(deck_count=Coalesce(Subquery(deck_counts), 0))
+        self.stdout.write(self.style.SUCCESS(f'Recomputed counters for {decks} decks and {subjects} subjects.'))
@@ -0,0 +1,64 @@
+"""
+Deliver the outbound email queue.
+
+Usage:
+    python manage.py send_emails                  # Run forever, polling every 5s
+    python manage.py send_emails --once           # Send what is due, then exit (cron)
+    python manage.py send_emails --concurrency 8  # Sends in flight at once
+
+See api.email_service for batching, retries and backoff.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api import email_service
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails in batches, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Send every due message once and exit',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds between polls of the outbox (default: 5)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.EMAIL_BATCH_SIZE,
+            help=f'Messages claimed per batch (default: {settings.EMAIL_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.EMAIL_CONCURRENCY,
+            help=f'Sends in flight at once (default: {settings.EMAIL_CONCURRENCY})',
+        )
+
+    def handle(self, *args, **options):
+        transport = email_service.get_transport()
+        while True:
+            started = time.perf_counter()
+            sent, failed = email_service.process_outbox(
+                transport, options['batch_size'], options['concurrency']
+            )
+            if sent or failed:
+                self.stdout.write(
+                    f'Sent {sent}, failed {failed} in {time.perf_counter() - started:.2f}s'
+                )
+            if options['once']:
+                return
+            # Long-running: drop connections that outlived CONN_MAX_AGE or broke
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,81 @@
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .profiling import QueryRecorder, local_store
+from .routers import PRIMARY_PIN_COOKIE, PRIMARY_PIN_SECONDS, has_replica
+
+
+class ProfilingMiddleware:
+    """
+    Record per-endpoint latency, query count, DB time and response size.
+
+    Disabled unless settings.API_PROFILING is true, in which case Django
+    drops the middleware at startup and requests pay nothing for it. It is
+    sync only: under ASGI, profiled requests run in a thread.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'API_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.store = local_store()
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        wall_ms = (time.perf_counter() - start) * 1000
+
+        match = request.resolver_match
+        endpoint = match.url_name if match and match.url_name else 'unresolved'
+        size = 0 if response.streaming else len(response.content)
+        sample = (round(wall_ms, 3), recorder.queries, round(recorder.db_time * 1000, 3), size)
+        request_info = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'at': time.time(),
+        }
+        self.store.record(endpoint, sample, request_info, recorder.sql)
+        return response
+
+
+class PrimaryPinMiddleware:
+    """
+    Keep a client's reads on the primary for PRIMARY_PIN_SECONDS after a
+    successful write, so replica lag never hides their own changes (see
+    api.routers). Removed at startup when no replica is configured.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not has_replica():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.pin(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.pin(request, await self.get_response(request))
+
+    def pin(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            response.set_cookie(
+                PRIMARY_PIN_COOKIE, f'{time.time() + PRIMARY_PIN_SECONDS:.3f}',
+                max_age=PRIMARY_PIN_SECONDS, httponly=True, samesite='Lax'
+            )
+        return response
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.9 on 2026-10-17 20:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counts(apps, schema_editor):
+    Card = apps.get_model('api', 'Card')
+    Deck = apps.get_model('api', 'Deck')
+    Subject = apps.get_model('api', 'Subject')
+
+    card_counts = Card.objects.filter(deck=OuterRef('pk')).order_by().values('deck').annotate(n=Count('id')).values('n')
+    Deck.objects.update(card_count=Coalesce(Subquery(card_counts), 0))
+
+    deck_counts = Deck.objects.filter(subject=OuterRef('pk')).order_by().values('subject').annotate(n=Count('id')).values('n')
+    Subject.objects.update(deck_count=Coalesce(Subquery(deck_counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_deck_created_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deck',
+            name='card_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='deck_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
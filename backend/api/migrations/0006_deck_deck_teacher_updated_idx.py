@@ -0,0 +1,17 @@
+# Generated by Django 5.2.9 on 2026-10-17 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_deck_card_count_subject_deck_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deck',
+            index=models.Index(fields=['teacher', '-updated_at', '-id'], name='deck_teacher_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+
+SQLITE_CREATE = """
+    CREATE VIRTUAL TABLE api_deck_search USING fts5(
+        title, body, prefix = '3 4', tokenize = 'porter unicode61 remove_diacritics 2'
+    )
+"""
+
+SQLITE_POPULATE = """
+    INSERT INTO api_deck_search (rowid, title, body)
+    SELECT d.id, d.title, COALESCE((
+        SELECT group_concat(c.question || ' ' || c.answer, char(10))
+        FROM api_card c WHERE c.deck_id = d.id
+    ), '')
+    FROM api_deck d
+"""
+
+POSTGRES_CREATE = [
+    """
+    CREATE TABLE api_deck_search (
+        deck_id bigint PRIMARY KEY REFERENCES api_deck (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        document tsvector NOT NULL
+    )
+    """,
+    'CREATE INDEX api_deck_search_document_idx ON api_deck_search USING gin (document)',
+]
+
+POSTGRES_POPULATE = """
+    INSERT INTO api_deck_search (deck_id, document)
+    SELECT d.id,
+        setweight(to_tsvector('english', d.title), 'A') ||
+        setweight(to_tsvector('english', COALESCE((
+            SELECT string_agg(c.question || ' ' || c.answer, E'\\n')
+            FROM api_card c WHERE c.deck_id = d.id
+        ), '')), 'B')
+    FROM api_deck d
+"""
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for statement in POSTGRES_CREATE:
+            schema_editor.execute(statement)
+        schema_editor.execute(POSTGRES_POPULATE)
+    else:
+        schema_editor.execute(SQLITE_CREATE)
+        schema_editor.execute(SQLITE_POPULATE)
+
+
+def drop_search_index(apps, schema_editor):
+    schema_editor.execute('DROP TABLE api_deck_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_deck_deck_teacher_updated_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
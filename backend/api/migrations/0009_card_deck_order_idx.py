@@ -0,0 +1,29 @@
+# Generated by Django 5.2.9 on 2026-10-17 22:04
+
+from django.db import migrations, models
+
+# Existing decks are numbered 0, 1, 2...; space them ORDER_GAP apart so cards
+# can be inserted between them
+SPREAD_ORDERS = """
+    UPDATE api_card SET "order" = ranked.position * 1024
+    FROM (
+        SELECT id, ROW_NUMBER() OVER (PARTITION BY deck_id ORDER BY "order", id) - 1 AS position
+        FROM api_card
+    ) AS ranked
+    WHERE api_card.id = ranked.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_outboundemail'),
+    ]
+
+    operations = [
+        migrations.RunSQL(SPREAD_ORDERS, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['deck', 'order'], name='card_deck_order_idx'),
+        ),
+    ]
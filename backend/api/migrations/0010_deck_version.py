@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-17 22:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_card_deck_order_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deck',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='deck',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1, editable=False),
+        ),
+    ]
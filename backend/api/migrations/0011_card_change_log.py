@@ -0,0 +1,37 @@
+# Generated by Django 5.2.9 on 2026-10-17 22:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Card writes before this migration were not logged, so existing decks can
+# only be synced from their current version on
+START_LOGS = 'UPDATE api_deck SET changes_since = version'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_deck_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deck',
+            name='changes_since',
+            field=models.PositiveBigIntegerField(default=1, editable=False),
+        ),
+        migrations.RunSQL(START_LOGS, migrations.RunSQL.noop),
+        migrations.CreateModel(
+            name='CardChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField()),
+                ('card_id', models.BigIntegerField()),
+                ('op', models.CharField(choices=[('insert', 'Insert'), ('update', 'Update'), ('delete', 'Delete')], max_length=6)),
+                ('deck', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='card_changes', to='api.deck')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['deck', 'version'], name='cardchange_deck_version_idx')],
+            },
+        ),
+    ]
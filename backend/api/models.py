@@ -1,7 +1,35 @@
-from django.db import models
+import hashlib
+import json
+import re
+import secrets
+from collections import Counter
+from contextlib import nullcontext
+
+from django.db import IntegrityError, connection, models, router, transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Length
+from django.utils import timezone
 from django.contrib.auth.hashers import make_password, check_password
 from slugify import slugify
 
+from . import search
+
+# Rows per INSERT/UPDATE statement for bulk card writes (keeps SQLite under its variable limit)
+CARD_BATCH_SIZE = 500
+
+# Card.order values are spaced this far apart, so a card can be inserted or
+# moved between two others by giving it the midpoint, without touching them
+ORDER_GAP = 1024
+
+# A deck's card change log keeps this many versions of history (see api.sync);
+# it is trimmed once every CHANGE_LOG_COMPACT_EVERY versions
+CHANGE_LOG_VERSIONS = 200
+CHANGE_LOG_COMPACT_EVERY = 50
+
+# Slugs are base-N; the base is cut short enough for any suffix to fit in 250
+SLUG_BASE_LENGTH = 200
+SLUG_ATTEMPTS = 4
+
 
 class Teacher(models.Model):
     name = models.CharField(max_length=100)
@@ -9,11 +37,34 @@ class Teacher(models.Model):
     password = models.CharField(max_length=255)  # hashed
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Signed-in teachers are DRF's request.user (see api.authentication)
+    is_authenticated = True
+    is_anonymous = False
+    is_staff = False
+
     def set_password(self, raw_password):
         self.password = make_password(raw_password)
 
     def check_password(self, raw_password):
-        return check_password(raw_password, self.password)
+        """Check raw_password, rehashing it if the hasher or its cost setting changed"""
+        def rehash(raw_password):
+            self.set_password(raw_password)
+            self.save(update_fields=['password'])
+
+        return check_password(raw_password, self.password, rehash)
+
+    @classmethod
+    def authenticate(cls, email, password):
+        """
+        The teacher with these credentials, or None. An unknown email costs
+        one password hash too, so response times do not reveal which
+        emails have accounts.
+        """
+        teacher = cls.objects.filter(email=email).first()
+        if teacher is None:
+            make_password(password)
+            return None
+        return teacher if teacher.check_password(password) else None
 
     def __str__(self):
         return self.name
@@ -22,10 +73,20 @@ class Teacher(models.Model):
 class Subject(models.Model):
     name = models.CharField(max_length=100)
     teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, related_name='subjects')
+    deck_count = models.PositiveIntegerField(default=0, editable=False)  # maintained by api.signals
+
+    # Kept up to date with F() updates; a full save() from an instance
+    # loaded before one of those must not write it back
+    MAINTAINED_FIELDS = ('deck_count',)
 
     class Meta:
         unique_together = ['name', 'teacher']
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = saved_fields(self)
+        return super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.name} ({self.teacher.name})"
 
@@ -42,30 +103,461 @@ class Deck(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_public = models.BooleanField(default=True)
+    card_count = models.PositiveIntegerField(default=0, editable=False)  # maintained by Card writes
+    # Moves on by one with every save; the ETag and cache key of the deck
+    version = models.PositiveBigIntegerField(default=1, editable=False)
+    # cards_hash() of the cards as last written by sync_cards, '' when unknown
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
+    # The card change log holds every card write after this version
+    changes_since = models.PositiveBigIntegerField(default=1, editable=False)
+
+    # Kept up to date with F() and queryset updates; a full save() from an
+    # instance loaded before one of those must not write them back
+    MAINTAINED_FIELDS = ('card_count', 'content_hash', 'changes_since')
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a teacher's decks (see api.pagination.DeckPagination)
+            models.Index(fields=['teacher', '-updated_at', '-id'], name='deck_teacher_updated_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base_slug = slugify(self.title)
-            unique_slug = base_slug
-            counter = 1
-            while Deck.objects.filter(slug=unique_slug).exists():
-                unique_slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = unique_slug
-        super().save(*args, **kwargs)
+        if not self._state.adding:
+            return self._save_next_version(*args, **kwargs)
+        if self.slug:
+            return super().save(*args, **kwargs)
+
+        base_slug = slugify(self.title, max_length=SLUG_BASE_LENGTH) or 'deck'
+        for attempt in range(SLUG_ATTEMPTS):
+            # A concurrent save may take the same slug between the lookup and
+            # the insert; the savepoint keeps the outer transaction usable
+            self.slug = next_slug(base_slug) if attempt < SLUG_ATTEMPTS - 1 else random_slug(base_slug)
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if attempt == SLUG_ATTEMPTS - 1 or not Deck.objects.filter(slug=self.slug).exists():
+                    self.slug = ''
+                    raise
+
+    def _save_next_version(self, *args, **kwargs):
+        """
+        Update the row with version moved on by one in the database, so
+        concurrent saves each get a number of their own, and read back the
+        number this save got. The save runs in a transaction of its own when
+        there is none, so on_commit callbacks (see api.cache) run after the
+        read-back rather than straight away with version still an expression.
+        """
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            update_fields = saved_fields(self)
+        elif not update_fields:
+            return super().save(*args, **kwargs)
+        kwargs['update_fields'] = [*update_fields, 'version']
+        using = kwargs.get('using') or router.db_for_write(Deck, instance=self)
+        in_transaction = transaction.get_connection(using).in_atomic_block
+        previous, self.version = self.version, F('version') + 1
+        try:
+            with nullcontext() if in_transaction else transaction.atomic(using=using):
+                super().save(*args, **kwargs)
+                self.refresh_from_db(fields=['version'])
+        except BaseException:
+            self.version = previous
+            raise
+
+    def confirm_version(self, expected):
+        """
+        Raise VersionConflict if a write other than this request's own got
+        in since the client read version expected. Called after the deck was
+        saved inside the request's transaction, which the raise rolls back;
+        the save holds the row lock, so no write can slip in after the check.
+        """
+        if expected is not None and self.version > expected + 1:
+            raise VersionConflict(self.version - 1)
+
+    def sync_cards(self, cards_data, expected_version=None):
+        """
+        Replace this deck's cards with cards_data in one transaction.
+
+        Cards that carry the id of an existing card in this deck are kept and
+        only updated when their question, answer or position changed; cards
+        without a known id are inserted and missing ones deleted. All writes
+        are batched. Nothing is read or written when cards_data hashes to
+        the stored content_hash; otherwise the deck is saved, which locks its
+        row, before its cards are read and diffed. With expected_version, raises
+        VersionConflict (writing nothing) if the deck was saved since that
+        version. Returns a (created, updated, deleted) tuple of counts.
+        """
+        content_hash = cards_hash(cards_data)
+        if content_hash == self.content_hash:
+            return 0, 0, 0
+
+        with transaction.atomic():
+            # Cards are part of the deck, so editing them moves the deck's
+            # version on; saving it first also locks the row for the check,
+            # and for the read below, so a concurrent sync cannot change the
+            # cards between the diff and the writes
+            self.content_hash = content_hash
+            self.save(update_fields=['updated_at', 'content_hash'])
+            self.confirm_version(expected_version)
+
+            existing = {
+                card_id: (question, answer, order)
+                for card_id, question, answer, order
+                in self.cards.values_list('id', 'question', 'answer', 'order')
+            }
+            to_create = []
+            to_update = []
+            kept_ids = set()
+            for idx, card_data in enumerate(cards_data):
+                question = card_data.get('question', '')
+                answer = card_data.get('answer', '')
+                card_id = card_data.get('id')
+                if card_id in existing and card_id not in kept_ids:
+                    kept_ids.add(card_id)
+                    if existing[card_id] != (question, answer, idx * ORDER_GAP):
+                        to_update.append(
+                            Card(id=card_id, deck=self, question=question, answer=answer, order=idx * ORDER_GAP)
+                        )
+                else:
+                    to_create.append(Card(deck=self, question=question, answer=answer, order=idx * ORDER_GAP))
+            to_delete = [card_id for card_id in existing if card_id not in kept_ids]
+
+            if to_delete and not kept_ids:
+                self.cards.all().delete()
+            elif to_delete:
+                for start in range(0, len(to_delete), CARD_BATCH_SIZE):
+                    batch = to_delete[start:start + CARD_BATCH_SIZE]
+                    Card.objects.filter(deck=self, id__in=batch).delete()
+            if to_update:
+                Card.objects.bulk_update(to_update, ['question', 'answer', 'order'], batch_size=CARD_BATCH_SIZE)
+            if to_create:
+                Card.objects.bulk_create(to_create, batch_size=CARD_BATCH_SIZE)
+
+            self.log_card_changes(
+                inserted=[card.id for card in to_create],
+                updated=[card.id for card in to_update],
+                deleted=to_delete,
+            )
+
+        # The counter itself was updated in the database by the Card queryset
+        self.card_count = len(kept_ids) + len(to_create)
+        return len(to_create), len(to_update), len(to_delete)
+
+    def log_card_changes(self, inserted=(), updated=(), deleted=()):
+        """
+        Record card writes in the deck's change log under its current
+        version; call after the save that moved the version on, in the same
+        transaction. Every CHANGE_LOG_COMPACT_EVERY versions the entries
+        older than CHANGE_LOG_VERSIONS versions are dropped. Logged cards
+        are left out of the deck's pending card writes (see card_writes).
+        """
+        ops = ((CardChange.INSERT, inserted), (CardChange.UPDATE, updated), (CardChange.DELETE, deleted))
+        changes = [
+            CardChange(deck=self, version=self.version, card_id=card_id, op=op)
+            for op, card_ids in ops
+            for card_id in card_ids
+        ]
+        CardChange.objects.bulk_create(changes, batch_size=CARD_BATCH_SIZE)
+        card_writes(self.id).logged.update(change.card_id for change in changes)
+        if self.version % CHANGE_LOG_COMPACT_EVERY == 0:
+            self.compact_card_changes()
+
+    def compact_card_changes(self, keep=CHANGE_LOG_VERSIONS):
+        """Drop change log entries more than keep versions old"""
+        horizon = self.version - keep
+        if horizon <= self.changes_since:
+            return
+        self.card_changes.filter(version__lte=horizon).delete()
+        Deck.objects.filter(pk=self.pk, changes_since__lt=horizon).update(changes_since=horizon)
+        self.changes_since = horizon
+
+    def card_position(self, before=None, after=None, moving=None):
+        """
+        Card.order for a card placed right before the card before, right
+        after the card after, or (with neither) at the end of the deck.
+        moving is the card being moved, if any; it is not its own neighbour.
+
+        Costs one query. Only when no integer is left between the two
+        neighbours (after about ten inserts at the same spot) are the deck's
+        cards renumbered to ORDER_GAP spacing first.
+        """
+        cards = self.cards.all()
+        if moving is not None:
+            cards = cards.exclude(pk=moving.pk)
+        if before is not None:
+            upper = before.order
+            lower = cards.filter(order__lt=upper).order_by('-order').values_list('order', flat=True).first()
+        elif after is not None:
+            lower = after.order
+            upper = cards.filter(order__gt=lower).order_by('order').values_list('order', flat=True).first()
+        else:
+            lower = cards.order_by('-order').values_list('order', flat=True).first()
+            upper = None
+
+        if lower is None and upper is None:
+            return 0
+        if upper is None:
+            return lower + ORDER_GAP
+        if lower is None:
+            return upper - ORDER_GAP
+        if upper - lower > 1:
+            return (lower + upper) // 2
+        self.renumber_cards()
+        if before is not None:
+            before.refresh_from_db(fields=['order'])
+        if after is not None:
+            after.refresh_from_db(fields=['order'])
+        return self.card_position(before, after, moving)
+
+    def renumber_cards(self):
+        """
+        Respace this deck's cards ORDER_GAP apart, keeping their order. Every
+        card moves, so every card goes into the change log.
+        """
+        cards = list(self.cards.order_by('order', 'id').only('id', 'order', 'deck_id'))
+        for idx, card in enumerate(cards):
+            card.order = idx * ORDER_GAP
+        Card.objects.bulk_update(cards, ['order'], batch_size=CARD_BATCH_SIZE)
+        self.log_card_changes(updated=[card.id for card in cards])
 
     def __str__(self):
         return self.title
 
 
+class VersionConflict(Exception):
+    """A write based on an older version of a deck than the stored one"""
+
+    def __init__(self, current):
+        super().__init__(f'Deck is at version {current}')
+        self.current = current
+
+
+def cards_hash(cards_data):
+    """SHA-256 of the questions and answers of card dicts, in order"""
+    digest = hashlib.sha256()
+    for card_data in cards_data:
+        pair = [card_data.get('question', ''), card_data.get('answer', '')]
+        digest.update(json.dumps(pair).encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def next_slug(base_slug):
+    """
+    base_slug, or base_slug-N with N one above the highest suffix in use,
+    in one query. The prefix condition keeps the lookup on a slug index;
+    the regex then drops other slugs sharing the prefix ("cells-revision").
+
+    SQLite compares text byte by byte, so there the prefix is a range on the
+    unique index ('.' sorts right after '-'). PostgreSQL sorts text by the
+    database collation, where a range need not match the prefix, so there
+    it is LIKE 'prefix%', served by the varchar_pattern_ops index Django
+    creates next to the unique one.
+    """
+    if connection.vendor == 'sqlite':
+        prefix = Q(slug__gte=base_slug, slug__lt=f'{base_slug}.')
+    else:
+        prefix = Q(slug__startswith=base_slug)
+    taken = Deck.objects.filter(
+        prefix, slug__regex=rf'^{re.escape(base_slug)}(-[0-9]+)?$',
+    ).order_by(Length('slug').desc(), '-slug').values_list('slug', flat=True).first()
+    if taken is None:
+        return base_slug
+    if taken == base_slug:
+        return f'{base_slug}-1'
+    return f'{base_slug}-{int(taken.rsplit("-", 1)[1]) + 1}'
+
+
+def random_slug(base_slug):
+    """base_slug with a short random suffix, the fallback when next_slug keeps colliding"""
+    return f'{base_slug}-{secrets.token_hex(3)}'
+
+
+def saved_fields(instance):
+    """Fields a full save() of an existing row writes: all but the pk and MAINTAINED_FIELDS"""
+    return [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in instance.MAINTAINED_FIELDS
+    ]
+
+
+class _CardWrites:
+    """
+    on_commit callback publishing the card writes of one deck that were not
+    logged with Deck.log_card_changes: saves and deletes of single cards in
+    the admin, a shell or a script. The deck moves on to a new version, which
+    moves its caches on, and the writes go into its change log.
+    """
+
+    def __init__(self, deck_id):
+        self.deck_id = deck_id
+        self.ops = {}
+        self.logged = set()
+        self.done = False
+
+    def add(self, card_id, op):
+        if self.ops.get(card_id) == CardChange.INSERT and op == CardChange.UPDATE:
+            return
+        self.ops[card_id] = op
+
+    def __call__(self):
+        self.done = True
+        ops = {card_id: op for card_id, op in self.ops.items() if card_id not in self.logged}
+        if ops:
+            publish_card_writes(self.deck_id, ops)
+
+
+def card_writes(deck_id):
+    """
+    The card writes of deck_id in the open transaction, published once it
+    commits (at once outside a transaction), however many there are
+    """
+    # Django drops the callbacks of a savepoint that rolls back from this
+    # list, as in search.schedule_index
+    for _, func, _ in connection.run_on_commit:
+        if isinstance(func, _CardWrites) and func.deck_id == deck_id and not func.done:
+            return func
+    writes = _CardWrites(deck_id)
+    transaction.on_commit(writes)
+    return writes
+
+
+def publish_card_writes(deck_id, ops):
+    """Move a deck on to a new version for {card_id: op} card writes and log them"""
+    with transaction.atomic():
+        deck = Deck.objects.filter(pk=deck_id).first()
+        if deck is None:
+            return
+        # The cards no longer match the stored hash
+        deck.content_hash = ''
+        deck.save(update_fields=['updated_at', 'content_hash'])
+        deck.log_card_changes(**{
+            key: [card_id for card_id, op in ops.items() if op == value]
+            for key, value in (
+                ('inserted', CardChange.INSERT), ('updated', CardChange.UPDATE), ('deleted', CardChange.DELETE)
+            )
+        })
+
+
+def adjust_card_counts(counts, sign=1):
+    """Apply {deck_id: n} card count deltas with F() updates"""
+    for deck_id, n in counts.items():
+        Deck.objects.filter(pk=deck_id).update(card_count=F('card_count') + sign * n)
+
+
+class CardQuerySet(models.QuerySet):
+    """
+    Keeps Deck.card_count and the search index in sync for bulk writes,
+    which send no signals.
+
+    Deletes are handled here rather than with a post_delete receiver: any
+    delete receiver on Card would stop Django fast-deleting a deck's cards
+    and instead load and signal every row.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            counts = Counter(card.deck_id for card in created)
+            adjust_card_counts(counts)
+            for deck_id in counts:
+                search.schedule_index(deck_id)
+        return created
+
+    def bulk_update(self, objs, *args, **kwargs):
+        objs = list(objs)
+        result = super().bulk_update(objs, *args, **kwargs)
+        for deck_id in {card.deck_id for card in objs}:
+            search.schedule_index(deck_id)
+        return result
+
+    def delete(self):
+        with transaction.atomic(using=self.db, savepoint=False):
+            counts = dict(self.order_by().values_list('deck').annotate(n=Count('id')))
+            result = super().delete()
+            adjust_card_counts(counts, sign=-1)
+            for deck_id in counts:
+                search.schedule_index(deck_id)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Card(models.Model):
     deck = models.ForeignKey(Deck, on_delete=models.CASCADE, related_name='cards')
     question = models.TextField()
     answer = models.TextField()
     order = models.IntegerField(default=0)
 
+    objects = CardQuerySet.as_manager()
+
     class Meta:
         ordering = ['order']
+        indexes = [
+            models.Index(fields=['deck', 'order'], name='card_deck_order_idx'),
+        ]
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            card_writes(self.deck_id).add(self.pk, CardChange.DELETE)
+            result = super().delete(*args, **kwargs)
+            adjust_card_counts({self.deck_id: 1}, sign=-1)
+            search.schedule_index(self.deck_id)
+        return result
 
     def __str__(self):
         return f"{self.question[:50]}..."
+
+
+class CardChange(models.Model):
+    """One card insert, update or delete in a deck's change log (see api.sync)"""
+    INSERT = 'insert'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    OP_CHOICES = [(INSERT, 'Insert'), (UPDATE, 'Update'), (DELETE, 'Delete')]
+
+    deck = models.ForeignKey(Deck, on_delete=models.CASCADE, related_name='card_changes')
+    version = models.PositiveBigIntegerField()  # Deck.version the write produced
+    card_id = models.BigIntegerField()  # Not a foreign key: deleted cards stay in the log
+    op = models.CharField(max_length=6, choices=OP_CHOICES)
+
+    class Meta:
+        indexes = [
+            # The changes-since query of api.sync and compaction
+            models.Index(fields=['deck', 'version'], name='cardchange_deck_version_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.op} card {self.card_id} at v{self.version}'
+
+
+class OutboundEmail(models.Model):
+    """A message in the outbox, delivered by the send_emails worker (see api.email_service)"""
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENDING, 'Sending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    to = models.EmailField()
+    subject = models.CharField(max_length=200)
+    html = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # When a pending message is due, or when a claimed one may be claimed again
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    provider_id = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's claim query: due messages that are not done yet
+            models.Index(fields=['status', 'next_attempt_at'], name='email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to} ({self.status})"
@@ -0,0 +1,117 @@
+"""
+Keyset (cursor) pagination for teacher listings.
+
+Pages are fetched with a WHERE clause on the last row seen instead of an
+OFFSET, so every page costs the same index range scan however deep the
+client has paged. The cursor holds the full ordering key including the
+primary key, so rows that share a timestamp never repeat or go missing.
+
+A deck edited while a client walks the pages moves to the front of the
+ordering; it is not returned twice, and shows up first on the next walk.
+
+Pagination is opt-in: requests without ``cursor`` or ``page_size`` get the
+unpaginated list the dashboard has always used.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    ordering = ('-id',)
+    page_size = 50
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(queryset.model, params.get(self.cursor_query_param))
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+
+        # One extra row tells us whether there is a next page
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def after(self, position):
+        """Q matching rows strictly after position in self.ordering"""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def encode_cursor(self, row):
+        values = []
+        for field in self.ordering:
+            value = getattr(row, field.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, model, cursor):
+        if not cursor:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+            # to_python() passes null through, and no row comes after it
+            if None in position:
+                raise ValueError
+            return position
+        except (TypeError, ValueError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+class DeckPagination(KeysetPagination):
+    """Most recently edited first, backed by the (teacher, updated_at, id) index"""
+    ordering = ('-updated_at', '-id')
+
+
+class SubjectPagination(KeysetPagination):
+    ordering = ('id',)
@@ -0,0 +1,181 @@
+"""
+Opt-in request profiling for the API.
+
+When settings.API_PROFILING is on, ProfilingMiddleware records wall time,
+query count, DB time and response size for every request, grouped by the
+resolved URL name (public-deck, deck-list, deck-update-cards, ...). Each
+gunicorn worker keeps a rolling window of samples in memory and periodically
+flushes a snapshot to the cache, so the stats endpoint and the api_profile
+management command see every worker as long as the cache is shared (the
+file-based cache in settings_prod).
+
+A request flushes when API_PROFILING_FLUSH_SECONDS have passed since the
+last flush. Otherwise it starts a timer thread that flushes once they have,
+so the last requests before a worker goes idle still reach the cache, and
+the worker flushes once more when it exits.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+WORKERS_KEY = 'profiling:workers'
+GENERATION_KEY = 'profiling:generation'
+SNAPSHOT_TIMEOUT = 60 * 60 * 24  # 24 hours
+
+# Index of each metric inside a stored sample tuple
+METRICS = ('wall_ms', 'queries', 'db_ms', 'bytes')
+
+
+def _worker_key(pid):
+    return f'profiling:worker:{pid}'
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class QueryRecorder:
+    """Database execute wrapper counting and timing the queries of one request"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.sql = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += elapsed
+            self.sql.append({'sql': sql, 'ms': round(elapsed * 1000, 3)})
+
+
+class ProfileStore:
+    """Per-worker rolling samples plus the slowest requests seen"""
+
+    def __init__(self):
+        self.window = getattr(settings, 'API_PROFILING_WINDOW', 1000)
+        self.keep_slowest = getattr(settings, 'API_PROFILING_SLOWEST', 20)
+        self.flush_interval = getattr(settings, 'API_PROFILING_FLUSH_SECONDS', 10)
+        self.samples = defaultdict(lambda: deque(maxlen=self.window))
+        self.slowest = []
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.unflushed = False
+        self.timer = None
+        self.generation = cache.get(GENERATION_KEY, 0)
+
+    def record(self, endpoint, sample, request_info, sql):
+        with self.lock:
+            self.samples[endpoint].append(sample)
+            if len(self.slowest) < self.keep_slowest or sample[0] > self.slowest[-1]['wall_ms']:
+                self.slowest.append({
+                    'endpoint': endpoint,
+                    **dict(zip(METRICS, sample)),
+                    **request_info,
+                    'sql': sql,
+                })
+                self.slowest.sort(key=lambda entry: entry['wall_ms'], reverse=True)
+                del self.slowest[self.keep_slowest:]
+            self.unflushed = True
+            wait = self.flush_interval - (time.monotonic() - self.last_flush)
+            if wait > 0 and self.timer is None:
+                self.timer = threading.Timer(wait, self.flush_pending)
+                self.timer.daemon = True
+                self.timer.start()
+        if wait <= 0:
+            self.flush()
+
+    def flush_pending(self):
+        """Flush if samples were recorded since the last flush"""
+        with self.lock:
+            self.timer = None
+            pending = self.unflushed
+        if pending:
+            self.flush()
+
+    def flush(self):
+        generation = cache.get(GENERATION_KEY, 0)
+        with self.lock:
+            if generation != self.generation:
+                # Stats were reset since the last flush; start a fresh window
+                self.samples.clear()
+                self.slowest = []
+                self.generation = generation
+            snapshot = {
+                'samples': {endpoint: list(values) for endpoint, values in self.samples.items()},
+                'slowest': list(self.slowest),
+            }
+            self.last_flush = time.monotonic()
+            self.unflushed = False
+        pid = os.getpid()
+        cache.set(_worker_key(pid), snapshot, SNAPSHOT_TIMEOUT)
+        workers = cache.get(WORKERS_KEY, set())
+        if pid not in workers:
+            cache.set(WORKERS_KEY, workers | {pid}, SNAPSHOT_TIMEOUT)
+
+
+_local_store = None
+
+
+def local_store():
+    """The ProfileStore of this worker process"""
+    global _local_store
+    if _local_store is None:
+        _local_store = ProfileStore()
+        atexit.register(_local_store.flush_pending)
+    return _local_store
+
+
+def _snapshots():
+    workers = cache.get(WORKERS_KEY, set())
+    snapshots = cache.get_many([_worker_key(pid) for pid in workers])
+    return list(snapshots.values())
+
+
+def summarize():
+    """Merge all worker snapshots into p50/p95/p99/max per endpoint and metric"""
+    merged = defaultdict(list)
+    for snapshot in _snapshots():
+        for endpoint, samples in snapshot['samples'].items():
+            merged[endpoint].extend(samples)
+
+    summary = {}
+    for endpoint, samples in sorted(merged.items()):
+        stats = {'count': len(samples)}
+        for index, metric in enumerate(METRICS):
+            values = sorted(sample[index] for sample in samples)
+            stats[metric] = {
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+                'max': values[-1],
+            }
+        summary[endpoint] = stats
+    return summary
+
+
+def slowest_requests(limit=10):
+    """Slowest requests across all workers, with the SQL they ran"""
+    entries = [entry for snapshot in _snapshots() for entry in snapshot['slowest']]
+    entries.sort(key=lambda entry: entry['wall_ms'], reverse=True)
+    return entries[:limit]
+
+
+def reset():
+    """Drop every stored snapshot; live workers discard their windows on next flush"""
+    workers = cache.get(WORKERS_KEY, set())
+    cache.delete_many([_worker_key(pid) for pid in workers] + [WORKERS_KEY])
+    cache.set(GENERATION_KEY, cache.get(GENERATION_KEY, 0) + 1, None)
@@ -0,0 +1,91 @@
+"""
+Database router sending public read traffic to a read replica.
+
+When settings.DATABASES has a 'replica' alias, views wrapped in
+read_from_replica (public_deck and DeckViewSet.retrieve) run their queries
+on it; every other read and all writes use 'default', the primary. Without
+a replica the router changes nothing.
+
+Replicas lag the primary slightly. The public deck cache tolerates that:
+a payload rendered from a stale replica row is stored under the old
+version, which the cache pointer has already moved past. For the teacher
+who just saved, PrimaryPinMiddleware (api.middleware) sets a short-lived
+cookie after every successful write, and while it is present their reads
+stay on the primary so they see their own changes.
+"""
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.views import View
+
+REPLICA_ALIAS = 'replica'
+
+# Seconds a client's reads stay on the primary after it wrote something
+PRIMARY_PIN_SECONDS = 5
+PRIMARY_PIN_COOKIE = 'primary_until'
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def has_replica():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PRIMARY_PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def read_from_replica(view):
+    """Run a read-only view (function, async function or viewset method) on the replica"""
+
+    if iscoroutinefunction(view):
+        # sync_to_async copies the context, so the ORM's threads see the flag
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not has_replica() or is_pinned(request):
+                return await view(request, *args, **kwargs)
+            token = _use_replica.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _use_replica.reset(token)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        request = args[1] if isinstance(args[0], View) else args[0]
+        if not has_replica() or is_pinned(request):
+            return view(*args, **kwargs)
+        token = _use_replica.set(True)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and has_replica():
+            return REPLICA_ALIAS
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is migrated through replication, never directly
+        return db != REPLICA_ALIAS
+
@@ -0,0 +1,308 @@
+"""
+Full-text search over public decks.
+
+The index holds one row per deck with its title and the text of all its
+cards: an FTS5 virtual table on SQLite, or a weighted tsvector with a GIN
+index on PostgreSQL (both named api_deck_search, created in migration 0007).
+Rows are rebuilt after commit whenever a deck's title or cards change (see
+api.signals and CardQuerySet), once per deck however many writes the
+transaction made, so searching never scans api_card.
+
+A search runs a facet query (which also yields the total) and a page
+query. Narrow searches are ranked by bm25/ts_rank over every match; broad
+ones, where ranking every match would dominate the request, list decks
+whose title matches first (ranked), then the remaining matches newest
+first. Only the requested page is loaded through the ORM.
+"""
+import re
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import partial
+
+from django.db import connection, transaction
+from django.db.models import Count
+
+FACET_FIELDS = ('subject', 'exam_board', 'year_group', 'target_grade')
+MAX_TERMS = 10
+# Searches with more matches than this skip full ranking (see module docstring)
+RANKED_MATCH_LIMIT = 2000
+# Shortest stem accepted for an explicit prefix search such as ``photo*``
+MIN_PREFIX_LENGTH = 3
+
+# Relative weight of a deck's title against its card text when ranking
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+_SQLITE_DOCUMENT = """
+    SELECT d.id, d.title, COALESCE((
+        SELECT group_concat(c.question || ' ' || c.answer, char(10))
+        FROM api_card c WHERE c.deck_id = d.id
+    ), '')
+    FROM api_deck d
+"""
+
+_POSTGRES_DOCUMENT = """
+    SELECT d.id,
+        setweight(to_tsvector('english', d.title), 'A') ||
+        setweight(to_tsvector('english', COALESCE((
+            SELECT string_agg(c.question || ' ' || c.answer, E'\\n')
+            FROM api_card c WHERE c.deck_id = d.id
+        ), '')), 'B')
+    FROM api_deck d
+"""
+
+
+def search_terms(query):
+    """
+    Split free text into at most MAX_TERMS lower-cased (word, is_prefix) terms.
+    A trailing ``*`` on a word of MIN_PREFIX_LENGTH or more makes it a prefix.
+    """
+    return [
+        (word, bool(star) and len(word) >= MIN_PREFIX_LENGTH)
+        for word, star in re.findall(r'(\w+)(\*?)', query.lower())
+    ][:MAX_TERMS]
+
+
+def index_deck(deck_id):
+    """Rebuild the index row of one deck from its title and cards"""
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f'INSERT INTO api_deck_search (deck_id, document) {_POSTGRES_DOCUMENT} WHERE d.id = %s '
+                'ON CONFLICT (deck_id) DO UPDATE SET document = EXCLUDED.document',
+                [deck_id]
+            )
+        else:
+            cursor.execute('DELETE FROM api_deck_search WHERE rowid = %s', [deck_id])
+            cursor.execute(
+                f'INSERT INTO api_deck_search (rowid, title, body) {_SQLITE_DOCUMENT} WHERE d.id = %s',
+                [deck_id]
+            )
+
+
+def remove_deck(deck_id):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('DELETE FROM api_deck_search WHERE deck_id = %s', [deck_id])
+        else:
+            cursor.execute('DELETE FROM api_deck_search WHERE rowid = %s', [deck_id])
+
+
+_deferred = threading.local()
+
+
+class _Reindex:
+    """on_commit callback rebuilding the index row of one deck"""
+
+    def __init__(self, deck_id):
+        self.deck_id = deck_id
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        index_deck(self.deck_id)
+
+
+def _index_scheduled(deck_id):
+    """Whether the open transaction already reindexes deck_id when it commits"""
+    # Django drops the callbacks of a savepoint that rolls back from this
+    # list, so a reindex scheduled there does not count
+    return any(
+        isinstance(func, _Reindex) and func.deck_id == deck_id and not func.done
+        for _, func, _ in connection.run_on_commit
+    )
+
+
+def schedule_index(deck_id):
+    """Reindex a deck once the current transaction commits, once however often it is scheduled"""
+    pending = getattr(_deferred, 'deck_ids', None)
+    if pending is not None:
+        pending.add(deck_id)
+    elif not _index_scheduled(deck_id):
+        transaction.on_commit(_Reindex(deck_id))
+
+
+@contextmanager
+def deferred_indexing():
+    """
+    Reindex each deck touched inside the block once, at the end, instead of
+    after every transaction (e.g. a bulk import committing batch by batch)
+    """
+    if getattr(_deferred, 'deck_ids', None) is not None:
+        yield
+        return
+    _deferred.deck_ids = set()
+    try:
+        yield
+    finally:
+        deck_ids, _deferred.deck_ids = _deferred.deck_ids, None
+        for deck_id in deck_ids:
+            schedule_index(deck_id)
+
+
+def schedule_remove(deck_id):
+    transaction.on_commit(partial(remove_deck, deck_id))
+
+
+def rebuild_index():
+    """Rebuild every row of the index in bulk; returns the number of decks indexed"""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM api_deck_search')
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'INSERT INTO api_deck_search (deck_id, document) {_POSTGRES_DOCUMENT}')
+        else:
+            cursor.execute(f'INSERT INTO api_deck_search (rowid, title, body) {_SQLITE_DOCUMENT}')
+        return cursor.rowcount
+
+
+def _match_sql(terms, title_only=False):
+    """FROM clause, WHERE clause, rank expression and params matching every term"""
+    if connection.vendor == 'postgresql':
+        # The title is stored with weight A, card text with weight B
+        weight = 'A' if title_only else ''
+        tsquery = ' & '.join(
+            f"'{word}':{'*' if prefix else ''}{weight}".rstrip(':') for word, prefix in terms
+        )
+        return (
+            'api_deck_search JOIN api_deck d ON d.id = api_deck_search.deck_id '
+            "CROSS JOIN to_tsquery('english', %s) q",
+            'api_deck_search.document @@ q',
+            'ts_rank(api_deck_search.document, q, 1)',
+            [tsquery],
+        )
+    # Quote every term so user input can never be parsed as FTS5 syntax
+    match = ' '.join(f'"{word}"' + ('*' if prefix else '') for word, prefix in terms)
+    if title_only:
+        match = f'title : ({match})'
+    return (
+        'api_deck_search JOIN api_deck d ON d.id = api_deck_search.rowid',
+        'api_deck_search MATCH %s',
+        f'-bm25(api_deck_search, {TITLE_WEIGHT}, {BODY_WEIGHT})',
+        [match],
+    )
+
+
+def _filter_sql(filters):
+    """WHERE clause and params restricting decks to public ones matching filters"""
+    sql = 'd.is_public = %s'
+    params = [True]
+    for field, value in filters.items():
+        if field == 'subject':
+            sql += ' AND d.subject_id IN (SELECT id FROM api_subject WHERE name = %s)'
+        else:
+            sql += f' AND d.{field} = %s'
+        params.append(value)
+    return sql, params
+
+
+def _select_ids(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _tally(rows):
+    """(total, {facet: Counter}) from grouped (subject, board, year, grade, count) rows"""
+    total = 0
+    facets = defaultdict(Counter)
+    for *values, count in rows:
+        total += count
+        for field, value in zip(FACET_FIELDS, values):
+            if value:
+                facets[field][value] += count
+    return total, facets
+
+
+def _facet_counts(terms, filters):
+    """(total, {facet: Counter}) over every match, grouped in the database"""
+    source, condition, _, params = _match_sql(terms)
+    where, filter_params = _filter_sql(filters)
+    rows = _select_ids(
+        'SELECT sub.name, g.exam_board, g.year_group, g.target_grade, g.n FROM ('
+        f'SELECT d.subject_id, d.exam_board, d.year_group, d.target_grade, COUNT(*) AS n '
+        f'FROM {source} WHERE {condition} AND {where} GROUP BY 1, 2, 3, 4'
+        ') g JOIN api_subject sub ON sub.id = g.subject_id',
+        params + filter_params
+    )
+    return _tally(rows)
+
+
+def _ranked_page(terms, filters, limit, offset, title_only=False):
+    """[(id, rank)] of one page of matches ordered by rank"""
+    source, condition, rank, params = _match_sql(terms, title_only)
+    where, filter_params = _filter_sql(filters)
+    return _select_ids(
+        f'SELECT d.id, {rank} AS score FROM {source} WHERE {condition} AND {where} '
+        'ORDER BY score DESC, d.id DESC LIMIT %s OFFSET %s',
+        params + filter_params + [limit, offset]
+    )
+
+
+def _broad_page(terms, filters, limit, offset):
+    """
+    [(id, rank)] of one page of a broad search: title matches ranked first,
+    then decks matching only in their cards, newest first and unranked.
+    """
+    source, condition, _, params = _match_sql(terms, title_only=True)
+    where, filter_params = _filter_sql(filters)
+    title_matches = _select_ids(
+        f'SELECT COUNT(*) FROM {source} WHERE {condition} AND {where}', params + filter_params
+    )[0][0]
+
+    page = []
+    if offset < title_matches:
+        page = _ranked_page(terms, filters, limit, offset, title_only=True)
+    remaining = limit - len(page)
+    if remaining > 0:
+        body_source, body_condition, _, body_params = _match_sql(terms)
+        title_source, title_condition, _, _ = _match_sql(terms, title_only=True)
+        page += [
+            (deck_id, None) for deck_id, in _select_ids(
+                f'SELECT d.id FROM {body_source} WHERE {body_condition} AND {where} '
+                f'AND d.id NOT IN (SELECT d.id FROM {title_source} WHERE {title_condition}) '
+                'ORDER BY d.updated_at DESC, d.id DESC LIMIT %s OFFSET %s',
+                body_params + filter_params + params + [remaining, max(offset - title_matches, 0)]
+            )
+        ]
+    return page
+
+
+def search_decks(query, filters, limit=20, offset=0):
+    """
+    Search public decks.
+
+    Returns (decks, total, facets): the requested page of Deck objects (each
+    with a ``rank`` attribute, None when unranked), the number of matching
+    decks and {facet: {value: count}} over all matches. An empty query lists
+    matching decks newest first.
+    """
+    from .models import Deck
+
+    terms = search_terms(query)
+    if terms:
+        total, facets = _facet_counts(terms, filters)
+        if total <= RANKED_MATCH_LIMIT:
+            page = _ranked_page(terms, filters, limit, offset)
+        else:
+            page = _broad_page(terms, filters, limit, offset)
+    else:
+        queryset = Deck.objects.filter(is_public=True)
+        for field, value in filters.items():
+            queryset = queryset.filter(**{'subject__name' if field == 'subject' else field: value})
+        total, facets = _tally(queryset.order_by().values_list(
+            'subject__name', 'exam_board', 'year_group', 'target_grade'
+        ).annotate(n=Count('id')))
+        page = [
+            (deck_id, None) for deck_id in
+            queryset.order_by('-updated_at', '-id').values_list('id', flat=True)[offset:offset + limit]
+        ]
+
+    decks = Deck.objects.select_related('subject', 'teacher').in_bulk([deck_id for deck_id, _ in page])
+    results = []
+    for deck_id, rank in page:
+        deck = decks[deck_id]
+        deck.rank = rank
+        results.append(deck)
+
+    return results, total, {field: dict(facets[field].most_common()) for field in FACET_FIELDS}
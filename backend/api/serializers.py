@@ -1,6 +1,7 @@
 import re
+from django.db import transaction
 from rest_framework import serializers
-from .models import Teacher, Subject, Deck, Card
+from .models import Teacher, Subject, Deck, Card, CARD_BATCH_SIZE, ORDER_GAP, cards_hash
 
 
 def validate_password_strength(password):
@@ -39,6 +40,14 @@ class CardSerializer(serializers.ModelSerializer):
     class Meta:
         model = Card
         fields = ['id', 'question', 'answer', 'order']
+        # Positions are assigned by the deck (see Deck.card_position)
+        read_only_fields = ['order']
+
+    def update(self, instance, validated_data):
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
 
 
 class DeckSerializer(serializers.ModelSerializer):
@@ -52,7 +61,8 @@ class DeckSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'slug', 'subject', 'subject_name',
             'teacher', 'teacher_name', 'exam_board', 'year_group',
-            'target_grade', 'created_by', 'display_author', 'created_at', 'updated_at', 'is_public', 'cards'
+            'target_grade', 'created_by', 'display_author', 'created_at', 'updated_at', 'version',
+            'is_public', 'cards'
         ]
         read_only_fields = ['slug', 'created_at', 'updated_at', 'teacher']
 
@@ -61,10 +71,17 @@ class DeckSerializer(serializers.ModelSerializer):
         return obj.created_by if obj.created_by else obj.teacher.name
 
 
+class DeckHeaderSerializer(DeckSerializer):
+    """A deck's own fields as DeckSerializer gives them, without the cards"""
+    cards = None
+
+    class Meta(DeckSerializer.Meta):
+        fields = [field for field in DeckSerializer.Meta.fields if field != 'cards'] + ['card_count']
+
+
 class DeckListSerializer(serializers.ModelSerializer):
     """Lighter serializer for list views (no cards)"""
     subject_name = serializers.CharField(source='subject.name', read_only=True)
-    card_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Deck
@@ -74,8 +91,42 @@ class DeckListSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'is_public', 'card_count'
         ]
 
-    def get_card_count(self, obj):
-        return obj.cards.count()
+
+class DeckMetadataSerializer(serializers.ModelSerializer):
+    """
+    PATCH payload and response for a deck's own fields. Saves only the
+    fields that were sent and never touches the cards.
+    """
+    subject_name = serializers.CharField(source='subject.name', read_only=True)
+
+    class Meta:
+        model = Deck
+        fields = [
+            'id', 'title', 'slug', 'subject', 'subject_name',
+            'exam_board', 'year_group', 'target_grade', 'created_by',
+            'updated_at', 'version', 'is_public', 'card_count'
+        ]
+        read_only_fields = ['slug', 'updated_at']
+
+    def update(self, instance, validated_data):
+        if not validated_data:
+            return instance
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
+
+class DeckSearchSerializer(DeckListSerializer):
+    """Public search result: list fields plus author and relevance"""
+    display_author = serializers.SerializerMethodField()
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta(DeckListSerializer.Meta):
+        fields = DeckListSerializer.Meta.fields + ['display_author', 'rank']
+
+    def get_display_author(self, obj):
+        return obj.created_by if obj.created_by else obj.teacher.name
 
 
 class DeckCreateSerializer(serializers.ModelSerializer):
@@ -90,6 +141,7 @@ class DeckCreateSerializer(serializers.ModelSerializer):
             'year_group', 'target_grade', 'is_public', 'cards'
         ]
 
+    @transaction.atomic
     def create(self, validated_data):
         cards_data = validated_data.pop('cards')
         subject_name = validated_data.pop('subject_name', None)
@@ -110,25 +162,23 @@ class DeckCreateSerializer(serializers.ModelSerializer):
         else:
             raise serializers.ValidationError({'subject_name': 'Subject is required'})
 
-        deck = Deck.objects.create(teacher=teacher, **validated_data)
+        deck = Deck.objects.create(teacher=teacher, content_hash=cards_hash(cards_data), **validated_data)
 
+        cards = []
         for idx, card_data in enumerate(cards_data):
             # Remove order if present, use idx instead
             card_data.pop('order', None)
-            Card.objects.create(deck=deck, order=idx, **card_data)
+            cards.append(Card(deck=deck, order=idx * ORDER_GAP, **card_data))
+        Card.objects.bulk_create(cards, batch_size=CARD_BATCH_SIZE)
 
         return deck
 
 
 class SubjectSerializer(serializers.ModelSerializer):
-    deck_count = serializers.SerializerMethodField()
-
     class Meta:
         model = Subject
         fields = ['id', 'name', 'deck_count']
-
-    def get_deck_count(self, obj):
-        return obj.decks.count()
+        read_only_fields = ['deck_count']
 
 
 class TeacherSerializer(serializers.ModelSerializer):
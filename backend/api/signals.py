@@ -0,0 +1,145 @@
+"""
+Signal receivers keeping the denormalized counters and caches in sync.
+
+Deck.card_count and Subject.deck_count are updated with F() expressions so
+concurrent writers never lose an increment, and the search index row of a
+deck is rebuilt after commit when its title or cards change. Card deletes
+and bulk writes are covered by CardQuerySet in models.py instead of
+receivers here. Deck and subject writes also move the owner's cached
+dashboard to a new version, and deck saves and deletes move the deck's
+cached public payload (api.cache) once they commit. Renaming a teacher or
+subject changes the payload of each of their decks without saving them, so
+those decks are moved to a new version directly. Single card saves, and
+card deletes through Card.delete(), move their deck to a new version and
+into its change log once they commit (models.card_writes), unless the
+writer logged them itself as the API does.
+
+Fixtures (loaddata) save rows raw, with their counters already filled in,
+so the counter receivers leave raw saves alone.
+"""
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import search
+from .cache import forget_dashboard, forget_public_deck, forget_teacher, invalidate_public_deck
+from .models import Teacher, Subject, Deck, Card, CardChange, adjust_card_counts, card_writes
+
+
+def _previous_value(sender, instance, field, update_fields):
+    """Stored value of a field (a foreign key's id) before this save, or None for new rows"""
+    if instance._state.adding or (update_fields is not None and field not in update_fields):
+        return None
+    column = sender._meta.get_field(field).attname
+    return sender.objects.filter(pk=instance.pk).values_list(column, flat=True).first()
+
+
+def _republish_decks(decks):
+    """Move decks to a new version after a change to what their payload embeds"""
+    decks.update(updated_at=timezone.now(), version=F('version') + 1)
+    for deck in decks.only('id', 'slug', 'version'):
+        invalidate_public_deck(deck)
+
+
+@receiver(post_save, sender=Teacher)
+@receiver(post_delete, sender=Teacher)
+def forget_cached_teacher(sender, instance, **kwargs):
+    forget_teacher(instance.pk)
+
+
+@receiver(pre_save, sender=Teacher)
+@receiver(pre_save, sender=Subject)
+def remember_name(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    instance._previous_name = _previous_value(sender, instance, 'name', update_fields)
+
+
+@receiver(post_save, sender=Teacher)
+@receiver(post_save, sender=Subject)
+def republish_renamed(sender, instance, **kwargs):
+    # Public deck payloads carry teacher_name, display_author and subject_name
+    previous = getattr(instance, '_previous_name', None)
+    if previous is not None and previous != instance.name:
+        _republish_decks(instance.decks.all())
+
+
+@receiver(post_save, sender=Deck)
+@receiver(post_delete, sender=Deck)
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+def forget_teacher_dashboard(sender, instance, **kwargs):
+    forget_dashboard(instance.teacher_id)
+
+
+def _adjust_deck_count(subject_id, delta):
+    Subject.objects.filter(pk=subject_id).update(deck_count=F('deck_count') + delta)
+
+
+@receiver(pre_save, sender=Deck)
+def remember_deck_subject(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    instance._previous_subject_id = _previous_value(sender, instance, 'subject', update_fields)
+
+
+@receiver(post_save, sender=Deck)
+def count_saved_deck(sender, instance, created, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_subject_id', None)
+    if created and not raw:
+        _adjust_deck_count(instance.subject_id, 1)
+    elif previous is not None and previous != instance.subject_id:
+        _adjust_deck_count(previous, -1)
+        _adjust_deck_count(instance.subject_id, 1)
+
+
+@receiver(post_save, sender=Deck)
+def invalidate_saved_deck(sender, instance, **kwargs):
+    invalidate_public_deck(instance)
+
+
+@receiver(post_save, sender=Deck)
+def index_saved_deck(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or 'title' in update_fields:
+        search.schedule_index(instance.id)
+
+
+@receiver(post_delete, sender=Deck)
+def count_deleted_deck(sender, instance, **kwargs):
+    # A no-op when the subject itself is being deleted in the same cascade
+    _adjust_deck_count(instance.subject_id, -1)
+    search.schedule_remove(instance.id)
+    forget_public_deck(instance.slug)
+
+
+@receiver(pre_save, sender=Card)
+def remember_card_deck(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    instance._previous_deck_id = _previous_value(sender, instance, 'deck', update_fields)
+
+
+@receiver(post_save, sender=Card)
+def count_saved_card(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    previous = getattr(instance, '_previous_deck_id', None)
+    if created and not raw:
+        adjust_card_counts({instance.deck_id: 1})
+    elif previous is not None and previous != instance.deck_id:
+        adjust_card_counts({previous: 1}, sign=-1)
+        adjust_card_counts({instance.deck_id: 1})
+        search.schedule_index(previous)
+    # A move only changes the card's order, which the search index ignores
+    if update_fields is None or not update_fields <= {'order'}:
+        search.schedule_index(instance.deck_id)
+
+
+@receiver(post_save, sender=Card)
+def publish_saved_card(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_deck_id', None)
+    if previous is not None and previous != instance.deck_id:
+        card_writes(previous).add(instance.pk, CardChange.DELETE)
+        created = True
+    card_writes(instance.deck_id).add(instance.pk, CardChange.INSERT if created else CardChange.UPDATE)
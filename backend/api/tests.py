@@ -1,3 +1,1501 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import itertools
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+from contextlib import closing
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core import serializers
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import (
+    Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
+from django.urls import resolve
+from django.utils import timezone
+
+from .cache import get_cached_teacher
+from .middleware import PrimaryPinMiddleware
+from .models import Teacher, Subject, Deck, Card, CardChange, OutboundEmail, ORDER_GAP, VersionConflict, next_slug
+from .routers import PRIMARY_PIN_COOKIE, ReplicaRouter, read_from_replica
+from .throttling import AnonRateThrottle
+from .views import LoginRateThrottle
+from . import async_views, backups, email_service, exports, imports, profiling, search, throttling, views
+
+
+@override_settings(THROTTLE_DATABASE=':memory:')
+class APITestCase(TestCase):
+    """Base class with a logged-in teacher and helpers for building decks"""
+
+    def setUp(self):
+        cache.clear()
+        self.teacher = Teacher(name='Ada Teacher', email='ada@example.com')
+        self.teacher.set_password('Passw0rd!')
+        self.teacher.save()
+        self.subject = Subject.objects.create(name='Biology', teacher=self.teacher)
+        session = self.client.session
+        session['teacher_id'] = self.teacher.id
+        session.save()
+        # As after the teacher's first request: session and teacher are cached
+        get_cached_teacher(self.teacher.id)
+
+    def make_deck(self, title='Cells', cards=3, subject=None):
+        deck = Deck.objects.create(title=title, subject=subject or self.subject, teacher=self.teacher)
+        Card.objects.bulk_create(
+            Card(deck=deck, question=f'Question {i}?', answer=f'Answer {i}', order=i * ORDER_GAP)
+            for i in range(cards)
+        )
+        return deck
+
+
+class QueryBudgetTests(APITestCase):
+    """
+    Fixed query budgets per endpoint. Each test builds a small and a large
+    library and asserts both cost the same number of queries, so an N+1
+    regression fails here.
+    """
+
+    def assert_budget(self, budget, method, path, **kwargs):
+        with self.assertNumQueries(budget):
+            response = getattr(self.client, method)(path, content_type='application/json', **kwargs)
+        self.assertLess(response.status_code, 400, response.content)
+        return response
+
+    def test_deck_list(self):
+        for size in (2, 20):
+            Deck.objects.all().delete()
+            for i in range(size):
+                subject = Subject.objects.get_or_create(name=f'Subject {i % 3}', teacher=self.teacher)[0]
+                self.make_deck(title=f'Deck {i}', subject=subject)
+            response = self.assert_budget(1, 'get', '/api/decks/')
+            self.assertEqual(len(response.json()), size)
+            self.assertEqual(response.json()[0]['card_count'], 3)
+
+    def test_dashboard(self):
+        for size in (2, 200):
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(size):
+                    subject = Subject.objects.get_or_create(name=f'Subject {i % 3}', teacher=self.teacher)[0]
+                    self.make_deck(title=f'Deck {size}-{i}', subject=subject)
+            self.assert_budget(2, 'get', '/api/dashboard/')
+            response = self.assert_budget(0, 'get', '/api/dashboard/')
+            self.assertEqual(response.json()['deck_count'], Deck.objects.count())
+            self.assertEqual(response.json()['card_count'], 3 * Deck.objects.count())
+
+    def test_subject_list(self):
+        for size in (2, 20):
+            Subject.objects.all().delete()
+            for i in range(size):
+                subject = Subject.objects.create(name=f'Subject {i}', teacher=self.teacher)
+                self.make_deck(title=f'Deck {i}', subject=subject, cards=1)
+            response = self.assert_budget(1, 'get', '/api/subjects/')
+            self.assertEqual([s['deck_count'] for s in response.json()], [1] * size)
+
+    def test_deck_retrieve(self):
+        for size in (5, 200):
+            deck = self.make_deck(title=f'Deck {size}', cards=size)
+            response = self.assert_budget(2, 'get', f'/api/decks/{deck.slug}/')
+            self.assertEqual(len(response.json()['cards']), size)
+
+    def test_deck_patch(self):
+        for size in (5, 500):
+            deck = self.make_deck(title=f'Deck {size}', cards=size)
+            response = self.assert_budget(5, 'patch', f'/api/decks/{deck.slug}/', data={'exam_board': 'AQA'})
+            self.assertNotIn('cards', response.json())
+            self.assertEqual(response.json()['card_count'], size)
+            deck.refresh_from_db()
+            self.assertEqual(deck.exam_board, 'AQA')
+
+    def test_single_card_writes(self):
+        for size in (5, 300):
+            deck = self.make_deck(title=f'Deck {size}', cards=size)
+            first, second = deck.cards.all()[:2]
+            path = f'/api/decks/{deck.slug}/cards/'
+            card = self.assert_budget(10, 'post', path, data={'question': 'Q?', 'answer': 'A', 'after': first.id})
+            card_path = f'{path}{card.json()["id"]}/'
+            self.assert_budget(8, 'patch', card_path, data={'answer': 'Fixed'})
+            self.assert_budget(10, 'post', f'{card_path}move/', data={'before': first.id})
+            self.assert_budget(11, 'delete', card_path)
+            self.assertEqual(Deck.objects.get(pk=deck.pk).card_count, size)
+
+    def test_public_deck(self):
+        # Students are anonymous, so no session is loaded
+        self.client.cookies.clear()
+        for size in (5, 200):
+            deck = self.make_deck(title=f'Deck {size}', cards=size)
+            self.assert_budget(2, 'get', f'/api/study/{deck.slug}/')
+            # Served from the versioned response cache
+            response = self.assert_budget(0, 'get', f'/api/study/{deck.slug}/')
+            self.assertEqual(len(response.json()['cards']), size)
+
+    def test_public_deck_changes(self):
+        decks = [self.make_deck(title=f'Deck {size}', cards=size) for size in (5, 500)]
+        for deck in decks:
+            card = deck.cards.first()
+            self.client.patch(f'/api/decks/{deck.slug}/cards/{card.id}/', {'answer': 'Fixed'}, content_type='application/json')
+        self.client.cookies.clear()
+        for deck in decks:
+            response = self.assert_budget(3, 'get', f'/api/study/{deck.slug}/changes/?since=1')
+            self.assertEqual(len(response.json()['cards']), 1)
+            self.assert_budget(1, 'get', f'/api/study/{deck.slug}/changes/?since=2')
+
+    def test_public_deck_not_modified(self):
+        deck = self.make_deck(cards=50)
+        self.client.cookies.clear()
+        etag = self.client.get(f'/api/study/{deck.slug}/')['ETag']
+        cache.clear()
+        response = self.assert_budget(1, 'get', f'/api/study/{deck.slug}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_deck_create(self):
+        # Slug allocation costs one query however many decks share the title
+        for size in (2, 20):
+            Deck.objects.all().delete()
+            for _ in range(size):
+                self.make_deck(title='Cell Biology')
+            self.assert_budget(11, 'post', '/api/decks/', data={
+                'title': 'Cell Biology', 'subject_name': 'Biology',
+                'cards': [{'question': 'Q?', 'answer': 'A'}],
+            })
+            self.assertEqual(Deck.objects.latest('id').slug, f'cell-biology-{size}')
+
+    def test_update_cards(self):
+        for size in (5, 200):
+            deck = self.make_deck(title=f'Deck {size}', cards=size)
+            cards = list(deck.cards.values('id', 'question', 'answer'))
+            cards[0]['answer'] = 'Edited'
+            cards.append({'question': 'New?', 'answer': 'New'})
+            self.assert_budget(
+                11, 'put', f'/api/decks/{deck.slug}/update_cards/', data={'cards': cards}
+            )
+            self.assertEqual(deck.cards.count(), size + 1)
+            # Saving the same cards again matches the content hash and writes nothing
+            self.assert_budget(
+                2, 'put', f'/api/decks/{deck.slug}/update_cards/', data={'cards': cards}
+            )
+
+
+class TeacherAuthenticationTests(APITestCase):
+    """The signed-in teacher comes from the cache, which follows edits"""
+
+    def test_cached_teacher_follows_edits(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/auth/me/').json()['name'], 'Ada Teacher')
+        self.teacher.name = 'Ada Lovelace'
+        self.teacher.save()
+        self.assertEqual(self.client.get('/api/auth/me/').json()['name'], 'Ada Lovelace')
+
+    def test_deleted_teacher_is_signed_out(self):
+        self.teacher.delete()
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 401)
+
+    def login(self, email, password='Passw0rd!'):
+        return self.client.post(
+            '/api/auth/login/', {'email': email, 'password': password}, content_type='application/json'
+        )
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_login_rehashes_at_new_cost(self):
+        self.assertEqual(self.login('ada@example.com').status_code, 200)
+        self.teacher.refresh_from_db()
+        self.assertTrue(self.teacher.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_unknown_email_is_hashed_too(self):
+        with mock.patch('api.models.make_password') as make_password:
+            self.assertEqual(self.login('nobody@example.com').status_code, 401)
+        make_password.assert_called_once_with('Passw0rd!')
+
+    def test_writes_require_csrf_token(self):
+        self.client.handler.enforce_csrf_checks = True
+        response = self.client.post('/api/subjects/', {'name': 'Chemistry'}, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+
+class CardOrderTests(APITestCase):
+    """Single-card inserts and moves write one row and keep the deck in order"""
+
+    def questions(self, deck):
+        return [card['question'] for card in self.client.get(f'/api/decks/{deck.slug}/').json()['cards']]
+
+    def test_insert_and_move(self):
+        deck = self.make_deck(cards=3)
+        first, middle, last = deck.cards.all()
+        path = f'/api/decks/{deck.slug}/cards/'
+        self.client.post(path, {'question': 'Start', 'answer': 'A', 'before': first.id}, content_type='application/json')
+        self.client.post(path, {'question': 'Mid', 'answer': 'A', 'after': middle.id}, content_type='application/json')
+        self.client.post(path, {'question': 'End', 'answer': 'A'}, content_type='application/json')
+        self.client.post(f'{path}{last.id}/move/', {'after': first.id}, content_type='application/json')
+        self.assertEqual(
+            self.questions(deck), ['Start', 'Question 0?', 'Question 2?', 'Question 1?', 'Mid', 'End']
+        )
+        # Neighbours of the inserted and moved cards keep their positions
+        self.assertEqual(Card.objects.get(pk=middle.pk).order, middle.order)
+
+    def test_renumbers_when_gaps_run_out(self):
+        deck = self.make_deck(cards=2)
+        first = deck.cards.first()
+        path = f'/api/decks/{deck.slug}/cards/'
+        for i in range(15):
+            self.client.post(path, {'question': f'New {i}', 'answer': 'A', 'after': first.id}, content_type='application/json')
+        self.assertEqual(
+            self.questions(deck), ['Question 0?', *(f'New {i}' for i in reversed(range(15))), 'Question 1?']
+        )
+        orders = list(deck.cards.values_list('order', flat=True))
+        self.assertEqual(len(set(orders)), len(orders))
+
+    def test_bad_anchor(self):
+        deck = self.make_deck(cards=2)
+        other = self.make_deck(title='Other', cards=1).cards.get()
+        path = f'/api/decks/{deck.slug}/cards/'
+        response = self.client.post(path, {'question': 'Q', 'answer': 'A', 'after': other.id}, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        card = deck.cards.first()
+        response = self.client.post(f'{path}{card.id}/move/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CardSyncTests(APITestCase):
+    """sync_cards keeps known cards and writes only what changed"""
+
+    def cards(self, deck):
+        return list(deck.cards.values_list('id', 'question', 'answer', 'order'))
+
+    def test_diffed_write(self):
+        deck = self.make_deck(cards=4)
+        first, second, third, fourth = deck.cards.all()
+        counts = deck.sync_cards([
+            {'id': first.id, 'question': first.question, 'answer': first.answer},
+            {'id': third.id, 'question': third.question, 'answer': 'Changed'},
+            {'id': second.id, 'question': second.question, 'answer': second.answer},
+            {'question': 'New?', 'answer': 'A'},
+        ])
+        # fourth is deleted; second and third swap places, third also changes
+        self.assertEqual(counts, (1, 2, 1))
+        new_id = deck.cards.get(question='New?').id
+        self.assertEqual(self.cards(deck), [
+            (first.id, first.question, first.answer, 0),
+            (third.id, third.question, 'Changed', ORDER_GAP),
+            (second.id, second.question, second.answer, 2 * ORDER_GAP),
+            (new_id, 'New?', 'A', 3 * ORDER_GAP),
+        ])
+        self.assertFalse(Card.objects.filter(pk=fourth.pk).exists())
+        deck.refresh_from_db()
+        self.assertEqual(deck.card_count, 4)
+        changes = sorted(deck.card_changes.filter(version=deck.version).values_list('card_id', 'op'))
+        self.assertEqual(changes, sorted([
+            (new_id, CardChange.INSERT), (second.id, CardChange.UPDATE),
+            (third.id, CardChange.UPDATE), (fourth.id, CardChange.DELETE),
+        ]))
+
+    def test_duplicate_and_foreign_ids(self):
+        deck = self.make_deck(cards=2)
+        first, second = deck.cards.all()
+        other = self.make_deck(title='Other', cards=1).cards.get()
+        counts = deck.sync_cards([
+            {'id': first.id, 'question': first.question, 'answer': first.answer},
+            {'id': first.id, 'question': 'Copy', 'answer': 'A'},
+            {'id': other.id, 'question': 'Borrowed', 'answer': 'A'},
+        ])
+        # Only the first use of an id keeps its card; the rest are new cards
+        self.assertEqual(counts, (2, 0, 1))
+        rows = self.cards(deck)
+        self.assertEqual(rows[0], (first.id, first.question, first.answer, 0))
+        self.assertEqual([row[1] for row in rows[1:]], ['Copy', 'Borrowed'])
+        self.assertNotIn(other.id, [row[0] for row in rows])
+        self.assertFalse(Card.objects.filter(pk=second.pk).exists())
+        self.assertEqual(Card.objects.get(pk=other.pk).question, other.question)
+
+    def test_replace_all_and_unchanged(self):
+        deck = self.make_deck(cards=3)
+        data = [{'question': 'Only', 'answer': 'A'}]
+        self.assertEqual(deck.sync_cards(data), (1, 0, 3))
+        deck.refresh_from_db()
+        version = deck.version
+        card = deck.cards.get()
+        with self.assertNumQueries(0):
+            self.assertEqual(deck.sync_cards(data), (0, 0, 0))
+        self.assertEqual(deck.sync_cards([{'id': card.id, **data[0]}]), (0, 0, 0))
+        self.assertEqual(deck.cards.get().pk, card.pk)
+        deck.refresh_from_db()
+        self.assertEqual(deck.version, version)
+
+    def test_diffs_against_current_cards(self):
+        deck = self.make_deck(cards=2)
+        first, second = deck.cards.all()
+        stale = Deck.objects.get(pk=deck.pk)
+        # Another request replaces a card after this one loaded the deck
+        deck.sync_cards([{'id': first.id, 'question': first.question, 'answer': first.answer}])
+        counts = stale.sync_cards([
+            {'id': first.id, 'question': 'Edited', 'answer': first.answer},
+            {'id': second.id, 'question': second.question, 'answer': second.answer},
+        ])
+        # The deleted card comes back as a new one rather than a lost update
+        self.assertEqual(counts, (1, 1, 0))
+        self.assertEqual([row[1] for row in self.cards(deck)], ['Edited', second.question])
+        self.assertEqual(Deck.objects.get(pk=deck.pk).card_count, 2)
+
+
+class SlugTests(APITestCase):
+    """next_slug numbers decks that share a title, whatever the database's collation"""
+
+    def test_next_slug(self):
+        for slug in ('cells', 'cells-1', 'cells-9', 'cells-10', 'cells-revision', 'cellsx-99', 'cell-99'):
+            Deck.objects.create(title='Cells', slug=slug, subject=self.subject, teacher=self.teacher)
+        self.assertEqual(next_slug('cells'), 'cells-11')
+        self.assertEqual(next_slug('cells-revision'), 'cells-revision-1')
+        self.assertEqual(next_slug('mitosis'), 'mitosis')
+        # PostgreSQL matches the prefix with LIKE rather than a range
+        with mock.patch('api.models.connection', mock.Mock(vendor='postgresql')):
+            self.assertEqual(next_slug('cells'), 'cells-11')
+            self.assertEqual(next_slug('cell'), 'cell-100')
+
+    def test_new_decks_get_the_next_free_slug(self):
+        slugs = [self.make_deck(title='Cells').slug for _ in range(3)]
+        self.assertEqual(slugs, ['cells', 'cells-1', 'cells-2'])
+
+
+class PaginationTests(APITestCase):
+    """Keyset pages cover every deck once, in order, and bad cursors are a 404"""
+
+    def cursor(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def test_page_walk(self):
+        decks = [self.make_deck(title=f'Deck {i}', cards=0) for i in range(7)]
+        # Ties on updated_at are broken by id
+        Deck.objects.filter(pk__in=[deck.pk for deck in decks[2:5]]).update(updated_at=decks[2].updated_at)
+        expected = list(Deck.objects.order_by('-updated_at', '-id').values_list('slug', flat=True))
+
+        slugs = []
+        url = '/api/decks/?page_size=3'
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 3)
+            slugs += [deck['slug'] for deck in page['results']]
+            url = page['next']
+        self.assertEqual(slugs, expected)
+
+    def test_invalid_cursors(self):
+        self.make_deck()
+        for cursor in (
+            'not base64!', self.cursor('x'), self.cursor({'a': 1, 'b': 2}), self.cursor([1]),
+            self.cursor([None, None]), self.cursor(['2024-01-01T00:00:00+00:00', None]),
+            self.cursor(['yesterday', 1]), self.cursor(['2024-01-01T00:00:00+00:00', 'one']),
+        ):
+            response = self.client.get(f'/api/decks/?cursor={cursor}')
+            self.assertEqual(response.status_code, 404, cursor)
+            self.assertEqual(response.json()['detail'], 'Invalid cursor')
+
+
+class CounterTests(APITestCase):
+    """Deck.card_count and Subject.deck_count follow every kind of write"""
+
+    def counts(self, *objs):
+        return [
+            Deck.objects.get(pk=obj.pk).card_count if isinstance(obj, Deck)
+            else Subject.objects.get(pk=obj.pk).deck_count
+            for obj in objs
+        ]
+
+    def test_create_and_delete(self):
+        deck = self.make_deck(cards=3)
+        self.client.post(f'/api/decks/{deck.slug}/cards/', {'question': 'Q', 'answer': 'A'}, content_type='application/json')
+        Card.objects.create(deck=deck, question='Q', answer='A')
+        self.assertEqual(self.counts(deck, self.subject), [5, 1])
+
+        deck.cards.first().delete()
+        deck.cards.filter(question='Q').delete()
+        self.assertEqual(self.counts(deck), [2])
+        deck.delete()
+        self.assertEqual(self.counts(self.subject), [0])
+
+    def test_moves(self):
+        other_subject = Subject.objects.create(name='Physics', teacher=self.teacher)
+        deck, other = self.make_deck(cards=2), self.make_deck(title='Other', cards=0)
+        card = deck.cards.first()
+        card.deck = other
+        card.save()
+        self.assertEqual(self.counts(deck, other), [1, 1])
+
+        other.subject = other_subject
+        other.save()
+        self.assertEqual(self.counts(self.subject, other_subject), [1, 1])
+
+    def test_bulk_writes(self):
+        deck, other = self.make_deck(cards=4), self.make_deck(title='Other', cards=2)
+        self.assertEqual(self.counts(deck, other, self.subject), [4, 2, 2])
+        Card.objects.filter(deck__in=[deck, other], order=0).delete()
+        self.assertEqual(self.counts(deck, other), [3, 1])
+        self.client.put(
+            f'/api/decks/{deck.slug}/update_cards/', {'cards': [{'question': 'Q', 'answer': 'A'}]},
+            content_type='application/json'
+        )
+        self.assertEqual(self.counts(deck), [1])
+
+    def test_full_save_of_a_stale_instance_keeps_counters(self):
+        deck = self.make_deck(cards=0)
+        stale_deck, stale_subject = Deck.objects.get(pk=deck.pk), Subject.objects.get(pk=self.subject.pk)
+        Card.objects.create(deck=deck, question='Q', answer='A')
+        self.make_deck(title='Second')
+        stale_deck.title = 'Renamed'
+        stale_deck.save()
+        stale_subject.name = 'Renamed'
+        stale_subject.save()
+        self.assertEqual(self.counts(deck, self.subject), [1, 2])
+
+    def test_fixtures_are_not_counted_twice(self):
+        deck = self.make_deck(cards=3)
+        deck.refresh_from_db()
+        self.subject.refresh_from_db()
+        data = serializers.serialize('json', [self.subject, deck, *deck.cards.all()])
+        Subject.objects.all().delete()
+        for obj in serializers.deserialize('json', data):
+            obj.save()
+        self.assertEqual(self.counts(deck, self.subject), [3, 1])
+
+
+class ImportEndpointTests(APITestCase):
+    """Imported cards are appended after the deck's cards"""
+
+    def test_import_appends(self):
+        deck = self.make_deck(cards=2)
+        body = 'question,answer\nNew?,Yes\n,Missing\nAlso?,Yes\n'
+        response = self.client.post(f'/api/decks/{deck.slug}/import/auto/', body, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['format'], data['imported'], data['error_count'], data['card_count']), ('csv', 2, 1, 4))
+        self.assertEqual(
+            [card.question for card in deck.cards.all()], ['Question 0?', 'Question 1?', 'New?', 'Also?']
+        )
+
+    def test_nothing_imported(self):
+        deck = self.make_deck(cards=1)
+        response = self.client.post(f'/api/decks/{deck.slug}/import/json/', 'no cards', content_type='text/plain')
+        self.assertEqual(response.status_code, 400)
+
+    def test_csrf_checked_without_reading_the_body(self):
+        deck = self.make_deck(cards=1)
+        client = Client(enforce_csrf_checks=True)
+        client.cookies = self.client.cookies
+        client.cookies['csrftoken'] = 'a' * 32
+        path = f'/api/decks/{deck.slug}/import/auto/'
+        bodies = [
+            ('question,answer\nCSV?,Yes\n', 'text/csv'),
+            ('Plain?\tYes\n', 'text/plain'),
+            ('{"question": "Line?", "answer": "Yes"}\n', 'application/x-ndjson'),
+            ('[{"question": "Json?", "answer": "Yes"}]', 'application/json'),
+        ]
+        for body, content_type in bodies:
+            with self.subTest(content_type=content_type):
+                response = client.post(path, body, content_type=content_type, headers={'X-CSRFToken': 'a' * 32})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['imported'], 1)
+        upload = SimpleUploadedFile('cards.csv', b'question,answer\nFile?,Yes\n', content_type='text/csv')
+        response = client.post(path, {'file': upload}, headers={'X-CSRFToken': 'a' * 32})
+        self.assertEqual(response.json()['imported'], 1)
+        self.assertEqual(deck.cards.count(), 6)
+        response = client.post(path, bodies[0][0], content_type='text/csv')
+        self.assertEqual(response.status_code, 403)
+
+
+class SearchTests(APITestCase):
+    """The search index follows deck and card writes once they commit"""
+
+    def make_indexed_deck(self, title, questions, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            deck = Deck.objects.create(title=title, subject=self.subject, teacher=self.teacher, **fields)
+            Card.objects.bulk_create(
+                Card(deck=deck, question=question, answer='Answer', order=i * ORDER_GAP)
+                for i, question in enumerate(questions)
+            )
+        return deck
+
+    def search(self, query, **params):
+        return self.client.get('/api/search/', {'q': query, **params}).json()
+
+    def titles(self, query, **params):
+        return [deck['title'] for deck in self.search(query, **params)['results']]
+
+    def test_title_matches_rank_first(self):
+        self.make_indexed_deck('Plant biology', ['What is osmosis?'])
+        self.make_indexed_deck('Osmosis', ['Define diffusion'])
+        self.make_indexed_deck('Private osmosis', ['Osmosis?'], is_public=False)
+        self.assertEqual(self.titles('osmosis'), ['Osmosis', 'Plant biology'])
+        self.assertEqual(self.titles('osmo*'), ['Osmosis', 'Plant biology'])
+        self.assertEqual(self.titles('"OSMOSIS"!'), ['Osmosis', 'Plant biology'])
+
+    def test_filters_and_facets(self):
+        self.make_indexed_deck('Cells AQA', ['Nucleus?'], exam_board='AQA')
+        self.make_indexed_deck('Cells OCR', ['Nucleus?'], exam_board='OCR')
+        data = self.search('nucleus', exam_board='AQA')
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['facets']['exam_board'], {'AQA': 1})
+        self.assertEqual(self.search('nucleus')['facets']['exam_board'], {'AQA': 1, 'OCR': 1})
+
+    def test_writes_reindex_on_commit(self):
+        deck = self.make_indexed_deck('Genetics', ['What is DNA?'])
+        with self.captureOnCommitCallbacks(execute=True):
+            deck.sync_cards([{'question': 'What is RNA?', 'answer': 'A'}])
+        self.assertEqual(self.titles('rna'), ['Genetics'])
+        self.assertEqual(self.titles('dna'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            deck.title = 'Heredity'
+            deck.save(update_fields=['title'])
+        self.assertEqual(self.titles('heredity'), ['Heredity'])
+        with self.captureOnCommitCallbacks(execute=True):
+            deck.delete()
+        self.assertEqual(self.titles('rna'), [])
+
+    def test_one_reindex_per_transaction(self):
+        deck = self.make_indexed_deck('Genetics', ['DNA?', 'RNA?'])
+        kept = deck.cards.first()
+        with self.captureOnCommitCallbacks() as callbacks:
+            deck.sync_cards([
+                {'id': kept.id, 'question': 'Edited?', 'answer': 'A'}, {'question': 'New?', 'answer': 'A'}
+            ])
+        reindexes = [callback for callback in callbacks if isinstance(callback, search._Reindex) and callback.deck_id == deck.id]
+        self.assertEqual(len(reindexes), 1)
+
+    def test_rebuild_index(self):
+        self.make_deck(title='Unindexed', cards=1)
+        self.assertEqual(self.titles('unindexed'), [])
+        search.rebuild_index()
+        self.assertEqual(self.titles('unindexed'), ['Unindexed'])
+
+
+class ConditionalGetTests(APITestCase):
+    """Deck payloads carry an ETag and revalidations are answered with 304"""
+
+    def test_public_deck(self):
+        deck = self.make_deck()
+        response = self.client.get(f'/api/study/{deck.slug}/')
+        self.assertEqual(response['ETag'], f'"{deck.id}-1"')
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+        # nginx weakens ETags when it gzips, and those must still match
+        for etag in (response['ETag'], f'W/{response["ETag"]}', f'"other", {response["ETag"]}'):
+            revalidated = self.client.get(f'/api/study/{deck.slug}/', headers={'If-None-Match': etag})
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(revalidated['ETag'], response['ETag'])
+        self.assertEqual(
+            self.client.get(f'/api/study/{deck.slug}/', headers={'If-None-Match': '"other"'}).status_code, 200
+        )
+
+    def test_teacher_deck(self):
+        deck = self.make_deck()
+        response = self.client.get(f'/api/decks/{deck.slug}/')
+        self.assertIn('private', response['Cache-Control'])
+        with self.assertNumQueries(1):  # the deck, not its cards
+            revalidated = self.client.get(f'/api/decks/{deck.slug}/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+
+        self.client.patch(f'/api/decks/{deck.slug}/', {'exam_board': 'AQA'}, content_type='application/json')
+        response = self.client.get(f'/api/decks/{deck.slug}/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 200)
+
+
+class ExportTests(APITestCase):
+    """Deck exports in every format, the library zip, and their caching"""
+
+    def setUp(self):
+        super().setUp()
+        self.deck = Deck.objects.create(title='Cells & DNA', subject=self.subject, teacher=self.teacher)
+        Card.objects.bulk_create(
+            Card(deck=self.deck, question=question, answer=answer, order=i * ORDER_GAP)
+            for i, (question, answer) in enumerate([
+                ('What is\tDNA?', 'Deoxyribo-\nnucleic acid'),
+                ('Powerhouse?', 'Mitochondria, "the" powerhouse'),
+                ('Say it\r\n\tagain', 'Deoxyribo-\nnucleic acid'),
+            ])
+        )
+
+    def export(self, export_format, deck=None, **headers):
+        return self.client.get(f'/api/study/{(deck or self.deck).slug}/export/{export_format}/', headers=headers)
+
+    def body(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_tab_separated_formats(self):
+        lines = (
+            'What is DNA?\tDeoxyribo- nucleic acid\n'
+            'Powerhouse?\tMitochondria, "the" powerhouse\n'
+            'Say it again\tDeoxyribo- nucleic acid\n'
+        )
+        response = self.export('quizlet')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="cells___dna_quizlet.txt"')
+        self.assertEqual(self.body(response), lines)
+        self.assertEqual(self.body(self.export('anki')), exports.ANKI_INSTRUCTIONS + lines)
+
+    def test_csv(self):
+        response = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(self.body(response), (
+            'Question,Answer\r\n'
+            'What is\tDNA?,"Deoxyribo-\nnucleic acid"\r\n'
+            'Powerhouse?,"Mitochondria, ""the"" powerhouse"\r\n'
+            '"Say it\r\n\tagain","Deoxyribo-\nnucleic acid"\r\n'
+        ))
+
+    def test_kahoot(self):
+        # Wrong answers are earlier cards' answers other than the right one, padded
+        self.assertEqual(self.body(self.export('kahoot')), (
+            'Question,Answer 1,Answer 2,Answer 3,Answer 4,Time limit,Correct answer(s)\r\n'
+            'What is\tDNA?,"Deoxyribo-\nnucleic acid",Add wrong answer,Add wrong answer,Add wrong answer,30,1\r\n'
+            'Powerhouse?,"Mitochondria, ""the"" powerhouse","Deoxyribo-\nnucleic acid",'
+            'Add wrong answer,Add wrong answer,30,1\r\n'
+            '"Say it\r\n\tagain","Deoxyribo-\nnucleic acid","Mitochondria, ""the"" powerhouse",'
+            'Add wrong answer,Add wrong answer,30,1\r\n'
+        ))
+
+    def test_library_zip(self):
+        other = self.make_deck(title='Other', cards=1)
+        response = self.client.get('/api/decks/export/quizlet/')
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="flashcards_quizlet.zip"')
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertEqual(archive.namelist(), [f'{self.deck.slug}_quizlet.txt', f'{other.slug}_quizlet.txt'])
+            self.assertEqual(
+                archive.read(f'{self.deck.slug}_quizlet.txt').decode(), self.body(self.export('quizlet'))
+            )
+            self.assertEqual(archive.read(f'{other.slug}_quizlet.txt'), b'Question 0?\tAnswer 0\n')
+        self.assertEqual(self.client.get('/api/decks/export/pdf/').status_code, 404)
+
+    def test_cached_per_version(self):
+        body = self.body(self.export('csv'))
+        self.assertEqual(cache.get(f'deck:export:{self.deck.id}:csv:{self.deck.id}-1'), body.encode())
+        with self.assertNumQueries(1):  # the deck, not its cards
+            self.assertEqual(self.body(self.export('csv')), body)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(
+                f'/api/decks/{self.deck.slug}/update_cards/',
+                {'cards': [{'question': 'Only?', 'answer': 'Yes'}]},
+                content_type='application/json',
+            )
+        self.assertEqual(self.body(self.export('csv')), 'Question,Answer\r\nOnly?,Yes\r\n')
+        self.assertIsNotNone(cache.get(f'deck:export:{self.deck.id}:csv:{self.deck.id}-2'))
+
+    def test_conditional_get(self):
+        response = self.export('anki')
+        etag = response['ETag']
+        self.assertEqual(etag, f'"{self.deck.id}-1-anki"')
+        revalidated = self.export('anki', **{'If-None-Match': etag})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b'')
+        self.assertEqual(self.export('csv', **{'If-None-Match': etag}).status_code, 200)
+
+        self.client.patch(f'/api/decks/{self.deck.slug}/', {'title': 'Cells'}, content_type='application/json')
+        response = self.export('anki', **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.export('pdf').status_code, 404)
+
+
+class PublicDeckCacheTests(APITestCase):
+    """Public deck payloads come from the cache until a write moves the deck on"""
+
+    def study(self, deck):
+        return self.client.get(f'/api/study/{deck.slug}/')
+
+    def test_hit_and_miss(self):
+        deck = self.make_deck(cards=2)
+        self.client.cookies.clear()
+        first = self.study(deck)
+        with self.assertNumQueries(0):
+            second = self.study(deck)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.client.get(f'/api/study/{deck.slug}/', headers={'If-None-Match': first['ETag']}).status_code, 304)
+        self.assertEqual(self.client.get('/api/study/missing/').status_code, 404)
+
+    def test_saves_outside_the_api_move_the_cache_on(self):
+        deck = self.make_deck()
+        etag = self.study(deck)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            deck.title = 'Renamed in the admin'
+            deck.save()
+        response = self.study(deck)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['title'], 'Renamed in the admin')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            deck.delete()
+        self.assertEqual(self.study(deck).status_code, 404)
+
+    def test_renames_move_the_cache_on(self):
+        deck = self.make_deck()
+        etag = self.study(deck)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.name = 'Ada Lovelace'
+            self.teacher.save()
+        response = self.study(deck)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['display_author'], 'Ada Lovelace')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/subjects/{self.subject.id}/', {'name': 'Life'}, content_type='application/json')
+        self.assertEqual(self.study(deck).json()['subject_name'], 'Life')
+
+    def test_stale_pointer_is_moved_on(self):
+        deck = self.make_deck()
+        self.client.cookies.clear()
+        cache.set(f'deck:version:{deck.slug}', f'{deck.id}-0')
+        self.study(deck)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.study(deck).status_code, 200)
+
+
+@override_settings(THROTTLE_DATABASE=':memory:')
+class AutocommitCacheTests(TransactionTestCase):
+    """Saves outside a transaction, as in the admin or a shell, move the cache on too"""
+
+    def setUp(self):
+        cache.clear()
+        teacher = Teacher.objects.create(name='Ada Teacher', email='ada@example.com')
+        subject = Subject.objects.create(name='Biology', teacher=teacher)
+        self.deck = Deck.objects.create(title='Cells', subject=subject, teacher=teacher)
+
+    def test_deck_save(self):
+        path = f'/api/study/{self.deck.slug}/'
+        self.client.get(path)
+        self.deck.title = 'Renamed in the shell'
+        self.deck.save()
+        self.assertEqual(cache.get(f'deck:version:{self.deck.slug}'), f'{self.deck.id}-2')
+        response = self.client.get(path)
+        self.assertEqual(response['ETag'], f'"{self.deck.id}-2"')
+        self.assertEqual(response.json()['title'], 'Renamed in the shell')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(path).content, response.content)
+
+
+class DeckVersionTests(APITestCase):
+    """Writes move Deck.version on and stale writes are turned away"""
+
+    def put_cards(self, deck, cards, **extra):
+        return self.client.put(
+            f'/api/decks/{deck.slug}/update_cards/', {'cards': cards}, content_type='application/json', **extra
+        )
+
+    def test_writes_move_version_and_etag(self):
+        deck = self.make_deck(cards=2)
+        etag = self.client.get(f'/api/decks/{deck.slug}/')['ETag']
+        response = self.client.patch(f'/api/decks/{deck.slug}/', {'exam_board': 'AQA'}, content_type='application/json')
+        self.assertEqual(response.json()['version'], 2)
+        self.assertNotEqual(response['ETag'], etag)
+        self.client.post(f'/api/decks/{deck.slug}/cards/', {'question': 'Q', 'answer': 'A'}, content_type='application/json')
+        self.client.patch(f'/api/subjects/{self.subject.id}/', {'name': 'Biology A'}, content_type='application/json')
+        self.assertEqual(Deck.objects.get(pk=deck.pk).version, 4)
+
+    def test_reused_slug_is_not_served_from_cache(self):
+        deck = self.make_deck(title='Cells', cards=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/decks/{deck.slug}/', {'exam_board': 'AQA'}, content_type='application/json')
+        etag = self.client.get('/api/study/cells/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/api/decks/cells/')
+            deck = self.make_deck(title='Cells', cards=1)
+        self.assertEqual(deck.slug, 'cells')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/api/decks/cells/', {'exam_board': 'AQA'}, content_type='application/json')
+        response = self.client.get('/api/study/cells/')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['cards']), 1)
+
+    def test_stale_write_conflicts(self):
+        deck = self.make_deck(cards=2)
+        loaded = self.client.get(f'/api/decks/{deck.slug}/')
+        cards = loaded.json()['cards']
+        self.put_cards(deck, [*cards, {'question': 'Other tab', 'answer': 'A'}])
+
+        response = self.put_cards(deck, cards[:1], HTTP_IF_MATCH=loaded['ETag'])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['version'], 2)
+        response = self.client.put(
+            f'/api/decks/{deck.slug}/update_cards/', {'cards': cards[:1], 'version': 1}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(deck.cards.count(), 3)
+
+        response = self.put_cards(deck, cards[:1], HTTP_IF_MATCH=f'"{deck.id}-2"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['version'], 3)
+
+    def test_write_racing_another_rolls_back(self):
+        deck = self.make_deck(cards=2)
+        stale = Deck.objects.get(pk=deck.pk)
+        Deck.objects.get(pk=deck.pk).save(update_fields=['exam_board'])
+        with self.assertRaises(VersionConflict):
+            stale.sync_cards([{'question': 'Only', 'answer': 'A'}], expected_version=1)
+        self.assertEqual(deck.cards.count(), 2)
+        self.assertEqual(Deck.objects.get(pk=deck.pk).version, 2)
+
+    def test_unchanged_cards_are_not_written(self):
+        deck = self.make_deck(cards=2)
+        cards = self.client.get(f'/api/decks/{deck.slug}/').json()['cards']
+        cards[0]['answer'] = 'Edited'
+        self.assertEqual(self.put_cards(deck, cards).json()['version'], 2)
+        self.assertEqual(self.put_cards(deck, cards).json()['version'], 2)
+        # A single-card write forgets the hash, so the same list is compared card by card
+        self.client.patch(f'/api/decks/{deck.slug}/cards/{cards[0]["id"]}/', {'answer': 'B'}, content_type='application/json')
+        self.assertEqual(self.put_cards(deck, cards).json()['version'], 4)
+
+
+class DeltaSyncTests(APITestCase):
+    """A copy of a deck plus its changes equals the deck"""
+
+    def sync(self, copy, path):
+        changes = self.client.get(f'{path}changes/?since={copy["version"]}').json()
+        if changes['reset'] or changes['deck']['id'] != copy['id']:
+            return self.client.get(path).json()
+        cards = {card['id']: card for card in copy['cards']}
+        for card_id in changes['deleted']:
+            cards.pop(card_id, None)
+        cards.update((card['id'], card) for card in changes['cards'])
+        return {**copy, **changes['deck'], 'cards': sorted(cards.values(), key=lambda card: card['order'])}
+
+    def test_changes_bring_copy_up_to_date(self):
+        deck = self.make_deck(cards=4)
+        first, second, third, fourth = deck.cards.all()
+        path = f'/api/decks/{deck.slug}/'
+        copy = self.client.get(path).json()
+
+        self.client.patch(f'{path}cards/{first.id}/', {'answer': 'Fixed'}, content_type='application/json')
+        self.client.delete(f'{path}cards/{second.id}/')
+        added = self.client.post(f'{path}cards/', {'question': 'New', 'answer': 'A'}, content_type='application/json')
+        self.client.delete(f'{path}cards/{added.json()["id"]}/')
+        self.client.post(f'{path}cards/{fourth.id}/move/', {'before': first.id}, content_type='application/json')
+        self.client.post(f'{path}import/csv/', 'Imported?,Yes\n', content_type='text/csv')
+        self.client.patch(path, {'title': 'Renamed'}, content_type='application/json')
+
+        changes = self.client.get(f'{path}changes/?since={copy["version"]}').json()
+        self.assertEqual(changes['deleted'], [second.id])
+        self.assertEqual(len(changes['cards']), 3)
+        synced = self.sync(copy, path)
+        full = self.client.get(path).json()
+        self.assertEqual(synced['cards'], full['cards'])
+        self.assertEqual(synced['title'], 'Renamed')
+
+        cards = [*full['cards'][1:], {'question': 'Last', 'answer': 'A'}]
+        self.client.put(f'{path}update_cards/', {'cards': cards}, content_type='application/json')
+        self.assertEqual(self.sync(synced, path)['cards'], self.client.get(path).json()['cards'])
+
+    def test_card_writes_outside_the_api(self):
+        deck = self.make_deck(cards=3)
+        first, second, third = deck.cards.all()
+        second_id = second.id
+        other = self.make_deck(title='Other', cards=0)
+        path = f'/api/decks/{deck.slug}/'
+        copy = self.client.get(path).json()
+        public = self.client.get(f'/api/study/{deck.slug}/')
+
+        # As in the admin or a script: one new version per transaction
+        with self.captureOnCommitCallbacks(execute=True):
+            first.answer = 'Fixed in the admin'
+            first.save()
+            first.save()
+            added = Card.objects.create(deck=deck, question='Added?', answer='A', order=10 * ORDER_GAP)
+            second.delete()
+            third.deck = other
+            third.save()
+        deck.refresh_from_db()
+        self.assertEqual(deck.version, copy['version'] + 1)
+        self.assertEqual(deck.content_hash, '')
+        changes = self.client.get(f'{path}changes/?since={copy["version"]}').json()
+        self.assertEqual(sorted(changes['deleted']), [second_id, third.id])
+        self.assertEqual(sorted(card['id'] for card in changes['cards']), [first.id, added.id])
+        self.assertEqual(self.sync(copy, path)['cards'], self.client.get(path).json()['cards'])
+        self.assertEqual(list(other.card_changes.values_list('card_id', 'op')), [(third.id, CardChange.INSERT)])
+
+        response = self.client.get(f'/api/study/{deck.slug}/')
+        self.assertNotEqual(response['ETag'], public['ETag'])
+        self.assertEqual(response.json()['cards'][0]['answer'], 'Fixed in the admin')
+
+        # The API logs its own writes, so they move the deck on once
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'{path}cards/{first.id}/', {'answer': 'Again'}, content_type='application/json')
+            self.client.delete(f'{path}cards/{added.id}/')
+        self.assertEqual(Deck.objects.get(pk=deck.pk).version, deck.version + 2)
+
+    def test_renumbering_syncs_every_card(self):
+        deck = self.make_deck(cards=2)
+        first = deck.cards.first()
+        path = f'/api/decks/{deck.slug}/'
+        copy = self.client.get(path).json()
+        for i in range(12):
+            self.client.post(f'{path}cards/', {'question': f'N{i}', 'answer': 'A', 'after': first.id},
+                             content_type='application/json')
+            copy = self.sync(copy, path)
+        questions = [card['question'] for card in self.client.get(path).json()['cards']]
+        self.assertEqual([card['question'] for card in copy['cards']], questions)
+        self.assertEqual(questions, ['Question 0?', *(f'N{i}' for i in reversed(range(12))), 'Question 1?'])
+
+    def test_reset_outside_the_log(self):
+        deck = self.make_deck(cards=2)
+        path = f'/api/study/{deck.slug}/changes/'
+        self.assertTrue(self.client.get(f'{path}?since=2').json()['reset'])
+        self.assertEqual(self.client.get(f'{path}?since=-1').status_code, 400)
+
+        card = deck.cards.first()
+        for i in range(60):
+            self.client.patch(f'/api/decks/{deck.slug}/cards/{card.id}/', {'answer': f'v{i}'}, content_type='application/json')
+        deck.refresh_from_db()
+        deck.compact_card_changes(keep=10)
+        self.assertEqual(deck.changes_since, 51)
+        self.assertEqual(deck.card_changes.count(), 10)
+        self.assertTrue(self.client.get(f'{path}?since=50').json()['reset'])
+        self.assertEqual(self.client.get(f'{path}?since=51').json()['cards'][0]['answer'], 'v59')
+
+
+class JsonBackupTests(APITestCase):
+    """export_jsonl and restore_jsonl round trip, and a failed restore changes nothing"""
+
+    def setUp(self):
+        super().setUp()
+        self.deck = self.make_deck(cards=3)
+        self.path = os.path.join(tempfile.mkdtemp(), 'backup.jsonl')
+        self.addCleanup(lambda: os.path.exists(self.path) and os.remove(self.path))
+
+    def snapshot(self):
+        return (
+            list(Deck.objects.order_by('id').values()),
+            list(Card.objects.order_by('id').values()),
+            list(Subject.objects.order_by('id').values()),
+        )
+
+    def test_round_trip(self):
+        before = self.snapshot()
+        backups.export_jsonl(self.path)
+        self.make_deck(title='Later', cards=2)
+        Card.objects.filter(deck=self.deck).delete()
+
+        counts = backups.restore_jsonl(self.path)
+        self.assertEqual(counts['api.card'], 3)
+        self.assertEqual(self.snapshot(), before)
+
+    def test_bad_file_keeps_rows(self):
+        before = self.snapshot()
+        backups.export_jsonl(self.path)
+        with open(self.path, 'a') as out:
+            out.write('{"model": "api.nothing", "pk": 1, "fields": {}}\n')
+        with self.assertRaises(ValueError):
+            backups.restore_jsonl(self.path)
+        self.assertEqual(self.snapshot(), before)
+
+    def test_missing_fields_get_defaults(self):
+        backups.export_jsonl(self.path)
+        with open(self.path) as source:
+            rows = [json.loads(line) for line in source]
+        for row in rows:
+            if row['model'] == 'api.deck':
+                for field in ('version', 'content_hash', 'changes_since'):
+                    del row['fields'][field]
+        with open(self.path, 'w') as out:
+            out.writelines(json.dumps(row) + '\n' for row in rows)
+
+        backups.restore_jsonl(self.path)
+        deck = Deck.objects.get(pk=self.deck.pk)
+        self.assertEqual((deck.version, deck.content_hash, deck.changes_since), (1, '', 1))
+        self.assertEqual(deck.cards.count(), 3)
+
+    def test_restore_clears_the_cache(self):
+        public = self.client.get(f'/api/study/{self.deck.slug}/')
+        backups.export_jsonl(self.path)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/decks/{self.deck.slug}/', {'title': 'Renamed'}, content_type='application/json')
+        self.assertEqual(self.client.get(f'/api/study/{self.deck.slug}/').json()['title'], 'Renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            backups.restore_jsonl(self.path)
+        self.assertIsNone(cache.get(f'deck:version:{self.deck.slug}'))
+        response = self.client.get(f'/api/study/{self.deck.slug}/')
+        self.assertEqual(response['ETag'], public['ETag'])
+        self.assertEqual(response.json()['title'], 'Cells')
+
+    def test_copy_database_clears_the_cache(self):
+        self.client.get(f'/api/study/{self.deck.slug}/')
+        with mock.patch.object(backups, '_copy_model', return_value=0):
+            with self.captureOnCommitCallbacks(execute=True):
+                backups.copy_database('default')
+        self.assertIsNone(cache.get(f'deck:version:{self.deck.slug}'))
+        self.assertEqual(self.client.get(f'/api/study/{self.deck.slug}/').status_code, 404)
+
+
+class BackupCommandTests(SimpleTestCase):
+    """backup_db's incremental backups restore exactly and --keep prunes whole chains"""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.backup_dir = os.path.join(tmp_dir.name, 'backups')
+        self.db_path = os.path.join(tmp_dir.name, 'live.sqlite3')
+        with closing(sqlite3.connect(self.db_path)) as db, db:
+            db.execute('CREATE TABLE note (id INTEGER PRIMARY KEY, body TEXT)')
+            db.executemany('INSERT INTO note (body) VALUES (?)', [('x' * 500,)] * 200)
+
+        start = datetime.datetime(2026, 1, 1)
+        ticks = itertools.count()
+
+        class Clock(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return start + datetime.timedelta(minutes=next(ticks))
+
+        # Backups are named by the second they were taken in
+        self.enterContext(mock.patch('api.management.commands.backup_db.datetime', Clock))
+        self.enterContext(mock.patch.dict(settings.DATABASES['default'], {'NAME': self.db_path}))
+
+    def backup(self, *args):
+        out = StringIO()
+        call_command('backup_db', *args, '--backup-dir', self.backup_dir, '--step-sleep', '0', stdout=out)
+        return out.getvalue()
+
+    def write(self, sql, *params):
+        with closing(sqlite3.connect(self.db_path)) as db, db:
+            db.execute(sql, params)
+
+    def notes(self):
+        with closing(sqlite3.connect(self.db_path)) as db:
+            return db.execute('SELECT id, body FROM note ORDER BY id').fetchall()
+
+    def files(self, pattern):
+        return sorted(path.name for path in Path(self.backup_dir).glob(pattern))
+
+    def test_incremental_backup_and_restore(self):
+        self.backup('--verify')
+        self.write('UPDATE note SET body = ? WHERE id = 7', 'changed')
+        output = self.backup('--incremental', '--verify')
+        self.assertIn('Integrity check ok', output)
+        self.assertRegex(output, r'Created incremental backup: db_\S+\.delta .*, [1-9]\d* of \d+ pages changed')
+        self.write('INSERT INTO note (body) VALUES (?)', 'third')
+        self.backup('--incremental')
+        deltas = self.files('db_*.delta')
+        self.assertEqual(len(deltas), 2)
+
+        expected = self.notes()[:-1]
+        self.write('DELETE FROM note WHERE id < 100')
+        cache.set('deck:version:cells', '1-5')
+        self.backup('--restore', deltas[0])
+        self.assertEqual(self.notes(), expected)
+        self.assertEqual(len(self.files('db_pre_restore_*')), 1)
+        self.assertIsNone(cache.get('deck:version:cells'))
+
+    def test_corrupt_delta_is_not_restored(self):
+        self.backup()
+        self.write('UPDATE note SET body = ? WHERE id = 7', 'changed')
+        self.backup('--incremental')
+        (delta,) = Path(self.backup_dir).glob('db_*.delta')
+        delta.write_bytes(delta.read_bytes()[:-50])
+        before = self.notes()
+        with self.assertRaises(EOFError):
+            self.backup('--restore', delta.name)
+        self.assertEqual(self.notes(), before)
+
+    def test_keep_prunes_deltas_with_their_base(self):
+        for i in range(10):
+            self.write('INSERT INTO note (body) VALUES (?)', str(i))
+            self.backup('--incremental', '--keep', '3')
+        fulls, deltas = self.files('db_*.sqlite3'), self.files('db_*.delta')
+        # Each chain holds at most three backups, and the newest three are kept
+        self.assertLessEqual(len(fulls) + len(deltas), 5)
+        self.assertEqual(fulls[-1], 'db_20260101_000900.sqlite3')
+        for delta in deltas:
+            chain = backups.delta_chain(Path(self.backup_dir) / delta)
+            self.assertTrue(all(path.exists() for path in chain))
+        self.assertEqual(len(self.files('db_*.pages')), len(fulls) + len(deltas))
+
+
+class DashboardTests(APITestCase):
+    """The cached dashboard follows deck and card writes"""
+
+    def test_dashboard_follows_writes(self):
+        deck = self.make_deck(cards=2)
+        self.assertEqual(self.client.get('/api/dashboard/').json()['card_count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(
+                f'/api/decks/{deck.slug}/update_cards/',
+                {'cards': [{'question': 'Q', 'answer': 'A'}]},
+                content_type='application/json',
+            )
+        data = self.client.get('/api/dashboard/').json()
+        self.assertEqual(data['card_count'], 1)
+        self.assertEqual(data['subjects'][0]['decks'][0]['card_count'], 1)
+
+    def test_requires_teacher(self):
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get('/api/dashboard/').status_code, 401)
+
+
+@override_settings(API_PROFILING=True, API_PROFILING_FLUSH_SECONDS=0.05)
+class ProfilingTests(APITestCase):
+    """The profiling middleware reaches the shared stats, even from an idle worker"""
+
+    def setUp(self):
+        super().setUp()
+        # Each test gets its own worker store, and a fresh client rebuilds the middleware
+        patcher = mock.patch.object(profiling, '_local_store', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.cancel_timer)
+        self.client = self.client_class()
+        session = self.client.session
+        session['teacher_id'] = self.teacher.id
+        session.save()
+
+    def cancel_timer(self):
+        if profiling._local_store and profiling._local_store.timer:
+            profiling._local_store.timer.cancel()
+
+    def wait_for_flush(self):
+        store = profiling.local_store()
+        time.sleep(0.1)
+        self.assertIsNone(store.timer)
+        self.assertFalse(store.unflushed)
+
+    def test_idle_worker_flushes(self):
+        deck = self.make_deck()
+        for _ in range(3):
+            self.client.get(f'/api/study/{deck.slug}/')
+        # No later request arrives; the pending timer flushes the window
+        self.assertEqual(profiling.summarize(), {})
+        self.wait_for_flush()
+        stats = profiling.summarize()['public-deck']
+        self.assertEqual(stats['count'], 3)
+        self.assertGreater(stats['bytes']['p95'], 0)
+
+    def test_due_request_flushes(self):
+        deck = self.make_deck()
+        self.client.get(f'/api/study/{deck.slug}/')
+        self.wait_for_flush()
+        store = profiling.local_store()
+        store.flush_interval = 60
+        self.client.get('/api/dashboard/')
+        self.assertNotIn('dashboard', profiling.summarize())
+        store.timer.cancel()
+        store.last_flush -= 60
+        self.client.get('/api/dashboard/')
+        self.assertEqual(profiling.summarize()['dashboard']['count'], 2)
+
+    def test_command(self):
+        deck = self.make_deck()
+        self.client.get(f'/api/study/{deck.slug}/')
+        self.client.get('/api/dashboard/')
+        self.wait_for_flush()
+
+        out = StringIO()
+        call_command('api_profile', '--slowest', '1', stdout=out)
+        self.assertIn('public-deck', out.getvalue())
+        self.assertIn('1 slowest requests', out.getvalue())
+
+        out = StringIO()
+        call_command('api_profile', '--json', '--slowest', '2', stdout=out)
+        data = json.loads(out.getvalue())
+        self.assertEqual(set(data['endpoints']), {'public-deck', 'dashboard'})
+        self.assertEqual(len(data['slowest']), 2)
+        self.assertTrue(all('sql' in entry for entry in data['slowest']))
+
+        call_command('api_profile', '--reset', stdout=StringIO())
+        out = StringIO()
+        call_command('api_profile', stdout=out)
+        self.assertIn('No profiling data', out.getvalue())
+
+        # The worker drops its old window instead of publishing it again
+        self.client.get('/api/dashboard/')
+        self.wait_for_flush()
+        self.assertNotIn('public-deck', profiling.summarize())
+
+
+@override_settings(ROOT_URLCONF='flashcards.asgi_urls')
+class AsyncViewTests(APITestCase):
+    """Under ASGI the async read views stand in for the DRF views"""
+
+    def test_only_asgi_routes_to_async_views(self):
+        self.assertIs(resolve('/api/study/deck/', urlconf='flashcards.urls').func, views.public_deck)
+        self.assertIs(resolve('/api/study/deck/').func, async_views.public_deck)
+        self.assertIs(resolve('/api/auth/me/').func, async_views.get_current_teacher)
+
+    async def test_public_deck_under_asgi(self):
+        deck = await sync_to_async(self.make_deck)(cards=4)
+        response = await self.async_client.get(f'/api/study/{deck.slug}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['cards']), 4)
+        response = await self.async_client.get(
+            f'/api/study/{deck.slug}/', headers={'If-None-Match': response['ETag']}
+        )
+        self.assertEqual(response.status_code, 304)
+        response = await self.async_client.get('/api/study/missing/')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('detail', response.json())
+
+    async def test_exports_stream_asynchronously_under_asgi(self):
+        deck = await sync_to_async(self.make_deck)(cards=3)
+        expected = await sync_to_async(
+            lambda: b''.join(self.client.get(f'/api/study/{deck.slug}/export/csv/').streaming_content)
+        )()
+        response = await self.async_client.get(f'/api/study/{deck.slug}/export/csv/')
+        self.assertTrue(response.is_async)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), expected)
+
+    def test_paginated_list_falls_back_to_viewset(self):
+        self.make_deck(title='One')
+        self.make_deck(title='Two')
+        response = self.client.get('/api/decks/?page_size=1')
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertIsNotNone(response.json()['next'])
+
+    async def test_anonymous_reads_are_throttled(self):
+        deck = await sync_to_async(self.make_deck)()
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            override_settings(THROTTLE_DATABASE=os.path.join(tmp_dir, 'throttle.sqlite3')),
+            mock.patch.dict(AnonRateThrottle.THROTTLE_RATES, {'anon': '2/hour'}),
+        ):
+            statuses = [(await self.async_client.get(f'/api/study/{deck.slug}/')).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+
+@override_settings(EMAIL_TRANSPORT='api.email_service.FakeTransport')
+class ImportParserTests(SimpleTestCase):
+    """Each import format parses the same however the input is split into chunks"""
+
+    SAMPLES = {
+        'json': (
+            'Here you go:\n```json\n[\n  {"question": "Cellule?", "answer": "Unité 🧬"},\n'
+            '  {"q": "Mitose?", "a": "Division → 2"},\n  {"question": 5, "answer": "x"},\n'
+            '  {"question": "Cut", "answ\n',
+            [
+                (4, 'Cellule?', 'Unité 🧬', None),
+                (5, 'Mitose?', 'Division → 2', None),
+                (6, None, None, 'Question and answer must be text'),
+                (7, None, None, 'Incomplete card at end of input'),
+            ],
+        ),
+        'csv': (
+            'question,answer\n"Q, with comma","Multi\nline"\nOnly one cell\nÉté?,Summer\n',
+            [
+                (2, 'Q, with comma', 'Multi\nline', None),
+                (4, None, None, 'Expected question,answer'),
+                (5, 'Été?', 'Summer', None),
+            ],
+        ),
+        'anki': (
+            '# comment\nCell?\tUnit\nno tab here\nÉté?\tSummer 🌞\n',
+            [
+                (2, 'Cell?', 'Unit', None),
+                (3, None, None, 'Expected question<TAB>answer'),
+                (4, 'Été?', 'Summer 🌞', None),
+            ],
+        ),
+        'table': (
+            '| Term | Definition |\n|---|---|\n| Cell | Unit |\n| Été | Summer |\n',
+            [(3, 'Cell', 'Unit', None), (4, 'Été', 'Summer', None)],
+        ),
+        'qa': (
+            'Q: What is a cell?\nA: The unit\nof life\n\n2. Été?\nA: Summer\n3. Orphan?\n',
+            [
+                (1, 'What is a cell?', 'The unit\nof life', None),
+                (5, 'Été?', 'Summer', None),
+                (7, None, None, 'Missing answer'),
+            ],
+        ),
+    }
+
+    def parse(self, import_format, text, chunk_size=None):
+        data = text.encode()
+        size = chunk_size or len(data)
+        chunks = [data[start:start + size] for start in range(0, len(data), size)]
+        return [tuple(card) for card in imports.PARSERS[import_format](imports.iter_text(chunks))]
+
+    def test_formats(self):
+        for import_format, (text, expected) in self.SAMPLES.items():
+            with self.subTest(import_format):
+                self.assertEqual(imports.detect_format(text), import_format)
+                self.assertEqual(self.parse(import_format, text), expected)
+
+    def test_chunk_boundaries(self):
+        # Single bytes split every multi-byte character and every JSON object
+        for import_format, (text, expected) in self.SAMPLES.items():
+            for chunk_size in (1, 2, 3, 7):
+                with self.subTest(import_format, chunk_size=chunk_size):
+                    self.assertEqual(self.parse(import_format, text, chunk_size), expected)
+
+    def test_json_shapes(self):
+        cards = [(1, 'A?', 'B', None), (2, 'C?', 'D', None)]
+        wrapped = '{"cards": [{"question": "A?", "answer": "B"},\n{"question": "C?", "answer": "D"}]}'
+        lines = '{"question": "A?", "answer": "B"}\n{"front": "C?", "back": "D"}\n'
+        for text in (wrapped, lines):
+            for chunk_size in (None, 1, 5):
+                self.assertEqual(self.parse('json', text, chunk_size), cards)
+        self.assertEqual(
+            self.parse('json', '{bad}\n{"q": "C?", "a": "D"}'),
+            [(1, None, None, 'Invalid JSON'), (2, 'C?', 'D', None)]
+        )
+
+    def test_invisible_characters_dropped(self):
+        self.assertEqual(self.parse('anki', '\ufeffCell?\u200b\tUnit\n'), [(1, 'Cell?', 'Unit', None)])
+
+
+class OutboxTests(TestCase):
+    """Handlers only enqueue; the worker sends in batches and backs off on failure"""
+
+    def setUp(self):
+        email_service.FakeTransport.reset()
+        self.teacher = Teacher(name='Ada <Teacher>', email='ada@example.com')
+
+    def test_enqueue_does_not_send(self):
+        with self.assertNumQueries(1):
+            message = email_service.send_verification_email(self.teacher, 'token123')
+        self.assertEqual(message.status, OutboundEmail.PENDING)
+        self.assertIn('/verify/token123', message.html)
+        self.assertIn('Ada &lt;Teacher&gt;', message.html)
+        self.assertEqual(email_service.FakeTransport.sent, [])
+
+    def test_worker_sends_concurrently(self):
+        email_service.FakeTransport.reset(latency=0.05)
+        for i in range(20):
+            email_service.enqueue(f'teacher{i}@example.com', 'Hello', 'verification', {'url': 'x'})
+        start = time.perf_counter()
+        self.assertEqual(email_service.process_outbox(batch_size=8, concurrency=10), (20, 0))
+        # Twenty sends of 50ms each, at most ten at a time
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(len(email_service.FakeTransport.sent), 20)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT).exists())
+
+    def test_failures_back_off_then_give_up(self):
+        email_service.FakeTransport.reset(failures={
+            'slow@example.com': ConnectionError('timeout'),
+            'bad@example.com': email_service.PermanentEmailError('invalid address'),
+        })
+        slow = email_service.enqueue('slow@example.com', 'Hi', 'verification', {})
+        bad = email_service.enqueue('bad@example.com', 'Hi', 'verification', {})
+        self.assertEqual(email_service.process_outbox(), (0, 2))
+        slow.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual((slow.status, slow.attempts), (OutboundEmail.PENDING, 1))
+        self.assertGreater(slow.next_attempt_at, timezone.now())
+        self.assertEqual(bad.status, OutboundEmail.FAILED)
+        # Nothing is due until the backoff has passed
+        self.assertEqual(email_service.process_outbox(), (0, 0))
+
+        OutboundEmail.objects.update(next_attempt_at=timezone.now(), attempts=5)
+        self.assertEqual(email_service.process_outbox(), (0, 1))
+        slow.refresh_from_db()
+        self.assertEqual((slow.status, slow.attempts), (OutboundEmail.FAILED, 6))
+
+    @override_settings(EMAIL_TRANSPORT='api.email_service.ResendTransport', RESEND_API_KEY='')
+    def test_worker_without_api_key_refuses_to_start(self):
+        message = email_service.enqueue('ada@example.com', 'Hi', 'verification', {})
+        with self.assertRaises(ImproperlyConfigured):
+            call_command('send_emails', '--once', stdout=StringIO())
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (OutboundEmail.PENDING, 0))
+
+    @override_settings(EMAIL_TRANSPORT='api.email_service.ResendTransport', RESEND_API_KEY='re_test')
+    def test_resend_transport(self):
+        import resend
+
+        sent = email_service.enqueue('ada@example.com', 'Hi', 'verification', {})
+        bad = email_service.enqueue('bad@example.com', 'Hi', 'verification', {})
+        rejected = resend.exceptions.ResendError(
+            code=422, error_type='validation_error', message='Invalid `to` field', suggested_action=''
+        )
+        with mock.patch('resend.Emails.send', side_effect=[{'id': 're_1'}, rejected]) as send:
+            call_command('send_emails', '--once', stdout=StringIO())
+        self.assertEqual(send.call_args_list[0].args[0]['to'], 'ada@example.com')
+        sent.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual((sent.status, sent.provider_id), (OutboundEmail.SENT, 're_1'))
+        self.assertEqual(bad.status, OutboundEmail.FAILED)
+
+    def test_fake_transport_keeps_the_latest_messages(self):
+        transport = email_service.FakeTransport()
+        with mock.patch.object(email_service.FakeTransport, 'limit', 3):
+            ids = [transport.send(OutboundEmail(to=f'{i}@example.com')) for i in range(5)]
+        self.assertEqual(ids[-1], 'fake-5')
+        self.assertEqual(
+            [message.to for message in email_service.FakeTransport.sent],
+            ['2@example.com', '3@example.com', '4@example.com']
+        )
+
+
+@override_settings(THROTTLE_DATABASE=':memory:')
+class ThrottleTests(SimpleTestCase):
+    """GCRA buckets: a burst of the full rate, then one request per interval"""
+
+    def setUp(self):
+        throttling.store.clear()
+
+    def test_burst_then_refill(self):
+        hits = [throttling.store.hit('login', 1000.0, 6.0, 10) for _ in range(11)]
+        self.assertEqual([allowed for allowed, _ in hits], [True] * 10 + [False])
+        self.assertEqual(hits[-1][1], 6.0)
+        self.assertEqual(throttling.store.hit('login', 1006.0, 6.0, 10), (True, 6.0))
+        self.assertFalse(throttling.store.hit('login', 1006.0, 6.0, 10)[0])
+        self.assertTrue(throttling.store.hit('other', 1006.0, 6.0, 10)[0])
+
+    def test_login_throttle(self):
+        with mock.patch.dict(LoginRateThrottle.THROTTLE_RATES, {'login': '2/minute'}):
+            statuses = [
+                self.client.post('/api/auth/login/', {}, content_type='application/json').status_code
+                for _ in range(3)
+            ]
+        self.assertEqual(statuses, [400, 400, 429])
+
+
+@mock.patch('api.middleware.has_replica', lambda: True)
+@mock.patch('api.routers.has_replica', lambda: True)
+class ReplicaRoutingTests(SimpleTestCase):
+    """Public reads go to the replica, everything else to the primary"""
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+        @read_from_replica
+        def view(request):
+            return self.router.db_for_read(Deck)
+
+        self.view = view
+
+    def test_reads_outside_replica_views_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Deck), 'default')
+
+    def test_replica_view_reads_from_replica(self):
+        self.assertEqual(self.view(self.factory.get('/')), 'replica')
+        self.assertEqual(self.router.db_for_read(Deck), 'default')
+
+    def test_writes_use_primary(self):
+        self.assertEqual(self.router.db_for_write(Deck), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'api'))
+
+    def test_recent_writer_reads_from_primary(self):
+        response = PrimaryPinMiddleware(lambda request: HttpResponse())(self.factory.put('/'))
+        request = self.factory.get('/')
+        request.COOKIES[PRIMARY_PIN_COOKIE] = response.cookies[PRIMARY_PIN_COOKIE].value
+        self.assertEqual(self.view(request), 'default')
+        request.COOKIES[PRIMARY_PIN_COOKIE] = str(time.time() - 1)
+        self.assertEqual(self.view(request), 'replica')
+
+    def test_async_replica_view_reads_from_replica(self):
+        @read_from_replica
+        async def view(request):
+            return await sync_to_async(self.router.db_for_read)(Deck)
+
+        self.assertEqual(async_to_sync(view)(self.factory.get('/')), 'replica')
+
+    def test_without_replica_nothing_changes(self):
+        with mock.patch('api.routers.has_replica', lambda: False):
+            self.assertEqual(self.view(self.factory.get('/')), 'default')
@@ -0,0 +1,99 @@
+"""
+Rate limiting shared by every gunicorn worker on the host.
+
+DRF's SimpleRateThrottle keeps a list of request timestamps per client in
+the Django cache, one entry per request in the window, and updates it with
+a read-modify-write, so concurrent workers overwrite each other's counts
+(and with a per-process cache each worker counts on its own).
+
+These throttles keep one fixed-size row per client in a small SQLite
+database (settings.THROTTLE_DATABASE) and apply GCRA, the token bucket
+expressed as a single "theoretical arrival time": a rate of N/period
+allows a burst of N requests and refills one every period/N seconds. Each
+check is one INSERT ... ON CONFLICT DO UPDATE ... RETURNING statement,
+atomic across processes and well under a millisecond (see
+benchmarks/bench_throttle.py). Rows whose bucket has refilled are pruned
+now and then; they are equivalent to no row at all.
+"""
+import sqlite3
+import threading
+
+from django.conf import settings
+from rest_framework import throttling
+
+PRUNE_EVERY = 1000  # checks per process between deletes of refilled buckets
+
+_HIT_SQL = '''
+    INSERT INTO throttle (key, tat, allowed) VALUES (:key, :now + :interval, 1)
+    ON CONFLICT (key) DO UPDATE SET
+        allowed = MAX(tat, :now) - :now <= :tolerance,
+        tat = CASE WHEN MAX(tat, :now) - :now <= :tolerance THEN MAX(tat, :now) + :interval ELSE tat END
+    RETURNING tat, allowed
+'''
+
+
+class BucketStore:
+    """GCRA buckets in a SQLite file, one connection per thread"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.checks = 0
+
+    def connection(self):
+        path = str(settings.THROTTLE_DATABASE)
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.path != path:
+            db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+            # Counters are disposable: skip fsync, and let readers and the writer overlap
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=OFF')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS throttle '
+                '(key TEXT PRIMARY KEY, tat REAL NOT NULL, allowed INTEGER NOT NULL) WITHOUT ROWID'
+            )
+            self.local.db, self.local.path = db, path
+        return db
+
+    def hit(self, key, now, interval, burst):
+        """
+        Count a request against key at time now for a rate of one per
+        interval seconds with bursts of burst. Returns (allowed, seconds to
+        wait before the next request is allowed).
+        """
+        tolerance = interval * (burst - 1)
+        db = self.connection()
+        tat, allowed = db.execute(_HIT_SQL, {
+            'key': key, 'now': now, 'interval': interval, 'tolerance': tolerance,
+        }).fetchone()
+        self.checks += 1
+        if self.checks % PRUNE_EVERY == 0:
+            db.execute('DELETE FROM throttle WHERE tat < ?', (now,))
+        return bool(allowed), max(0.0, tat - now - tolerance)
+
+    def clear(self):
+        self.connection().execute('DELETE FROM throttle')
+
+
+store = BucketStore()
+
+
+class SharedRateThrottle(throttling.SimpleRateThrottle):
+    """SimpleRateThrottle counting in the shared BucketStore instead of the cache"""
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        allowed, self.wait_seconds = store.hit(
+            self.key, self.timer(), self.duration / self.num_requests, self.num_requests
+        )
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class AnonRateThrottle(SharedRateThrottle, throttling.AnonRateThrottle):
+    pass
@@ -12,5 +12,10 @@ urlpatterns = [
     path('auth/login/', views.AuthView.as_view(), {'action': 'login'}, name='login'),
     path('auth/logout/', views.logout, name='logout'),
     path('auth/me/', views.get_current_teacher, name='current-teacher'),
+    path('dashboard/', views.get_dashboard, name='dashboard'),
     path('study/<slug:slug>/', views.public_deck, name='public-deck'),
+    path('study/<slug:slug>/changes/', views.public_deck_changes, name='public-deck-changes'),
+    path('study/<slug:slug>/export/<str:export_format>/', views.public_deck_export, name='public-deck-export'),
+    path('search/', views.search_decks, name='search-decks'),
+    path('profiling/', views.profiling_stats, name='profiling-stats'),
 ]
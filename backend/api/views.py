@@ -1,21 +1,64 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import api_view, action, authentication_classes, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.throttling import AnonRateThrottle
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
+from django.conf import settings
+from django.db import transaction
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import get_object_or_404
 from django.middleware.csrf import get_token
-from django.http import JsonResponse
-
-from .models import Teacher, Subject, Deck, Card
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from .cache import deck_etag, get_public_deck_payload, render_public_deck_payload
+from .models import Teacher, Subject, Deck, VersionConflict
+from .pagination import DeckPagination, SubjectPagination
+from .routers import read_from_replica
+from .throttling import AnonRateThrottle
+from . import dashboard, exports, imports, profiling, search, sync
 from .serializers import (
     TeacherSerializer, TeacherRegisterSerializer, TeacherLoginSerializer,
     SubjectSerializer, DeckSerializer, DeckListSerializer, DeckCreateSerializer,
-    CardSerializer
+    DeckMetadataSerializer, DeckSearchSerializer, CardSerializer
 )
 
 
+def set_deck_validators(response, etag, public=True):
+    """Attach the ETag and revalidation Cache-Control to a deck response"""
+    response['ETag'] = etag
+    # no-cache lets browsers and nginx store the payload but forces a
+    # conditional request, which we answer with a cheap 304
+    if public:
+        patch_cache_control(response, no_cache=True, public=True)
+    else:
+        patch_cache_control(response, no_cache=True, private=True)
+    return response
+
+
+def streaming_response(request, chunks, content_type):
+    """A StreamingHttpResponse over chunks, async under ASGI (see api.exports)"""
+    if isinstance(request._request, ASGIRequest):
+        chunks = exports.aiter_chunks(chunks)
+    return StreamingHttpResponse(chunks, content_type=content_type)
+
+
+def export_response(request, deck, export_format, public=True):
+    """Stream one deck's export as a download, answering revalidations with 304"""
+    if export_format not in exports.FORMATS:
+        return Response({'error': 'Unknown export format'}, status=status.HTTP_404_NOT_FOUND)
+    etag = exports.export_etag(deck, export_format)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = streaming_response(
+            request, exports.iter_export(deck, export_format),
+            content_type=exports.FORMATS[export_format][1]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{exports.export_filename(deck, export_format)}"'
+    return set_deck_validators(response, etag, public=public)
+
+
 class LoginRateThrottle(AnonRateThrottle):
     """Rate limit for login attempts: 5 per minute"""
     scope = 'login'
@@ -28,6 +71,8 @@ class RegisterRateThrottle(AnonRateThrottle):
 
 class AuthView(APIView):
     """Handle teacher authentication"""
+    # Always anonymous, so the login and register throttles apply to everyone
+    authentication_classes = []
 
     def get_throttles(self):
         if self.kwargs.get('action') == 'login':
@@ -57,27 +102,20 @@ class AuthView(APIView):
     def login(self, request):
         serializer = TeacherLoginSerializer(data=request.data)
         if serializer.is_valid():
-            email = serializer.validated_data['email']
-            password = serializer.validated_data['password']
-
-            try:
-                teacher = Teacher.objects.get(email=email)
-                if teacher.check_password(password):
-                    request.session['teacher_id'] = teacher.id
-                    return Response({
-                        'message': 'Login successful',
-                        'teacher': TeacherSerializer(teacher).data
-                    })
-                else:
-                    return Response(
-                        {'error': 'Invalid credentials'},
-                        status=status.HTTP_401_UNAUTHORIZED
-                    )
-            except Teacher.DoesNotExist:
-                return Response(
-                    {'error': 'Invalid credentials'},
-                    status=status.HTTP_401_UNAUTHORIZED
-                )
+            teacher = Teacher.authenticate(
+                serializer.validated_data['email'],
+                serializer.validated_data['password']
+            )
+            if teacher:
+                request.session['teacher_id'] = teacher.id
+                return Response({
+                    'message': 'Login successful',
+                    'teacher': TeacherSerializer(teacher).data
+                })
+            return Response(
+                {'error': 'Invalid credentials'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -87,13 +125,9 @@ def get_current_teacher(request):
     # Ensure CSRF cookie is set
     get_token(request)
 
-    teacher_id = request.session.get('teacher_id')
-    if teacher_id:
-        try:
-            teacher = Teacher.objects.get(id=teacher_id)
-            return Response(TeacherSerializer(teacher).data)
-        except Teacher.DoesNotExist:
-            pass
+    teacher = getattr(request, 'teacher', None)
+    if teacher:
+        return Response(TeacherSerializer(teacher).data)
     return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
 
 
@@ -108,6 +142,7 @@ def logout(request):
 
 class SubjectViewSet(viewsets.ModelViewSet):
     serializer_class = SubjectSerializer
+    pagination_class = SubjectPagination
 
     def get_queryset(self):
         teacher_id = self.request.session.get('teacher_id')
@@ -116,14 +151,16 @@ class SubjectViewSet(viewsets.ModelViewSet):
         return Subject.objects.none()
 
     def perform_create(self, serializer):
-        teacher_id = self.request.session.get('teacher_id')
-        if teacher_id:
-            teacher = Teacher.objects.get(id=teacher_id)
+        teacher = getattr(self.request, 'teacher', None)
+        if teacher:
             serializer.save(teacher=teacher)
 
 
 class DeckViewSet(viewsets.ModelViewSet):
     lookup_field = 'slug'
+    pagination_class = DeckPagination
+    # Version a PUT or PATCH was based on, see check_version
+    expected_version = None
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -135,35 +172,17 @@ class DeckViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         # For retrieve action (public deck viewing), allow any public deck
         if self.action == 'retrieve':
-            return Deck.objects.filter(is_public=True)
+            return Deck.objects.filter(is_public=True).select_related('subject', 'teacher')
 
         # For other actions, require authentication
         teacher_id = self.request.session.get('teacher_id')
-        if teacher_id:
-            return Deck.objects.filter(teacher_id=teacher_id)
-        return Deck.objects.none()
-
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        teacher_id = self.request.session.get('teacher_id')
-        if teacher_id:
-            try:
-                teacher = Teacher.objects.get(id=teacher_id)
-                self.request.teacher = teacher
-                context['request'].teacher = teacher
-            except Teacher.DoesNotExist:
-                pass
-        return context
-
-    def perform_create(self, serializer):
-        # Ensure teacher is set before saving
-        teacher_id = self.request.session.get('teacher_id')
-        if teacher_id:
-            try:
-                self.request.teacher = Teacher.objects.get(id=teacher_id)
-            except Teacher.DoesNotExist:
-                pass
-        serializer.save()
+        if not teacher_id:
+            return Deck.objects.none()
+        queryset = Deck.objects.filter(teacher_id=teacher_id)
+        if self.action == 'list':
+            # card_count is a column, so listing needs no join against cards
+            return queryset.select_related('subject')
+        return queryset.select_related('subject', 'teacher')
 
     def create(self, request, *args, **kwargs):
         teacher_id = request.session.get('teacher_id')
@@ -174,6 +193,16 @@ class DeckViewSet(viewsets.ModelViewSet):
             )
         return super().create(request, *args, **kwargs)
 
+    @read_from_replica
+    def retrieve(self, request, *args, **kwargs):
+        deck = self.get_object()
+        etag = deck_etag(deck)
+        # Answer revalidations before the cards are loaded
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(self.get_serializer(deck).data)
+        return set_deck_validators(response, etag, public=False)
+
     def update(self, request, *args, **kwargs):
         teacher_id = request.session.get('teacher_id')
         if not teacher_id:
@@ -188,8 +217,37 @@ class DeckViewSet(viewsets.ModelViewSet):
                 {'error': 'Not authorized'},
                 status=status.HTTP_403_FORBIDDEN
             )
+        self.expected_version = self.check_version(request, deck)
         return super().update(request, *args, **kwargs)
 
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            deck = serializer.save()
+            deck.confirm_version(self.expected_version)
+
+    def partial_update(self, request, *args, **kwargs):
+        """Change some of a deck's own fields; answers without the cards"""
+        teacher_id = request.session.get('teacher_id')
+        if not teacher_id:
+            return Response(
+                {'error': 'Authentication required'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        deck = self.get_object()
+        if deck.teacher_id != teacher_id:
+            return Response(
+                {'error': 'Not authorized'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        self.expected_version = self.check_version(request, deck)
+        serializer = DeckMetadataSerializer(deck, data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        response = Response(serializer.data)
+        response['ETag'] = deck_etag(deck)
+        return response
+
     def destroy(self, request, *args, **kwargs):
         teacher_id = request.session.get('teacher_id')
         if not teacher_id:
@@ -223,23 +281,296 @@ class DeckViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        # Delete existing cards and create new ones
-        deck.cards.all().delete()
+        expected = self.check_version(request, deck)
+        # Keep unchanged cards, update edited ones and insert/delete the rest
+        deck.sync_cards(request.data.get('cards', []), expected)
 
-        cards_data = request.data.get('cards', [])
-        for idx, card_data in enumerate(cards_data):
-            Card.objects.create(
-                deck=deck,
-                question=card_data.get('question', ''),
-                answer=card_data.get('answer', ''),
-                order=idx
+        return Response(DeckSerializer(deck).data)
+
+    def owned_deck(self, request):
+        """(deck, None) if the deck belongs to the signed-in teacher, else (None, error response)"""
+        teacher_id = request.session.get('teacher_id')
+        if not teacher_id:
+            return None, Response(
+                {'error': 'Authentication required'},
+                status=status.HTTP_401_UNAUTHORIZED
             )
 
-        return Response(DeckSerializer(deck).data)
+        deck = self.get_object()
+        if deck.teacher_id != teacher_id:
+            return None, Response(
+                {'error': 'Not authorized'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return deck, None
+
+    def check_version(self, request, deck):
+        """
+        The deck version a write is based on: the one in the deck ETag sent
+        as If-Match, or the version field of the body. None when the request
+        gives neither, and the write then goes through unchecked. Raises
+        VersionConflict, before any work is done, when it is not current.
+        """
+        if_match = request.headers.get('If-Match')
+        if if_match:
+            if if_match.strip() == '*':
+                return None
+            if deck_etag(deck) not in {tag.strip().removeprefix('W/') for tag in if_match.split(',')}:
+                raise VersionConflict(deck.version)
+            return deck.version
+
+        version = request.data.get('version')
+        if version is None:
+            return None
+        try:
+            version = int(version)
+        except (TypeError, ValueError):
+            raise ValidationError({'version': 'Must be a whole number'})
+        if version != deck.version:
+            raise VersionConflict(deck.version)
+        return version
+
+    def handle_exception(self, exc):
+        if isinstance(exc, VersionConflict):
+            return Response(
+                {'error': 'The deck was changed since it was loaded', 'version': exc.current},
+                status=status.HTTP_409_CONFLICT
+            )
+        return super().handle_exception(exc)
+
+    def save_card_write(self, deck, expected):
+        """
+        First write of a single-card change: moves the deck's version on,
+        which locks the row so concurrent writes go in turn, and forgets the
+        content hash sync_cards compares against
+        """
+        deck.content_hash = ''
+        deck.save(update_fields=['updated_at', 'content_hash'])
+        deck.confirm_version(expected)
+
+    def card_anchor(self, deck, data):
+        """The before= or after= card of a request as card_position() arguments"""
+        anchor = {key: data[key] for key in ('before', 'after') if data.get(key) is not None}
+        if len(anchor) > 1:
+            raise ValidationError({'error': 'Give before or after, not both'})
+        for key, card_id in anchor.items():
+            try:
+                card_id = int(card_id)
+            except (TypeError, ValueError):
+                raise ValidationError({key: 'Must be the id of a card in this deck'})
+            anchor[key] = get_object_or_404(deck.cards.only('id', 'deck_id', 'order'), pk=card_id)
+        return anchor
+
+    @action(detail=True, methods=['post'], url_path='cards')
+    def add_card(self, request, slug=None):
+        """Insert one card at the end, or before/after the card with the given id"""
+        deck, error = self.owned_deck(request)
+        if error:
+            return error
+        expected = self.check_version(request, deck)
+        serializer = CardSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        anchor = self.card_anchor(deck, request.data)
+
+        with transaction.atomic():
+            # Concurrent inserts pick their positions in turn
+            self.save_card_write(deck, expected)
+            card = serializer.save(deck=deck, order=deck.card_position(**anchor))
+            deck.log_card_changes(inserted=[card.id])
+        return Response(CardSerializer(card).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['patch', 'delete'], url_path=r'cards/(?P<card_id>\d+)')
+    def card(self, request, slug=None, card_id=None):
+        """Edit one card's question and/or answer, or delete it"""
+        deck, error = self.owned_deck(request)
+        if error:
+            return error
+        expected = self.check_version(request, deck)
+        card = get_object_or_404(deck.cards, pk=card_id)
+        serializer = None
+        if request.method == 'PATCH':
+            serializer = CardSerializer(card, data=request.data, partial=True)
+            serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            self.save_card_write(deck, expected)
+            if serializer is None:
+                deck.log_card_changes(deleted=[card.id])
+                card.delete()
+            else:
+                serializer.save()
+                deck.log_card_changes(updated=[card.id])
+        if serializer is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['post'], url_path=r'cards/(?P<card_id>\d+)/move')
+    def move_card(self, request, slug=None, card_id=None):
+        """Move one card before or after another; only the moved card is written"""
+        deck, error = self.owned_deck(request)
+        if error:
+            return error
+        expected = self.check_version(request, deck)
+        card = get_object_or_404(deck.cards, pk=card_id)
+        anchor = self.card_anchor(deck, request.data)
+        if not anchor:
+            return Response({'error': 'Give before or after'}, status=status.HTTP_400_BAD_REQUEST)
+        if any(neighbour.pk == card.pk for neighbour in anchor.values()):
+            return Response({'error': 'A card cannot move next to itself'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            self.save_card_write(deck, expected)
+            card.order = deck.card_position(**anchor, moving=card)
+            card.save(update_fields=['order'])
+            deck.log_card_changes(updated=[card.id])
+        return Response(CardSerializer(card).data)
+
+    @action(detail=True, methods=['get'])
+    def changes(self, request, slug=None):
+        """Card changes since the deck version in ?since= (see api.sync)"""
+        since = sync.parse_since(request.query_params.get('since'))
+        if since is None:
+            return Response({'since': 'Must be a deck version'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(sync.changes(self.get_object(), since))
+
+    @action(detail=True, methods=['post'], url_path=r'import/(?P<import_format>[a-z]+)')
+    def import_cards(self, request, slug=None, import_format=None):
+        """
+        Append cards from the raw request body or an uploaded ``file``,
+        streamed and parsed incrementally (see api.imports for formats)
+        """
+        teacher_id = request.session.get('teacher_id')
+        if not teacher_id:
+            return Response(
+                {'error': 'Authentication required'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        if import_format != 'auto' and import_format not in imports.PARSERS:
+            return Response({'error': 'Unknown import format'}, status=status.HTTP_404_NOT_FOUND)
+
+        deck = self.get_object()
+        if request.content_type.startswith('multipart/form-data'):
+            stream = request.FILES.get('file')
+        else:
+            stream = request.stream
+        if stream is None:
+            return Response({'error': 'No cards to import'}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = imports.import_cards(deck, stream, import_format)
+        data = {**report.as_dict(), 'card_count': deck.card_count}
+        return Response(data, status=status.HTTP_200_OK if report.imported else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['get'], url_path=r'export/(?P<export_format>[a-z]+)')
+    def export(self, request, slug=None, export_format=None):
+        """Download a deck as anki, quizlet, kahoot or csv"""
+        return export_response(request, self.get_object(), export_format, public=False)
+
+    @action(detail=False, methods=['get'], url_path=r'export/(?P<export_format>[a-z]+)')
+    def export_library(self, request, export_format=None):
+        """Download every deck of the teacher as one zip archive"""
+        if not request.session.get('teacher_id'):
+            return Response(
+                {'error': 'Authentication required'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        if export_format not in exports.FORMATS:
+            return Response({'error': 'Unknown export format'}, status=status.HTTP_404_NOT_FOUND)
+
+        decks = self.get_queryset().order_by('id').iterator()
+        response = streaming_response(
+            request, exports.iter_library_zip(decks, export_format),
+            content_type='application/zip'
+        )
+        response['Content-Disposition'] = f'attachment; filename="flashcards_{export_format}.zip"'
+        return response
+
+
+@api_view(['GET'])
+def get_dashboard(request):
+    """Subjects with their decks and counts for the signed-in teacher"""
+    teacher = getattr(request, 'teacher', None)
+    if not teacher:
+        return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(dashboard.dashboard_payload(teacher.id), content_type='application/json')
+
+
+@api_view(['GET'])
+def public_deck_export(request, slug, export_format):
+    """Download a public deck as anki, quizlet, kahoot or csv (no auth required)"""
+    deck = get_object_or_404(Deck, slug=slug, is_public=True)
+    return export_response(request, deck, export_format)
 
 
 @api_view(['GET'])
+@read_from_replica
 def public_deck(request, slug):
     """Get a public deck by slug (no auth required)"""
-    deck = get_object_or_404(Deck, slug=slug, is_public=True)
-    return Response(DeckSerializer(deck).data)
+    cached = get_public_deck_payload(slug)
+    if cached is not None:
+        etag, payload = cached
+        response = get_conditional_response(request, etag=etag)
+    else:
+        deck = get_object_or_404(
+            Deck.objects.select_related('subject', 'teacher'),
+            slug=slug, is_public=True
+        )
+        etag = deck_etag(deck)
+        # Answer revalidations before the cards are loaded
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            etag, payload = render_public_deck_payload(deck, DeckSerializer(deck).data)
+    if response is None:
+        response = HttpResponse(payload, content_type='application/json')
+    return set_deck_validators(response, etag)
+
+
+@api_view(['GET'])
+@read_from_replica
+def public_deck_changes(request, slug):
+    """Card changes to a public deck since the version in ?since= (see api.sync)"""
+    since = sync.parse_since(request.query_params.get('since'))
+    if since is None:
+        return Response({'since': 'Must be a deck version'}, status=status.HTTP_400_BAD_REQUEST)
+    deck = get_object_or_404(
+        Deck.objects.select_related('subject', 'teacher'),
+        slug=slug, is_public=True
+    )
+    return Response(sync.changes(deck, since))
+
+
+@api_view(['GET'])
+def search_decks(request):
+    """Search and browse public decks (no auth required)"""
+    params = request.query_params
+    filters = {
+        field: params[field]
+        for field in search.FACET_FIELDS
+        if params.get(field)
+    }
+    try:
+        limit = min(max(int(params.get('limit', 20)), 1), 50)
+        offset = max(int(params.get('offset', 0)), 0)
+    except ValueError:
+        return Response({'error': 'limit and offset must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+    decks, total, facets = search.search_decks(params.get('q', ''), filters, limit, offset)
+    return Response({
+        'count': total,
+        'results': DeckSearchSerializer(decks, many=True).data,
+        'facets': facets,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profiling_stats(request):
+    """Per-endpoint latency and query aggregates (Django staff only)"""
+    try:
+        limit = int(request.query_params.get('slowest', 10))
+    except ValueError:
+        limit = 10
+    return Response({
+        'enabled': settings.API_PROFILING,
+        'endpoints': profiling.summarize(),
+        'slowest': profiling.slowest_requests(limit),
+    })
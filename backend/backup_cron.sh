@@ -32,7 +32,7 @@ cd "$BACKEND_DIR"
 source venv/bin/activate
 
 # Run the backup command with JSON export
-python manage.py backup_db --json --keep $KEEP_BACKUPS --settings=flashcards.settings_prod
+python manage.py backup_db --json --compress --verify --keep $KEEP_BACKUPS --settings=flashcards.settings_prod
 
 echo "Backup completed at $(date)"
 echo ""
@@ -0,0 +1,189 @@
+"""
+Concurrent-connection capacity and tail latency, sync vs ASGI workers.
+
+Starts gunicorn twice on a throwaway database, first with the sync workers
+gunicorn.service uses and then with uvicorn workers serving
+flashcards.asgi, and loads GET /api/study/<slug>/ from --concurrency
+clients at once (one connection per request, so sync workers are not
+penalised for lacking keep-alive). Each load level is repeated with
+--slow extra clients that trickle their request headers over
+--slow-seconds, like students on a poor mobile connection hitting gunicorn
+directly. Reports requests/s, p50/p99 latency and requests that failed or
+took longer than --timeout.
+
+Needs gunicorn and uvicorn-worker (pip install gunicorn uvicorn-worker).
+The load generator shares the machine with the server, so compare the two
+modes with each other rather than with production numbers.
+
+    python -m benchmarks.bench_asgi
+    python -m benchmarks.bench_asgi --workers 3 --concurrency 10,100,400 --slow 6
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+from .common import setup_database, make_teacher, make_cards, print_table
+
+setup_database()
+
+from django.conf import settings  # noqa: E402
+from django.db import connections  # noqa: E402
+
+from api.serializers import DeckCreateSerializer  # noqa: E402
+from api.throttling import AnonRateThrottle  # noqa: E402
+
+HOST = '127.0.0.1'
+
+
+def serve(mode, port, workers):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{HOST}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('loglevel', 'warning')
+            if mode == 'asgi':
+                self.cfg.set('worker_class', 'uvicorn_worker.UvicornWorker')
+
+        def load(self):
+            if mode == 'asgi':
+                from flashcards.asgi import application
+                return application
+            from django.core.wsgi import get_wsgi_application
+            return get_wsgi_application()
+
+    connections.close_all()  # Never share the parent's SQLite connection
+    Server().run()
+
+
+def start_server(mode, workers):
+    with socket.socket() as probe:
+        probe.bind((HOST, 0))
+        port = probe.getsockname()[1]
+    process = multiprocessing.get_context('fork').Process(target=serve, args=(mode, port, workers))
+    process.start()
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+async def fetch(port, path, timeout):
+    """One request on a fresh connection; returns latency in ms, or None on failure"""
+    start = time.perf_counter()
+    try:
+        async with asyncio.timeout(timeout):
+            reader, writer = await asyncio.open_connection(HOST, port)
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {HOST}\r\nConnection: close\r\n\r\n'.encode())
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+    except (OSError, TimeoutError):
+        return None
+    if not response.startswith(b'HTTP/1.1 200'):
+        return None
+    return (time.perf_counter() - start) * 1000
+
+
+async def fast_client(port, path, timeout, stop_at, samples, failures):
+    while time.monotonic() < stop_at:
+        latency = await fetch(port, path, timeout)
+        if latency is None or latency > timeout * 1000:
+            failures.append(1)
+        else:
+            samples.append(latency)
+
+
+async def slow_client(port, path, slow_seconds, stop_at):
+    headers = [f'GET {path} HTTP/1.1\r\n', f'Host: {HOST}\r\n', 'User-Agent: slow\r\n',
+               'Accept: application/json\r\n', 'Connection: close\r\n', '\r\n']
+    while time.monotonic() < stop_at:
+        try:
+            reader, writer = await asyncio.open_connection(HOST, port)
+            for line in headers:
+                writer.write(line.encode())
+                await writer.drain()
+                await asyncio.sleep(slow_seconds / len(headers))
+            await reader.read()
+            writer.close()
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+async def load(port, path, concurrency, slow, slow_seconds, seconds, timeout):
+    samples, failures = [], []
+    stop_at = time.monotonic() + seconds
+    await asyncio.gather(
+        *(slow_client(port, path, slow_seconds, stop_at) for _ in range(slow)),
+        *(fast_client(port, path, timeout, stop_at, samples, failures) for _ in range(concurrency)),
+    )
+    return samples, len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--concurrency', default='10,100,400')
+    parser.add_argument('--slow', type=int, default=6)
+    parser.add_argument('--slow-seconds', type=float, default=5)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--timeout', type=float, default=5)
+    args = parser.parse_args()
+
+    try:
+        import gunicorn  # noqa: F401
+        import uvicorn_worker  # noqa: F401
+    except ImportError:
+        raise SystemExit('This benchmark needs gunicorn and uvicorn-worker: pip install gunicorn uvicorn-worker')
+
+    settings.DEBUG = False
+    settings.THROTTLE_DATABASE = os.path.join(tempfile.mkdtemp(prefix='flashcards-throttle-'), 'throttle.sqlite3')
+    AnonRateThrottle.THROTTLE_RATES['anon'] = None  # One client address makes every request
+
+    teacher, _ = make_teacher()
+    serializer = DeckCreateSerializer(
+        data={'title': 'Cells', 'subject_name': 'Biology', 'is_public': True, 'cards': make_cards(50)},
+        context={'request': SimpleNamespace(teacher=teacher)}
+    )
+    serializer.is_valid(raise_exception=True)
+    deck = serializer.save()
+    path = f'/api/study/{deck.slug}/'
+
+    rows = []
+    for mode in ('sync', 'asgi'):
+        process, port = start_server(mode, args.workers)
+        try:
+            asyncio.run(load(port, path, 1, 0, 0, 1, args.timeout))  # Warm caches in every worker
+            for concurrency in map(int, args.concurrency.split(',')):
+                for slow in (0, args.slow):
+                    samples, failures = asyncio.run(
+                        load(port, path, concurrency, slow, args.slow_seconds, args.seconds, args.timeout)
+                    )
+                    p99 = statistics.quantiles(samples, n=100)[98] if len(samples) > 1 else float('nan')
+                    rows.append([
+                        mode, concurrency, slow, f'{len(samples) / args.seconds:.0f}',
+                        f'{statistics.median(samples):.1f}' if samples else '-', f'{p99:.1f}', failures,
+                    ])
+        finally:
+            process.terminate()
+            process.join()
+
+    print(f'{args.workers} workers, {args.seconds:.0f}s per level, '
+          f'slow clients take {args.slow_seconds:.0f}s to send their headers')
+    print_table(['mode', 'clients', 'slow', 'req/s', 'p50 ms', 'p99 ms', 'failed'], rows)
+
+
+if __name__ == '__main__':
+    main()
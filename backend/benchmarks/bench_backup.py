@@ -0,0 +1,86 @@
+"""
+JSON backup and restore of a large library: dumpdata/loaddata (what
+backup_db --json used to run) against the streaming JSON lines exporter
+and restorer in api.backups.
+
+Reports wall time for each step, or with --memory the peak Python memory
+(tracemalloc, which also makes every step several times slower).
+
+    python -m benchmarks.bench_backup
+    python -m benchmarks.bench_backup --cards 1000000 --skip-legacy
+    python -m benchmarks.bench_backup --cards 100000 --memory
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from .common import setup_database, make_teacher, print_table
+
+setup_database()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+
+from api import backups  # noqa: E402
+from api.models import Card, Deck  # noqa: E402
+
+
+def build_library(total_cards, per_deck=100):
+    teacher, subject = make_teacher()
+    with transaction.atomic():
+        decks = Deck.objects.bulk_create(
+            Deck(title=f'Bench deck {i}', slug=f'bench-deck-{i}', subject=subject, teacher=teacher,
+                 card_count=per_deck)
+            for i in range(total_cards // per_deck)
+        )
+        with connection.cursor() as cursor:
+            for deck in decks:
+                cursor.executemany(
+                    'INSERT INTO api_card (deck_id, question, answer, "order") VALUES (%s, %s, %s, %s)',
+                    [(deck.id, f'Question {n} of deck {deck.id}?', f'Answer {n} ' * 6, n) for n in range(per_deck)]
+                )
+
+
+def measure(func, memory):
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if memory else 0
+    tracemalloc.stop()
+    return f'{elapsed:.1f}', f'{peak / 1024 ** 2:.1f}' if memory else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=200_000)
+    parser.add_argument('--skip-legacy', action='store_true', help='Only run the streaming backup')
+    parser.add_argument('--memory', action='store_true', help='Trace peak memory')
+    args = parser.parse_args()
+
+    build_library(args.cards)
+    tmp_dir = tempfile.mkdtemp(prefix='flashcards-bench-')
+    rows = []
+
+    if not args.skip_legacy:
+        legacy = os.path.join(tmp_dir, 'legacy.json')
+        dump = measure(lambda: call_command('dumpdata', 'api', '--indent', '2', '--output', legacy, verbosity=0), args.memory)
+        rows.append(['dumpdata --indent 2', *dump, f'{os.path.getsize(legacy) / 1024 ** 2:.1f}'])
+        rows.append(['loaddata', *measure(lambda: call_command('loaddata', legacy, verbosity=0), args.memory), ''])
+
+    for name in ('backup.jsonl', 'backup.jsonl.gz'):
+        path = os.path.join(tmp_dir, name)
+        export = measure(lambda: backups.export_jsonl(path), args.memory)
+        rows.append([f'export_jsonl {name}', *export, f'{os.path.getsize(path) / 1024 ** 2:.1f}'])
+    rows.append(['restore_jsonl', *measure(lambda: backups.restore_jsonl(path), args.memory), ''])
+    assert Card.objects.count() == args.cards
+
+    print(f'JSON backup of {args.cards:,} cards')
+    print_table(['step', 's', 'peak MB', 'file MB'], rows)
+
+
+if __name__ == '__main__':
+    main()
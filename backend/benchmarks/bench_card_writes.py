@@ -0,0 +1,74 @@
+"""
+Save latency of DeckViewSet.update_cards-style writes for 50/500/5000 cards.
+
+Compares the old delete-and-recreate loop (one autocommitted INSERT per
+card) with Deck.sync_cards for a full rewrite, a one-card edit and a save
+with no changes. Full rewrites alternate between two card lists, so every
+run writes every card instead of matching the stored content_hash.
+"""
+from itertools import cycle
+
+from .common import setup_database, make_teacher, make_cards, timed, print_table
+
+setup_database()
+
+from django.db.models.signals import post_save  # noqa: E402
+
+from api import search  # noqa: E402
+from api.models import Card, Deck  # noqa: E402
+from api.signals import publish_saved_card  # noqa: E402
+
+SIZES = [50, 500, 5000]
+
+
+def legacy_replace(deck, cards_data):
+    # The old loop predates the search index and deck versions: reindex
+    # once at the end rather than per card, and move the deck on per card
+    # no more than it did then
+    post_save.disconnect(publish_saved_card, sender=Card)
+    try:
+        with search.deferred_indexing():
+            deck.cards.all().delete()
+            for idx, card_data in enumerate(cards_data):
+                Card.objects.create(
+                    deck=deck,
+                    question=card_data.get('question', ''),
+                    answer=card_data.get('answer', ''),
+                    order=idx
+                )
+    finally:
+        post_save.connect(publish_saved_card, sender=Card)
+
+
+def main():
+    teacher, subject = make_teacher()
+    rows = []
+    for size in SIZES:
+        deck = Deck.objects.create(title=f'Bench {size}', subject=subject, teacher=teacher)
+        cards = make_cards(size)
+        repeat = 3 if size >= 5000 else 5
+
+        legacy = timed(lambda: legacy_replace(deck, cards), repeat)
+        rewrites = cycle([make_cards(size, prefix='Rewritten'), cards])
+        rewrite = timed(lambda: deck.sync_cards(next(rewrites)), repeat)
+
+        deck.sync_cards(cards)
+        current = list(deck.cards.values('id', 'question', 'answer'))
+        unchanged = timed(lambda: deck.sync_cards(current), repeat)
+
+        def edit_one():
+            current[0]['answer'] += '!'
+            deck.sync_cards(current)
+        one_edit = timed(edit_one, repeat)
+
+        rows.append([
+            size, f'{legacy:.1f}', f'{rewrite:.1f}', f'{one_edit:.1f}', f'{unchanged:.1f}',
+            f'{legacy / rewrite:.1f}x',
+        ])
+
+    print('Card save latency (median ms)')
+    print_table(['cards', 'legacy loop', 'bulk rewrite', 'one edit', 'no change', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Dashboard load time as a teacher's library grows to 100/1000/5000 decks.
+
+Compares the two requests the dashboard used to make (GET /api/decks/ and
+GET /api/subjects/, one after the other) with GET /api/dashboard/ on a
+cold cache and on a warm one, through the full middleware stack.
+"""
+from .common import setup_database, make_teacher, timed, print_table
+
+setup_database()
+
+from django.core.cache import cache  # noqa: E402
+from django.test import Client  # noqa: E402
+
+from api.cache import forget_dashboard  # noqa: E402
+from api.models import Deck, Subject  # noqa: E402
+
+SIZES = [100, 1000, 5000]
+SUBJECTS = 12
+
+
+def main():
+    teacher, _ = make_teacher()
+    subjects = [Subject.objects.create(name=f'Subject {i}', teacher=teacher) for i in range(SUBJECTS)]
+    client = Client()
+    session = client.session
+    session['teacher_id'] = teacher.id
+    session.save()
+
+    rows = []
+    for size in SIZES:
+        for i in range(Deck.objects.count(), size):
+            Deck.objects.create(title=f'Deck {i}', subject=subjects[i % SUBJECTS], teacher=teacher)
+        cache.clear()
+        client.get('/api/dashboard/')  # Warm the session and teacher caches
+
+        def separate():
+            client.get('/api/decks/')
+            client.get('/api/subjects/')
+
+        def cold():
+            forget_dashboard(teacher.id)
+            client.get('/api/dashboard/')
+
+        rows.append([
+            size,
+            f'{timed(separate):.1f}',
+            f'{timed(cold):.1f}',
+            f'{timed(lambda: client.get("/api/dashboard/"), repeat=20):.2f}',
+        ])
+
+    print_table(['decks', 'decks+subjects ms', 'dashboard cold ms', 'dashboard cached ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Metadata edit latency for decks of 50/500/5000 cards.
+
+Compares a full DeckSerializer update through PUT (what PATCH
+/api/decks/<slug>/ used to do: save every column, reindex the deck and
+answer with every card) with the metadata-only PATCH, editing exam_board
+and, separately, the title. A title edit still rebuilds the deck's search
+row after commit, which reads the card text.
+"""
+from .common import setup_database, make_teacher, make_cards, timed, print_table
+
+setup_database()
+
+from django.test import Client  # noqa: E402
+
+from api.models import Card, Deck  # noqa: E402
+
+SIZES = [50, 500, 5000]
+
+
+def main():
+    teacher, subject = make_teacher()
+    client = Client()
+    session = client.session
+    session['teacher_id'] = teacher.id
+    session.save()
+
+    rows = []
+    for size in SIZES:
+        deck = Deck.objects.create(title=f'Bench {size}', subject=subject, teacher=teacher)
+        Card.objects.bulk_create(
+            Card(deck=deck, order=i, **card) for i, card in enumerate(make_cards(size))
+        )
+        path = f'/api/decks/{deck.slug}/'
+
+        def put():
+            data = {'title': deck.title, 'subject': subject.id, 'exam_board': 'AQA'}
+            return client.put(path, data, content_type='application/json')
+
+        def patch(field, value):
+            return lambda: client.patch(path, {field: value}, content_type='application/json')
+
+        rows.append([
+            size,
+            f'{timed(put):.2f}',
+            len(put().content),
+            f'{timed(patch("exam_board", "AQA")):.2f}',
+            f'{timed(patch("title", f"Bench {size} edited")):.2f}',
+            len(patch('exam_board', 'OCR')().content),
+        ])
+
+    print_table(['cards', 'full ms', 'full bytes', 'patch exam_board ms', 'patch title ms', 'patch bytes'], rows)
+
+
+if __name__ == '__main__':
+    main()
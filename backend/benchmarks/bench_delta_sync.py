@@ -0,0 +1,58 @@
+"""
+Bytes and time to bring a copy of a deck of 50/500/5000 cards up to date
+after one card was edited.
+
+Compares downloading the whole public deck again (GET /api/study/<slug>/,
+on a cold response cache) with GET /api/study/<slug>/changes/?since=<the
+copy's version>, which answers from the deck's card change log.
+"""
+from .common import setup_database, make_teacher, make_cards, timed, print_table
+
+setup_database()
+
+from django.core.cache import cache  # noqa: E402
+from django.test import Client  # noqa: E402
+
+from api.models import Card, Deck, ORDER_GAP  # noqa: E402
+
+SIZES = [50, 500, 5000]
+
+
+def main():
+    teacher, subject = make_teacher()
+    client = Client()
+    session = client.session
+    session['teacher_id'] = teacher.id
+    session.save()
+    student = Client()
+
+    rows = []
+    for size in SIZES:
+        deck = Deck.objects.create(title=f'Bench {size}', subject=subject, teacher=teacher)
+        Card.objects.bulk_create(
+            Card(deck=deck, order=i * ORDER_GAP, **card) for i, card in enumerate(make_cards(size))
+        )
+        copy = student.get(f'/api/study/{deck.slug}/').json()
+        card = deck.cards.first()
+        client.patch(f'/api/decks/{deck.slug}/cards/{card.id}/', {'answer': 'Edited'}, content_type='application/json')
+
+        def full():
+            cache.clear()
+            return student.get(f'/api/study/{deck.slug}/')
+
+        def changes():
+            return student.get(f'/api/study/{deck.slug}/changes/?since={copy["version"]}')
+
+        rows.append([
+            size,
+            f'{timed(full):.2f}',
+            len(full().content),
+            f'{timed(changes):.2f}',
+            len(changes().content),
+        ])
+
+    print_table(['cards', 'full ms', 'full bytes', 'changes ms', 'changes bytes'], rows)
+
+
+if __name__ == '__main__':
+    main()
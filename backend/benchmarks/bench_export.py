@@ -0,0 +1,79 @@
+"""
+Memory and time of streaming a teacher's whole library as a zip export.
+
+Builds a library of --decks decks with --cards cards each, then streams
+the /api/decks/export/<format>/ response for a cold cache and a warm one,
+reporting wall time, archive size and peak Python memory (tracemalloc).
+Peak memory should stay flat as the library grows; only decks small enough
+to be cached are held in memory, and one at a time.
+
+    python -m benchmarks.bench_export
+    python -m benchmarks.bench_export --decks 200 --cards 2000
+"""
+import argparse
+import time
+import tracemalloc
+
+from .common import setup_database, make_teacher, print_table
+
+setup_database()
+
+from django.core.cache import cache  # noqa: E402
+from django.test import Client  # noqa: E402
+
+from api.models import Card, Deck  # noqa: E402
+
+
+def build_library(decks, cards):
+    teacher, subject = make_teacher()
+    for i in range(decks):
+        deck = Deck.objects.create(title=f'Bench deck {i}', subject=subject, teacher=teacher)
+        Card.objects.bulk_create(
+            Card(deck=deck, question=f'Question {n} of deck {i}?', answer=f'Answer {n} ' * 8, order=n)
+            for n in range(cards)
+        )
+    return teacher
+
+
+def stream(client, export_format, trace=False):
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(f'/api/decks/export/{export_format}/')
+    size = sum(len(chunk) for chunk in response.streaming_content)
+    elapsed = (time.perf_counter() - start) * 1000
+    peak = tracemalloc.get_traced_memory()[1] if trace else None
+    tracemalloc.stop()
+    return elapsed, size, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--decks', type=int, default=100)
+    parser.add_argument('--cards', type=int, default=1000)
+    args = parser.parse_args()
+
+    teacher = build_library(args.decks, args.cards)
+    client = Client()
+    session = client.session
+    session['teacher_id'] = teacher.id
+    session.save()
+
+    rows = []
+    for export_format in ('csv', 'kahoot'):
+        for label in ('cold', 'cached'):
+            # Time untraced (tracemalloc slows allocation), then measure memory
+            if label == 'cold':
+                cache.clear()
+            ms, size, _ = stream(client, export_format)
+            if label == 'cold':
+                cache.clear()
+            _, _, peak = stream(client, export_format, trace=True)
+            rows.append([export_format, label, f'{ms:.0f}', f'{size / 1024:.0f}', f'{peak / 1024:.0f}'])
+
+    print(f'Library export of {args.decks} decks x {args.cards} cards')
+    print_table(['format', 'cache', 'ms', 'zip KB', 'peak KB'], rows)
+
+
+if __name__ == '__main__':
+    main()
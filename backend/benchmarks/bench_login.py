@@ -0,0 +1,87 @@
+"""
+Login cost for each password hasher setting.
+
+For every profile, creates a teacher whose password was hashed with it and
+times --logins POSTs to /api/auth/login/ (throttling off): successful
+logins, and logins for an email without an account, which should cost the
+same. Logins/s is per worker process, i.e. per core; three sync gunicorn
+workers on three cores serve three times that.
+
+    python -m benchmarks.bench_login
+    python -m benchmarks.bench_login --logins 50
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import statistics
+import time
+
+from .common import setup_database, print_table
+
+setup_database()
+
+from django.test import Client, override_settings  # noqa: E402
+
+from api.models import Teacher  # noqa: E402
+from api.views import LoginRateThrottle  # noqa: E402
+
+PROFILES = [
+    ('pbkdf2', 'iterations 1M (default)', {'PASSWORD_PBKDF2_ITERATIONS': 1_000_000}),
+    ('pbkdf2', 'iterations 600k', {'PASSWORD_PBKDF2_ITERATIONS': 600_000}),
+    ('scrypt', 'N=2^14 p=5 (default)', {'PASSWORD_SCRYPT_WORK_FACTOR': 2 ** 14, 'PASSWORD_SCRYPT_PARALLELISM': 5}),
+    ('scrypt', 'N=2^15 p=3', {'PASSWORD_SCRYPT_WORK_FACTOR': 2 ** 15, 'PASSWORD_SCRYPT_PARALLELISM': 3}),
+    ('scrypt', 'N=2^16 p=2', {'PASSWORD_SCRYPT_WORK_FACTOR': 2 ** 16, 'PASSWORD_SCRYPT_PARALLELISM': 2}),
+    ('scrypt', 'N=2^17 p=1', {'PASSWORD_SCRYPT_WORK_FACTOR': 2 ** 17, 'PASSWORD_SCRYPT_PARALLELISM': 1}),
+    ('scrypt', 'N=2^14 p=1 (weaker)', {'PASSWORD_SCRYPT_WORK_FACTOR': 2 ** 14, 'PASSWORD_SCRYPT_PARALLELISM': 1}),
+    ('argon2', 't=2 m=100MB p=8 (default)', {'PASSWORD_ARGON2_TIME_COST': 2, 'PASSWORD_ARGON2_MEMORY_COST': 102400}),
+    ('argon2', 't=3 m=12MB p=1', {
+        'PASSWORD_ARGON2_TIME_COST': 3, 'PASSWORD_ARGON2_MEMORY_COST': 12288, 'PASSWORD_ARGON2_PARALLELISM': 1,
+    }),
+]
+
+HASHERS = {
+    'pbkdf2': 'api.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'api.hashers.ScryptPasswordHasher',
+    'argon2': 'api.hashers.Argon2PasswordHasher',
+}
+
+
+def time_logins(client, email, count):
+    body = json.dumps({'email': email, 'password': 'Passw0rd!'})
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        client.post('/api/auth/login/', body, content_type='application/json')
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=20)
+    args = parser.parse_args()
+
+    LoginRateThrottle.allow_request = lambda self, request, view: True
+    logging.getLogger('django.request').setLevel(logging.ERROR)  # Failed logins log a warning each
+    client = Client()
+
+    rows = []
+    for number, (hasher, label, costs) in enumerate(PROFILES):
+        if hasher == 'argon2' and importlib.util.find_spec('argon2') is None:
+            print(f'Skipping argon2 {label}: argon2-cffi is not installed')
+            continue
+        with override_settings(PASSWORD_HASHERS=[HASHERS[hasher]], **costs):
+            teacher = Teacher(name='Bench Teacher', email=f'login{number}@example.com')
+            teacher.set_password('Passw0rd!')
+            teacher.save()
+            known = time_logins(client, teacher.email, args.logins)
+            unknown = time_logins(client, f'nobody{number}@example.com', args.logins)
+        rows.append([hasher, label, f'{known:.1f}', f'{1000 / known:.1f}', f'{unknown:.1f}'])
+
+    print(f'Median of {args.logins} logins per profile')
+    print_table(['hasher', 'cost', 'login ms', 'logins/s/core', 'unknown email ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
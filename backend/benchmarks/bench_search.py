@@ -0,0 +1,119 @@
+"""
+Public deck search latency over a large synthetic library.
+
+Builds --cards cards (default 1,000,000) spread over decks of
+--cards-per-deck, with a Zipf-distributed synthetic vocabulary so there
+are very common, mid-frequency and rare terms, then times
+api.search.search_decks (facet query, page query and page fetch).
+
+    python -m benchmarks.bench_search
+    python -m benchmarks.bench_search --cards 100000
+"""
+import argparse
+import itertools
+import random
+import time
+
+from .common import setup_database, make_teacher, timed, print_table
+
+setup_database()
+
+from django.db import connection, transaction  # noqa: E402
+
+from api import search  # noqa: E402
+from api.models import Deck, Subject  # noqa: E402
+
+EXAM_BOARDS = ['AQA', 'OCR', 'Edexcel', 'WJEC', '']
+YEAR_GROUPS = ['Year 9', 'Year 10', 'Year 11', 'Year 12', 'Year 13']
+GRADES = ['4', '5', '6', '7', '8', '9', '']
+SYLLABLES = ['ba', 'co', 'di', 'fe', 'ga', 'hi', 'jo', 'ku', 'li', 'mo', 'ne', 'pa', 'qui', 'ro', 'su', 'ti', 'vo', 'xe']
+
+
+def vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def build_library(total_cards, per_deck, rng):
+    words = vocabulary(20000, rng)
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    teacher, _ = make_teacher()
+    subjects = [Subject.objects.create(name=f'Subject {i}', teacher=teacher) for i in range(12)]
+
+    deck_count = total_cards // per_deck
+    start = time.perf_counter()
+    with transaction.atomic():
+        decks = Deck.objects.bulk_create(
+            Deck(
+                title=' '.join(rng.choices(words, cum_weights=weights, k=3)).title(),
+                slug=f'bench-deck-{i}',
+                subject=subjects[i % len(subjects)],
+                teacher=teacher,
+                exam_board=rng.choice(EXAM_BOARDS),
+                year_group=rng.choice(YEAR_GROUPS),
+                target_grade=rng.choice(GRADES),
+                card_count=per_deck,
+            )
+            for i in range(deck_count)
+        )
+        # Raw executemany: bulk_create would also work but holds 1M objects
+        with connection.cursor() as cursor:
+            for deck in decks:
+                cursor.executemany(
+                    'INSERT INTO api_card (deck_id, question, answer, "order") VALUES (%s, %s, %s, %s)',
+                    [
+                        (
+                            deck.id,
+                            ' '.join(rng.choices(words, cum_weights=weights, k=8)) + '?',
+                            ' '.join(rng.choices(words, cum_weights=weights, k=10)),
+                            order,
+                        )
+                        for order in range(per_deck)
+                    ]
+                )
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    search.rebuild_index()
+    index_time = time.perf_counter() - start
+    return words, deck_count, load_time, index_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=1_000_000)
+    parser.add_argument('--cards-per-deck', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    words, deck_count, load_time, index_time = build_library(args.cards, args.cards_per_deck, rng)
+    print(f'Loaded {args.cards:,} cards in {deck_count:,} decks in {load_time:.1f}s; indexed in {index_time:.1f}s\n')
+
+    cases = [
+        ('common term', words[0], {}),
+        ('mid-frequency term', words[200], {}),
+        ('rare term', words[15000], {}),
+        ('two terms', f'{words[5]} {words[60]}', {}),
+        ('prefix', words[300][:4] + '*', {}),
+        ('term + facets', words[50], {'exam_board': 'AQA', 'year_group': 'Year 11'}),
+        ('browse by facet', '', {'subject': 'Subject 3', 'target_grade': '7'}),
+    ]
+    rows = []
+    for label, query, filters in cases:
+        _, total, _ = search.search_decks(query, filters)
+        samples = []
+        for _ in range(args.repeat):
+            samples.append(timed(lambda: search.search_decks(query, filters), repeat=1))
+        samples.sort()
+        p95 = samples[min(int(len(samples) * 0.95), len(samples) - 1)]
+        rows.append([label, repr(query), f'{total:,}', f'{samples[len(samples) // 2]:.1f}', f'{p95:.1f}'])
+
+    print('search_decks latency (ms)')
+    print_table(['case', 'query', 'matches', 'median', 'p95'], rows)
+
+
+if __name__ == '__main__':
+    main()
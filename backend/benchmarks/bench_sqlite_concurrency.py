@@ -0,0 +1,130 @@
+"""
+Concurrent reads and writes against SQLite, with the stock connection
+settings and with the tuned profile from settings_prod (WAL,
+synchronous=NORMAL, busy timeout, mmap, cache size, BEGIN IMMEDIATE).
+
+Forks --workers processes, like gunicorn workers, that for --seconds each
+loop over a mix of public deck reads (deck plus cards through
+DeckSerializer) and teacher writes, alternating between saving a deck with
+one edited card (Deck.sync_cards) and creating a deck with
+DeckCreateSerializer, whose transaction reads before it writes. Reports
+reads/s, writes/s and "database is locked" failures.
+
+    python -m benchmarks.bench_sqlite_concurrency
+    python -m benchmarks.bench_sqlite_concurrency --workers 6 --write-ratio 0.5
+"""
+import argparse
+import multiprocessing
+import random
+import time
+from types import SimpleNamespace
+
+from .common import setup_database, make_teacher, make_cards, print_table
+
+setup_database()
+
+from django.db import connection, connections, OperationalError  # noqa: E402
+
+from api.models import Deck, Teacher  # noqa: E402
+from api.serializers import DeckCreateSerializer, DeckSerializer  # noqa: E402
+from flashcards import settings_prod  # noqa: E402
+
+DECKS = 50
+CARDS_PER_DECK = 100
+
+PROFILES = [
+    ('stock', {}),
+    ('tuned', settings_prod.DATABASES['default']['OPTIONS']),
+]
+
+
+def write(rng, slug, teacher):
+    if rng.random() < 0.5:
+        deck = Deck.objects.get(slug=slug)
+        cards = list(deck.cards.values('id', 'question', 'answer'))
+        cards[rng.randrange(len(cards))]['answer'] = f'Edited {rng.random()}'
+        deck.sync_cards(cards)
+    else:
+        serializer = DeckCreateSerializer(
+            data={'title': 'Created', 'subject_name': 'Created', 'cards': make_cards(20)},
+            context={'request': SimpleNamespace(teacher=teacher)}
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+
+def worker(seed, seconds, write_ratio, slugs, results):
+    connections.close_all()  # Never share the parent's SQLite connection
+    rng = random.Random(seed)
+    counts = [0, 0, 0]  # reads, writes, locked
+    try:
+        teacher = Teacher.objects.get()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            slug = rng.choice(slugs)
+            try:
+                if rng.random() < write_ratio:
+                    write(rng, slug, teacher)
+                    counts[1] += 1
+                else:
+                    DeckSerializer(Deck.objects.select_related('subject', 'teacher').get(slug=slug)).data
+                    counts[0] += 1
+            except OperationalError as error:
+                if 'locked' not in str(error):
+                    raise
+                counts[2] += 1
+    finally:
+        results.put(counts)
+
+
+def run(profile_options, workers, seconds, write_ratio, slugs):
+    connection.close()
+    connection.settings_dict['OPTIONS'] = dict(profile_options)
+    connection.ensure_connection()
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        journal_mode = cursor.fetchone()[0]
+    connection.close()
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(seed, seconds, write_ratio, slugs, results))
+        for seed in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    totals = [sum(values) for values in zip(*(results.get() for _ in processes))]
+    for process in processes:
+        process.join()
+    return journal_mode, totals
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    args = parser.parse_args()
+
+    teacher, subject = make_teacher()
+    slugs = []
+    for i in range(DECKS):
+        deck = Deck.objects.create(title=f'Concurrency {i}', subject=subject, teacher=teacher)
+        deck.sync_cards(make_cards(CARDS_PER_DECK))
+        slugs.append(deck.slug)
+
+    rows = []
+    # Stock first: WAL, once enabled, stays on for the database file
+    for name, options in PROFILES:
+        journal_mode, (reads, writes, locked) = run(options, args.workers, args.seconds, args.write_ratio, slugs)
+        rows.append([
+            name, journal_mode, f'{reads / args.seconds:.0f}', f'{writes / args.seconds:.0f}', locked
+        ])
+
+    print(f'{args.workers} workers for {args.seconds:.0f}s each, {args.write_ratio:.0%} writes')
+    print_table(['profile', 'journal', 'reads/s', 'writes/s', 'locked errors'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Throttle overhead and accuracy across worker processes.
+
+Compares DRF's cache-based AnonRateThrottle (on the local-memory cache and
+on the file cache settings_prod uses) with api.throttling's shared SQLite
+buckets. Reports the time per check in one process, then forks --workers
+processes that each make --requests checks from one client against a
+limit of --limit per hour and counts how many were let through: exactly
+--limit is correct.
+
+    python -m benchmarks.bench_throttle
+    python -m benchmarks.bench_throttle --workers 6 --requests 2000
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+from .common import print_table
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework import throttling as drf_throttling
+
+from api import throttling
+
+
+def make_throttle(backend, tmp_dir, limit):
+    if backend == 'shared sqlite':
+        throttle = throttling.AnonRateThrottle()
+    else:
+        throttle = drf_throttling.AnonRateThrottle()
+        throttle.cache = (
+            LocMemCache('bench', {}) if backend == 'drf locmem'
+            else FileBasedCache(os.path.join(tmp_dir, 'cache'), {})
+        )
+    throttle.rate = f'{limit}/hour'
+    throttle.num_requests, throttle.duration = throttle.parse_rate(throttle.rate)
+    return throttle
+
+
+def check(throttle, client_ip):
+    request = SimpleNamespace(user=AnonymousUser(), META={'REMOTE_ADDR': client_ip})
+    return throttle.allow_request(request, None)
+
+
+def worker(backend, tmp_dir, limit, requests, results):
+    throttling.store.local = threading.local()  # Never share the parent's SQLite connection
+    throttle = make_throttle(backend, tmp_dir, limit)
+    results.put(sum(check(throttle, '10.0.0.1') for _ in range(requests)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    rows = []
+    for backend in ('drf locmem', 'drf file cache', 'shared sqlite'):
+        with tempfile.TemporaryDirectory(prefix='flashcards-throttle-') as tmp_dir:
+            settings.THROTTLE_DATABASE = os.path.join(tmp_dir, 'throttle.sqlite3')
+
+            # Latency: distinct clients, each under its limit
+            throttle = make_throttle(backend, tmp_dir, 1000)
+            samples = []
+            for n in range(2000):
+                start = time.perf_counter()
+                check(throttle, f'10.1.{n % 50}.{n % 200}')
+                samples.append((time.perf_counter() - start) * 1_000_000)
+
+            # Accuracy: one client hammering from every worker at once
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            processes = [
+                context.Process(target=worker, args=(backend, tmp_dir, args.limit, args.requests, results))
+                for _ in range(args.workers)
+            ]
+            for process in processes:
+                process.start()
+            allowed = sum(results.get() for _ in processes)
+            for process in processes:
+                process.join()
+
+        p99 = statistics.quantiles(samples, n=100)[98]
+        rows.append([backend, f'{statistics.median(samples):.0f}', f'{p99:.0f}', allowed])
+
+    print(f'{args.workers} workers x {args.requests} requests from one client, limit {args.limit}/hour')
+    print_table(['backend', 'median us', 'p99 us', 'allowed'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Shared setup for the benchmark scripts.
+
+Benchmarks never touch db.sqlite3: they build a throwaway on-disk test
+database (so SQLite fsync costs are included) and drop it afterwards.
+
+Run a benchmark from the backend directory, e.g.:
+    python -m benchmarks.bench_card_writes
+"""
+import atexit
+import os
+import statistics
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'flashcards.settings')
+django.setup()
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import setup_test_environment
+
+
+def setup_database():
+    """Create a temporary test database and register its cleanup"""
+    if connection.vendor == 'sqlite':
+        tmp_dir = tempfile.mkdtemp(prefix='flashcards-bench-')
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tmp_dir, 'bench.sqlite3')
+    setup_test_environment()
+    settings.ALLOWED_HOSTS = ['*']
+    old_name = connection.creation.create_test_db(verbosity=0)
+    atexit.register(connection.creation.destroy_test_db, old_name, verbosity=0)
+
+
+def make_teacher(email='bench@example.com'):
+    from api.models import Teacher, Subject
+
+    teacher = Teacher.objects.create(name='Bench Teacher', email=email)
+    subject = Subject.objects.create(name='Benchmarks', teacher=teacher)
+    return teacher, subject
+
+
+def make_cards(count, prefix='Question'):
+    return [
+        {'question': f'{prefix} {i}?', 'answer': f'Answer {i}'}
+        for i in range(count)
+    ]
+
+
+def timed(func, repeat=5):
+    """Run func repeat times and return the median wall time in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(headers, *rows)]
+    line = '  '.join(f'{{:>{w}}}' for w in widths)
+    print(line.format(*headers))
+    print('  '.join('-' * w for w in widths))
+    for row in rows:
+        print(line.format(*row))
@@ -3,14 +3,30 @@ ASGI config for flashcards project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Requests served here resolve against flashcards.asgi_urls, which puts the
+async read views of api.async_views in front of the DRF ones; flashcards.wsgi
+keeps serving the DRF views directly.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler, ASGIRequest
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'flashcards.settings')
 
-application = get_asgi_application()
+
+class FlashcardsASGIRequest(ASGIRequest):
+    urlconf = 'flashcards.asgi_urls'
+
+
+class FlashcardsASGIHandler(ASGIHandler):
+    request_class = FlashcardsASGIRequest
+
+
+# What get_asgi_application() does, with the handler above
+django.setup(set_prefix=False)
+application = FlashcardsASGIHandler()
@@ -0,0 +1,11 @@
+"""
+URL configuration for flashcards.asgi: flashcards.urls with the API's
+async read views (api.async_urls).
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('api/', include('api.async_urls')),
+]
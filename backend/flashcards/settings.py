@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.ProfilingMiddleware',
+    'api.middleware.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -83,6 +86,38 @@ DATABASES = {
     }
 }
 
+# PostgreSQL instead of SQLite when POSTGRES_DB is set (also for tests, e.g.
+# against a local Postgres container). POSTGRES_REPLICA_HOST adds a read
+# replica that api.routers sends public deck reads to.
+if os.environ.get('POSTGRES_DB'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', ''),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', ''),
+        'PORT': os.environ.get('POSTGRES_PORT', ''),
+    }
+    if os.environ.get('POSTGRES_REPLICA_HOST'):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.environ['POSTGRES_REPLICA_HOST'],
+            'PORT': os.environ.get('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+            'TEST': {'MIRROR': 'default'},
+        }
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -102,6 +137,27 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing (see api/hashers.py). PASSWORD_HASHER picks pbkdf2, scrypt
+# or argon2 (needs argon2-cffi) for new hashes; the others still verify old
+# ones, which are rehashed on login. The default costs are Django's;
+# benchmarks/bench_login.py shows what each costs per login.
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 1_000_000))
+PASSWORD_SCRYPT_WORK_FACTOR = int(os.environ.get('PASSWORD_SCRYPT_WORK_FACTOR', 2 ** 14))
+PASSWORD_SCRYPT_PARALLELISM = int(os.environ.get('PASSWORD_SCRYPT_PARALLELISM', 5))
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 102400))  # KiB
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('PASSWORD_ARGON2_PARALLELISM', 8))
+
+_PASSWORD_HASHERS = {
+    'pbkdf2': 'api.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'api.hashers.ScryptPasswordHasher',
+    'argon2': 'api.hashers.Argon2PasswordHasher',
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+]
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -135,13 +191,14 @@ CORS_ALLOW_CREDENTIALS = True
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'api.authentication.TeacherAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
+        'api.throttling.AnonRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '1000/hour',
@@ -150,11 +207,40 @@ REST_FRAMEWORK = {
     },
 }
 
+# Outbound email (see api/email_service.py), delivered by the send_emails worker
+RESEND_API_KEY = os.environ.get('RESEND_API_KEY', '')
+EMAIL_FROM = os.environ.get('EMAIL_FROM', 'Flashcard Generator <noreply@flashcards.cshub.org.je>')
+FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:5173')
+# FakeTransport only records messages, so it is the default for local
+# development alone; settings_prod always sends through Resend
+EMAIL_TRANSPORT = os.environ.get(
+    'EMAIL_TRANSPORT',
+    'api.email_service.ResendTransport' if RESEND_API_KEY or not DEBUG else 'api.email_service.FakeTransport'
+)
+EMAIL_BATCH_SIZE = 100  # messages claimed per batch
+EMAIL_CONCURRENCY = 4  # sends in flight at once
+EMAIL_MAX_ATTEMPTS = 6
+EMAIL_RETRY_BASE_SECONDS = 30  # doubled after every failed attempt
+
+# Throttle counters shared by all workers on the host (see api/throttling.py)
+THROTTLE_DATABASE = os.environ.get('THROTTLE_DATABASE', str(BASE_DIR / 'throttle.sqlite3'))
+
+# API profiling (see api/profiling.py). Off unless API_PROFILING=1; when off
+# the middleware removes itself at startup.
+API_PROFILING = os.environ.get('API_PROFILING') == '1'
+API_PROFILING_WINDOW = 1000  # samples kept per endpoint and worker
+API_PROFILING_SLOWEST = 20  # slowest requests kept (with SQL) per worker
+API_PROFILING_FLUSH_SECONDS = 10
+
 # Static files for production
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 # Session settings
 SESSION_COOKIE_AGE = 86400  # 24 hours in seconds
+# Sessions are read from the cache and only fall back to the database on a
+# miss. DJANGO_SESSION_ENGINE=django.contrib.sessions.backends.signed_cookies
+# keeps them in the (signed) cookie instead, with no storage at all.
+SESSION_ENGINE = os.environ.get('DJANGO_SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db')
 
 # CSRF settings
 CSRF_COOKIE_SAMESITE = 'Lax'
@@ -34,6 +34,54 @@ CORS_ALLOW_CREDENTIALS = True
 if DROPLET_IP:
     CORS_ALLOWED_ORIGINS.append(f'http://{DROPLET_IP}')
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # SQLite tuned for several gunicorn workers writing at once. WAL lets
+    # readers run alongside a writer, BEGIN IMMEDIATE takes the write lock up
+    # front so concurrent saves queue on the busy timeout instead of failing
+    # with "database is locked" when a read lock cannot be upgraded, and
+    # synchronous=NORMAL is durable across application crashes in WAL mode.
+    DATABASES['default']['OPTIONS'] = {
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            'PRAGMA mmap_size=268435456;'  # 256 MB
+            'PRAGMA cache_size=-32000;'  # 32 MB per connection
+            'PRAGMA temp_store=MEMORY;'
+        ),
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 20,  # busy_timeout, in seconds
+    }
+else:
+    # PostgreSQL (POSTGRES_* variables, see settings.py). Each sync gunicorn
+    # worker keeps its connection open between requests, checked before
+    # reuse so a restarted server costs one failed ping rather than an error.
+    # DB_POOL=1 switches to a psycopg connection pool per worker instead,
+    # worth it for threaded or async workers; Django requires
+    # CONN_MAX_AGE=0 with a pool.
+    for alias in DATABASES:
+        if os.environ.get('DB_POOL') == '1':
+            DATABASES[alias]['CONN_MAX_AGE'] = 0
+            DATABASES[alias]['OPTIONS'] = {'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                'timeout': 10,
+            }}
+        else:
+            DATABASES[alias]['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+            DATABASES[alias]['CONN_HEALTH_CHECKS'] = True
+
+# Cache shared by all gunicorn workers so deck cache invalidation is seen everywhere
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_DIR', str(BASE_DIR / 'cache')),
+    }
+}
+
+# Send real mail. Without RESEND_API_KEY the send_emails worker exits with
+# an error (see send_emails.service) instead of marking mail as sent
+EMAIL_TRANSPORT = os.environ.get('EMAIL_TRANSPORT', 'api.email_service.ResendTransport')
+
 # Security settings
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
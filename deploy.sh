@@ -21,7 +21,7 @@ cd $BACKEND_DIR
 python3 -m venv venv
 source venv/bin/activate
 pip install -r requirements.txt
-pip install gunicorn
+pip install gunicorn uvicorn-worker
 
 # Run migrations
 python manage.py migrate --settings=flashcards.settings_prod
@@ -40,6 +40,13 @@ sudo systemctl daemon-reload
 sudo systemctl enable flashcards
 sudo systemctl restart flashcards
 
+# Setup the email worker (needs RESEND_API_KEY in /etc/flashcards/email.env)
+echo "Setting up email worker..."
+sudo cp $APP_DIR/send_emails.service /etc/systemd/system/flashcards-email.service
+sudo systemctl daemon-reload
+sudo systemctl enable flashcards-email
+sudo systemctl restart flashcards-email
+
 # Setup Nginx
 echo "Setting up Nginx..."
 sudo cp $APP_DIR/nginx.conf /etc/nginx/sites-available/flashcards
@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react'
 import { useParams, useNavigate } from 'react-router-dom'
 import api from '../../utils/api'
+import { loadDeck } from '../../utils/deckCache'
 import Branding from '../common/Branding'
 import './DeckLanding.css'
 
@@ -19,8 +20,7 @@ function DeckLanding() {
 
   const fetchDeck = async () => {
     try {
-      const response = await api.get(`/study/${slug}/`)
-      setDeck(response.data)
+      setDeck(await loadDeck(`/study/${slug}`))
     } catch (err) {
       setError('Deck not found or not available')
     } finally {
@@ -1,6 +1,6 @@
 import { useState, useEffect, useRef, useCallback } from 'react'
 import { useParams, useNavigate } from 'react-router-dom'
-import api from '../../utils/api'
+import { loadDeck } from '../../utils/deckCache'
 import { fuzzyMatch } from '../../utils/cardParser'
 import LoadingSpinner from '../common/LoadingSpinner'
 import Branding from '../common/Branding'
@@ -37,9 +37,9 @@ function GravityGame() {
 
   const fetchDeck = async () => {
     try {
-      const response = await api.get(`/study/${slug}/`)
-      setDeck(response.data)
-      setCards(response.data.cards || [])
+      const data = await loadDeck(`/study/${slug}`)
+      setDeck(data)
+      setCards(data.cards || [])
       setGameState('ready')
     } catch (error) {
       console.error('Error fetching deck:', error)
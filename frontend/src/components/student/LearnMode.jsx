@@ -1,6 +1,6 @@
 import { useState, useEffect, useRef } from 'react'
 import { useParams, useNavigate } from 'react-router-dom'
-import api from '../../utils/api'
+import { loadDeck } from '../../utils/deckCache'
 import { fuzzyMatch } from '../../utils/cardParser'
 import LoadingSpinner from '../common/LoadingSpinner'
 import Branding from '../common/Branding'
@@ -31,10 +31,10 @@ function LearnMode() {
 
   const fetchDeck = async () => {
     try {
-      const response = await api.get(`/study/${slug}/`)
-      setDeck(response.data)
+      const data = await loadDeck(`/study/${slug}`)
+      setDeck(data)
       // Shuffle cards for learning
-      const shuffled = [...(response.data.cards || [])].sort(
+      const shuffled = [...(data.cards || [])].sort(
         () => Math.random() - 0.5
       )
       setCards(shuffled)
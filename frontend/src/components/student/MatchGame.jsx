@@ -1,6 +1,6 @@
 import { useState, useEffect, useCallback } from 'react'
 import { useParams, useNavigate } from 'react-router-dom'
-import api from '../../utils/api'
+import { loadDeck } from '../../utils/deckCache'
 import LoadingSpinner from '../common/LoadingSpinner'
 import Branding from '../common/Branding'
 import './MatchGame.css'
@@ -34,9 +34,9 @@ function MatchGame() {
 
   const fetchDeck = async () => {
     try {
-      const response = await api.get(`/study/${slug}/`)
-      setDeck(response.data)
-      initializeGame(response.data.cards || [])
+      const data = await loadDeck(`/study/${slug}`)
+      setDeck(data)
+      initializeGame(data.cards || [])
     } catch (error) {
       console.error('Error fetching deck:', error)
       navigate(`/study/${slug}`)
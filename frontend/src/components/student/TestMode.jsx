@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react'
 import { useParams, useNavigate } from 'react-router-dom'
-import api from '../../utils/api'
+import { loadDeck } from '../../utils/deckCache'
 import LoadingSpinner from '../common/LoadingSpinner'
 import Branding from '../common/Branding'
 import './TestMode.css'
@@ -23,9 +23,9 @@ function TestMode() {
 
   const fetchDeck = async () => {
     try {
-      const response = await api.get(`/study/${slug}/`)
-      setDeck(response.data)
-      generateQuestions(response.data.cards || [])
+      const data = await loadDeck(`/study/${slug}`)
+      setDeck(data)
+      generateQuestions(data.cards || [])
     } catch (error) {
       console.error('Error fetching deck:', error)
       navigate(`/study/${slug}`)
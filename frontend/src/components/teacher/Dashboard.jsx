@@ -21,12 +21,9 @@ function Dashboard({ teacher, onLogout }) {
   const fetchData = async () => {
     try {
       setError('')
-      const [decksRes, subjectsRes] = await Promise.all([
-        api.get('/decks/'),
-        api.get('/subjects/'),
-      ])
-      setDecks(decksRes.data)
-      setSubjects(subjectsRes.data)
+      const { data } = await api.get('/dashboard/')
+      setDecks(data.subjects.flatMap((subject) => subject.decks))
+      setSubjects(data.subjects)
     } catch (error) {
       console.error('Error fetching data:', error)
       setError('Failed to load decks. Please try again.')
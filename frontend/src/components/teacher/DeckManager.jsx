@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react'
 import { useParams, useNavigate } from 'react-router-dom'
 import api from '../../utils/api'
+import { loadDeck } from '../../utils/deckCache'
 import LoadingSpinner from '../common/LoadingSpinner'
 import './DeckManager.css'
 
@@ -21,9 +22,9 @@ function DeckManager({ teacher, onLogout }) {
   const fetchDeck = async () => {
     try {
       setError('')
-      const response = await api.get(`/decks/${slug}/`)
-      setDeck(response.data)
-      setEditedCards(response.data.cards || [])
+      const data = await loadDeck(`/decks/${slug}`)
+      setDeck(data)
+      setEditedCards(data.cards || [])
     } catch (error) {
       console.error('Error fetching deck:', error)
       setError('Failed to load deck')
@@ -76,11 +77,16 @@ function DeckManager({ teacher, onLogout }) {
     setSaving(true)
     setError('')
     try {
-      await api.put(`/decks/${slug}/update_cards/`, { cards: editedCards })
+      // version makes the save fail rather than overwrite edits made elsewhere
+      await api.put(`/decks/${slug}/update_cards/`, { cards: editedCards, version: deck.version })
       navigate('/')
     } catch (error) {
       console.error('Error saving deck:', error)
-      setError('Failed to save deck. Please try again.')
+      if (error.response?.status === 409) {
+        setError('This deck was changed somewhere else since you opened it. Reload to see the latest cards.')
+      } else {
+        setError('Failed to save deck. Please try again.')
+      }
     } finally {
       setSaving(false)
     }
@@ -89,8 +95,8 @@ function DeckManager({ teacher, onLogout }) {
   const handleUpdateDeckInfo = async (field, value) => {
     setSavingField(field)
     try {
-      await api.patch(`/decks/${slug}/`, { [field]: value })
-      setDeck({ ...deck, [field]: value })
+      const { data } = await api.patch(`/decks/${slug}/`, { [field]: value })
+      setDeck({ ...deck, ...data })
     } catch (error) {
       console.error('Error updating deck:', error)
       setError(`Failed to update ${field}`)
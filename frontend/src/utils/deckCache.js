@@ -0,0 +1,65 @@
+import api from './api'
+
+/**
+ * Decks kept in localStorage and brought up to date with the changes
+ * endpoint, so opening a deck again downloads only the cards edited since.
+ */
+
+const STORAGE_PREFIX = 'deck:'
+
+function readCopy(path) {
+  try {
+    return JSON.parse(localStorage.getItem(STORAGE_PREFIX + path))
+  } catch {
+    return null
+  }
+}
+
+function saveCopy(path, deck) {
+  try {
+    localStorage.setItem(STORAGE_PREFIX + path, JSON.stringify(deck))
+  } catch {
+    // Storage full or disabled: the deck is simply downloaded in full next time
+  }
+}
+
+/**
+ * Apply a changes response to a stored copy of the deck
+ */
+function applyChanges(copy, changes) {
+  const cards = new Map(copy.cards.map((card) => [card.id, card]))
+  changes.deleted.forEach((id) => cards.delete(id))
+  changes.cards.forEach((card) => cards.set(card.id, card))
+  return {
+    ...copy,
+    ...changes.deck,
+    cards: [...cards.values()].sort((a, b) => a.order - b.order),
+  }
+}
+
+/**
+ * Load a deck from `/study/<slug>` or `/decks/<slug>`: the stored copy plus
+ * its changes when there is one, the full deck otherwise
+ */
+export async function loadDeck(path) {
+  const copy = readCopy(path)
+  if (copy?.version) {
+    try {
+      const { data } = await api.get(`${path}/changes/`, { params: { since: copy.version } })
+      // A deck deleted and created again under the same slug is a new deck
+      if (!data.reset && data.deck.id === copy.id) {
+        const deck = applyChanges(copy, data)
+        saveCopy(path, deck)
+        return deck
+      }
+    } catch (error) {
+      if (error.response?.status === 404) {
+        localStorage.removeItem(STORAGE_PREFIX + path)
+        throw error
+      }
+    }
+  }
+  const { data } = await api.get(`${path}/`)
+  saveCopy(path, data)
+  return data
+}
@@ -63,7 +63,7 @@ python3 -m venv venv
 source venv/bin/activate
 pip install --upgrade pip
 pip install -r requirements.txt
-pip install gunicorn
+pip install gunicorn uvicorn-worker
 
 # Create production settings with domain
 cat > flashcards/settings_prod.py << 'SETTINGS_EOF'
@@ -143,11 +143,21 @@ Group=www-data
 WorkingDirectory=/var/www/flashcards/backend
 Environment="DJANGO_SETTINGS_MODULE=flashcards.settings_prod"
 ExecStart=/var/www/flashcards/backend/venv/bin/gunicorn --workers 3 --bind 127.0.0.1:8000 flashcards.wsgi:application
+# ASGI mode: async read views on uvicorn workers (see README)
+# ExecStart=/var/www/flashcards/backend/venv/bin/gunicorn --workers 3 --worker-class uvicorn_worker.UvicornWorker --bind 127.0.0.1:8000 flashcards.asgi:application
 
 [Install]
 WantedBy=multi-user.target
 SERVICE_EOF
 
+# Create email worker service; it needs RESEND_API_KEY in /etc/flashcards/email.env
+echo ""
+echo "Configuring email worker service..."
+sudo mkdir -p /etc/flashcards
+sudo touch /etc/flashcards/email.env
+sudo chmod 600 /etc/flashcards/email.env
+sudo cp $APP_DIR/send_emails.service /etc/systemd/system/flashcards-email.service
+
 # Create Nginx config
 echo ""
 echo "Configuring Nginx..."
@@ -206,6 +216,7 @@ sudo rm -f /etc/nginx/sites-enabled/default
 sudo systemctl daemon-reload
 sudo systemctl enable flashcards
 sudo systemctl restart flashcards
+sudo systemctl enable flashcards-email
 
 sudo nginx -t
 sudo systemctl restart nginx
@@ -228,10 +239,13 @@ echo ""
 echo "Next steps:"
 echo "  1. Point your DNS A record to this server's IP"
 echo "  2. (Optional) Add SSL with: sudo certbot --nginx -d flashcards.cshub.org.je"
+echo "  3. Put RESEND_API_KEY=... in /etc/flashcards/email.env, then"
+echo "     sudo systemctl start flashcards-email"
 echo ""
 echo "Useful commands:"
 echo "  sudo systemctl status flashcards  - Check Django status"
 echo "  sudo systemctl restart flashcards - Restart Django"
 echo "  sudo systemctl restart nginx      - Restart Nginx"
 echo "  sudo journalctl -u flashcards     - View Django logs"
+echo "  sudo journalctl -u flashcards-email - View email worker logs"
 echo ""